@@ -8,12 +8,29 @@ import sys
 import os
 import shutil
 import subprocess
-import time
-import textwrap
+import argparse
 
 from pathlib import Path
 from src.utils import Logger, Colors, TUI
 from src.dotfiles import DotfileManager
+from src.tasks import TaskGraph, STATUS_FAILED, STATUS_SKIPPED, STATUS_CANCELLED
+from src.profile import load_profile, ProfileError
+from src.plan import build_plan
+from src.journal import Journal, journal_path
+from src.pkgcache import DEFAULT_MAX_MB
+from src.cache import resolve_url
+from src.download import SEGMENTS, format_transfer
+from src.core import artifact_cache
+from src.bundle import Bundle, BundleError, build_bundle, ollama_tgz_url, OLLAMA_ARCH, GEMINI_PACKAGES
+from src.plan import ollama_models_dir, ollama_manifest_path
+from src.modelstore import ModelStoreError, format_import, import_models
+from src.ollama import (OllamaClient, OllamaError, ModelFingerprints, READY_TIMEOUT, PULL_WORKERS, PULL_MAX_MBPS,
+                        bare_digest, fingerprints_path, model_fingerprint, normalize_model, parse_modelfile,
+                        plan_pulls, pull_models)
+from src.fleet import FleetRunner, DEFAULT_SSH_CMD, read_hosts, build_payload, render_report, write_report
+
+# Raiz del repo (absoluta: las tareas concurrentes no deben depender del CWD)
+REPO_ROOT = Path(__file__).parent.resolve()
 
 # ==========================================
 # TEXTOS Y TRADUCCIONES DEL MENU (CONFIG)
@@ -86,6 +103,12 @@ MODEL_PARAMS = {
     "phi": ""
 }
 
+# Etapas de instalacion que pueden correr en paralelo (red mayormente ociosa)
+EXECUTION_WORKERS = 3
+
+# Traza de tiempos por etapa (Chrome trace-event JSON)
+TRACE_FILE = "brainbash_trace.json"
+
 # Mapeo de archivos: Origen (repo/config) -> Destino (home)
 DOTFILES_MAP = {
     "zshrc": ".zshrc",
@@ -148,14 +171,69 @@ def get_real_user_info():
         home = pwd.getpwnam(user).pw_dir
         return user, Path(home)
     else:
-        return os.getlogin(), Path.home()
-
-def install_omz(logger, target_user, target_home):
+        # os.getlogin() falla sin terminal de control (CI, contenedores)
+        try:
+            user = os.getlogin()
+        except OSError:
+            import pwd
+            user = pwd.getpwuid(os.getuid()).pw_name
+        return user, Path.home()
+
+def context_path(home):
+    """Contexto compartido que usan los alias -local como system prompt."""
+    return home / ".config" / "brainbash" / "context.md"
+
+def read_system_prompt(home):
+    """System prompt para los Modelfile ("" si no hay contexto). Lanza OSError."""
+    path = context_path(home)
+    if not path.exists():
+        return ""
+    with open(path, "r") as f:
+        # Escapamos comillas triples para no romper el Modelfile
+        return f.read().strip().replace('"""', '\\"\\"\\"')
+
+def render_alias_modelfile(menu_id, system_prompt, template_content):
+    """
+    Modelfile del alias -local a partir de config/Modelfile.
+    "" = sin contexto (copia directa del modelo base); None = falta la plantilla.
+    """
+    if not system_prompt:
+        return ""
+    if template_content is None:
+        return None
+    # Reemplazamos las variables
+    modelfile = template_content.replace("${BASE_MODEL}", MODELS_MAP[menu_id])
+    modelfile = modelfile.replace("${SYSTEM_PROMPT}", system_prompt)
+    # Parametros extra (Ej: Temperatura)
+    return modelfile.replace("${PARAMETERS}", MODEL_PARAMS.get(menu_id, ""))
+
+def read_modelfile_template():
+    template_path = REPO_ROOT / "config" / "Modelfile"
+    return template_path.read_text() if template_path.exists() else None
+
+def python_venv_available():
+    """True si python3 puede crear venvs (en Debian requiere python3-venv)"""
+    return subprocess.run(
+        ["python3", "-c", "import venv, ensurepip"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    ).returncode == 0
+
+def install_omz(logger, target_user, target_home, bundle=None):
     omz_dir = target_home / ".oh-my-zsh"
     if omz_dir.exists():
         logger.info(f"[Skip] Oh My Zsh ya instalado en {omz_dir}")
         return
 
+    if bundle:
+        # Offline: copiamos el arbol del bundle (equivale a --unattended --keep-zshrc)
+        if not bundle.omz_dir:
+            logger.warning("El bundle no incluye Oh My Zsh.")
+            return
+        shutil.copytree(bundle.omz_dir, omz_dir, symlinks=True)
+        logger.tracer.run(["chown", "-R", f"{target_user}:{target_user}", str(omz_dir)], check=False)
+        logger.success("Oh My Zsh instalado OK (bundle).")
+        return
+
     logger.info(f"Descargando Oh My Zsh para {target_user}...")
     
     install_url = "https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh"
@@ -163,7 +241,7 @@ def install_omz(logger, target_user, target_home):
     
     try:
         # 1. Descargar script
-        subprocess.run(["curl", "-fsSL", "-o", str(temp_script), install_url], check=True)
+        logger.tracer.run(["curl", "-fsSL", "-o", str(temp_script), install_url], check=True)
         
         # 2. Dar permisos (chmod +x)
         temp_script.chmod(0o755)
@@ -177,7 +255,7 @@ def install_omz(logger, target_user, target_home):
             f"export HOME={target_home}; sh {temp_script} --unattended --keep-zshrc"
         ]
         
-        subprocess.run(cmd, check=True)
+        logger.tracer.run(cmd, check=True)
         logger.success("Oh My Zsh instalado OK.")
         
     except subprocess.CalledProcessError as e:
@@ -190,7 +268,7 @@ def set_default_shell(logger, target_user):
     """Configura Zsh como shell por defecto y notifica como revertir."""
     try:
         # 1. Detectar path de zsh
-        result = subprocess.run("command -v zsh", shell=True, capture_output=True, text=True)
+        result = logger.tracer.run("command -v zsh", shell=True, capture_output=True, text=True)
         zsh_path = result.stdout.strip()
         
         if not zsh_path:
@@ -206,7 +284,7 @@ def set_default_shell(logger, target_user):
                 # Detectar si somos root para usar sudo o no
                 cmd_prefix = "sudo " if os.geteuid() != 0 else ""
                 cmd_add = f"echo {zsh_path} | {cmd_prefix}tee -a /etc/shells"
-                subprocess.run(cmd_add, shell=True, check=True, stdout=subprocess.DEVNULL)
+                logger.tracer.run(cmd_add, shell=True, check=True, stdout=subprocess.DEVNULL)
         except Exception as e:
             logger.warning(f"No se pudo verificar/editar /etc/shells: {e}")
 
@@ -221,13 +299,13 @@ def set_default_shell(logger, target_user):
             logger.info(f"Cambiando shell por defecto a {zsh_path}...")
             # 3. Intentar cambio (chsh/usermod)
             try:
-                subprocess.run(["sudo", "chsh", "-s", zsh_path, target_user], check=True)
+                logger.tracer.run(["sudo", "chsh", "-s", zsh_path, target_user], check=True)
                 logger.success(f"Shell por defecto cambiado a Zsh para {target_user}.")
             except (subprocess.CalledProcessError, FileNotFoundError):
                 # Fallback: usermod
                 logger.info(f"chsh falló, intentando usermod para {target_user}...")
                 try:
-                    subprocess.run(["sudo", "usermod", "--shell", zsh_path, target_user], check=True)
+                    logger.tracer.run(["sudo", "usermod", "--shell", zsh_path, target_user], check=True)
                     logger.success(f"Shell cambiado con usermod.")
                 except (subprocess.CalledProcessError, FileNotFoundError):
                     logger.error("Fallo el cambio con chsh y usermod.")
@@ -239,13 +317,26 @@ def set_default_shell(logger, target_user):
 # FUNCIONES DE INSTALACION (MODELOS)
 # ==========================================
 
-def setup_ollama(logger, selected_models, target_user, target_home):
-    """Instala Ollama SOLO si hay modelos seleccionados"""
-    if not selected_models: return
+def setup_ollama(logger, selected_models, target_user, target_home, journal=None, bundle=None,
+                 pull_workers=PULL_WORKERS, pull_max_mbps=PULL_MAX_MBPS, pinned_digests=None, models_from=None):
+    """
+    Instala Ollama SOLO si hay modelos seleccionados.
+    Los modelos se descargan en paralelo (pull_workers), con tope opcional de MB/s, y solo
+    si faltan o su digest no coincide con el fijado (pinned_digests) o con el del registro.
+    Con bundle, el motor y los modelos salen del bundle (sin red).
+    Con models_from (directorio o tarball con el layout de ~/.ollama/models) los modelos
+    se importan de ahi antes de bajar nada; solo se bajan los que falten.
+    Retorna False si algo fallo (motor, servidor o algun modelo).
+    """
+    if not selected_models: return True
+    journal = journal or Journal()
+    # API HTTP (OLLAMA_HOST): cada sondeo es un round-trip, no un 'ollama list'
+    client = OllamaClient()
+    log_path = Path("ollama.log")
 
     def ensure_ollama_running():
         # Check simple
-        if subprocess.run("ollama list", shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+        if client.is_ready():
             return True
         
         logger.info("Iniciando servidor Ollama...")
@@ -261,7 +352,7 @@ def setup_ollama(logger, selected_models, target_user, target_home):
             # This prevents permission issues in ~/.ollama
             # We use HOME env var so ollama knows where to write
             # Usamos nohup para que sobreviva a la session actual si es posible
-            cmd = f"sudo -u {target_user} HOME={target_home} nohup ollama serve > ollama.log 2>&1 &"
+            cmd = f"sudo -u {target_user} HOME={target_home} nohup ollama serve > {log_path} 2>&1 &"
 
             # Usamos Popen para no bloquear
             subprocess.Popen(cmd, shell=True, env=env)
@@ -269,14 +360,13 @@ def setup_ollama(logger, selected_models, target_user, target_home):
             logger.error(f"No se pudo iniciar Ollama: {e}")
             return False
 
-        # Wait loop (max 10s)
+        # Sondeo de /api/tags con backoff exponencial (50 ms -> 1 s), maximo READY_TIMEOUT
         logger.info("Esperando servicio...")
-        for _ in range(20):
-            time.sleep(0.5)
-            # Check with env
-            if subprocess.run("ollama list", shell=True, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
-                logger.success("Servidor Ollama iniciado.")
-                return True
+        with logger.span("ollama ready", "probe"):
+            ready = client.wait_ready(deadline=READY_TIMEOUT)
+        if ready:
+            logger.success("Servidor Ollama iniciado.")
+            return True
         
         # Si falló, mostramos las ultimas lineas del log
         if log_path.exists():
@@ -300,102 +390,208 @@ def setup_ollama(logger, selected_models, target_user, target_home):
     is_installed = False
     if ollama_bin.exists():
         is_installed = True
-    elif subprocess.run("command -v ollama", shell=True, stdout=subprocess.DEVNULL).returncode == 0:
+    elif logger.tracer.run("command -v ollama", shell=True, stdout=subprocess.DEVNULL).returncode == 0:
          is_installed = True
 
     if not is_installed:
         logger.step("Instalando Motor Ollama (Requerido para IA local)")
-
-        # 1. Intento OFICIAL (curl | sh) - Petición del usuario
-        installed_ok = False
-        logger.info("Metodo 1: Script oficial (speed preferido)...")
-        try:
-             # Pipe a sh puede retornar 0 si sh corre bien aunque curl falle.
-             # Solucion: set -o pipefail si es bash, o verificar binario despues.
-             cmd = "curl -fsSL https://ollama.com/install.sh | sh"
-             subprocess.run(cmd, shell=True, check=True)
-             
-             # VERIFICACION EXTRA: ¿Realmente se instalo?
-             if subprocess.run("command -v ollama", shell=True, stdout=subprocess.DEVNULL).returncode == 0:
-                 installed_ok = True
-                 logger.success("Ollama instalado via script oficial.")
-             else:
-                 logger.warning("El script oficial corrio pero no se encuentra 'ollama'. Posible fallo de red en curl.")
-
-        except subprocess.CalledProcessError:
-             logger.warning("Fallo script oficial. Intentando metodo 2...")
-
-        # 2. Intento descarga manual directa (Fallback 1)
-        if not installed_ok:
-            try:
-                logger.info("Metodo 2: Descarga manual desde GitHub...")
-                arch = os.uname().machine
-                if arch == "x86_64": arch = "amd64"
-                elif arch in ["aarch64", "arm64"]: arch = "arm64"
-                
-                url = f"https://ollama.com/download/ollama-linux-{arch}.tgz"
+        with logger.span("ollama engine", "install"):
+            # 1. Intento OFICIAL (curl | sh) - Petición del usuario
+            # Con bundle no hay red: vamos directo al tgz (metodo 2, desde el bundle)
+            installed_ok = False
+            if not bundle:
+                logger.info("Metodo 1: Script oficial (speed preferido)...")
+                try:
+                     # Pipe a sh puede retornar 0 si sh corre bien aunque curl falle.
+                     # Solucion: set -o pipefail si es bash, o verificar binario despues.
+                     cmd = "curl -fsSL https://ollama.com/install.sh | sh"
+                     logger.tracer.run(cmd, shell=True, check=True)
+                 
+                     # VERIFICACION EXTRA: ¿Realmente se instalo?
+                     if logger.tracer.run("command -v ollama", shell=True, stdout=subprocess.DEVNULL).returncode == 0:
+                         installed_ok = True
+                         logger.success("Ollama instalado via script oficial.")
+                     else:
+                         logger.warning("El script oficial corrio pero no se encuentra 'ollama'. Posible fallo de red en curl.")
+
+                except subprocess.CalledProcessError:
+                     logger.warning("Fallo script oficial. Intentando metodo 2...")
+
+            # 2. Intento descarga manual directa (Fallback 1)
+            if not installed_ok:
+                try:
+                    logger.info("Metodo 2: Descarga manual desde GitHub...")
+                    machine = os.uname().machine
+                    arch = OLLAMA_ARCH.get(machine, machine)
+                    url = ollama_tgz_url(machine)
                 
-                # Dir temporal
-                import tempfile
-                with tempfile.TemporaryDirectory() as tmpdirname:
-                    tmp_tar = Path(tmpdirname) / "ollama.tgz"
-                    subprocess.run(["curl", "-L", "-o", str(tmp_tar), url], check=True)
-                    subprocess.run(["tar", "-xzf", str(tmp_tar), "-C", tmpdirname], check=True)
+                    # Dir temporal
+                    import tempfile
+                    with tempfile.TemporaryDirectory() as tmpdirname:
+                        # El enlace no tiene version: la release real sale de la redireccion
+                        # (offline no se resuelve: el cache del bundle usa la copia de esa URL)
+                        # La descarga se reanuda si se corta y se verifica contra el
+                        # sha256sum.txt publicado en la release antes de extraer
+                        version = "" if bundle else resolve_url(url)
+                        # Es la descarga mas grande: varias conexiones en paralelo (Range)
+                        tmp_tar = artifact_cache().fetch(url, version=version, arch=arch,
+                                                         checksum_url=version or None, segments=SEGMENTS)
+                        transfer = artifact_cache().last_transfer(url)
+                        if transfer:
+                            logger.info(f"Ollama descargado: {format_transfer(transfer)}")
+                        logger.tracer.run(["tar", "-xzf", str(tmp_tar), "-C", tmpdirname], check=True)
                     
-                    # Mover binario
-                    binary_src = Path(tmpdirname) / "bin" / "ollama" 
-                    if not binary_src.exists():
-                         binary_src = Path(tmpdirname) / "ollama"
+                        # Mover binario
+                        binary_src = Path(tmpdirname) / "bin" / "ollama" 
+                        if not binary_src.exists():
+                             binary_src = Path(tmpdirname) / "ollama"
                     
-                    if binary_src.exists():
-                        user_bin.mkdir(parents=True, exist_ok=True)
-                        target = user_bin / "ollama"
-                        shutil.copy2(binary_src, target)
-                        target.chmod(0o755)
-                        logger.success(f"Ollama instalado en {target}")
-                        installed_ok = True
-                    else:
-                        logger.warning("No se encontro binario en el tgz.")
-
-            except Exception as e:
-                logger.error(f"Fallo descarga manual: {e}")
+                        if binary_src.exists():
+                            user_bin.mkdir(parents=True, exist_ok=True)
+                            target = user_bin / "ollama"
+                            shutil.copy2(binary_src, target)
+                            target.chmod(0o755)
+                            logger.success(f"Ollama instalado en {target}")
+                            installed_ok = True
+                        else:
+                            logger.warning("No se encontro binario en el tgz.")
+
+                except Exception as e:
+                    logger.error(f"Fallo descarga manual: {e}")
         
-        # 3. Intento Script Local (Fallback 2 - Ultimo recurso)
-        if not installed_ok:
-             logger.info("Metodo 3: Script local de emergencia...")
-             try:
-                local_script = Path(__file__).parent / "src" / "scripts" / "install_ollama.sh"
-                if local_script.exists():
-                    subprocess.run(f"sh {local_script}", shell=True, check=True)
-                else:
-                    logger.error("No se encontro script local. Instalacion fallida.")
-                    return
-             except subprocess.CalledProcessError:
-                logger.error("Fallo la instalacion de Ollama (Todos los metodos).")
-                return
+            if not installed_ok and bundle:
+                logger.error("El bundle no tiene el motor Ollama para esta arquitectura.")
+                return False
+
+            # 3. Intento Script Local (Fallback 2 - Ultimo recurso)
+            if not installed_ok:
+                 logger.info("Metodo 3: Script local de emergencia...")
+                 try:
+                    local_script = REPO_ROOT / "src" / "scripts" / "install_ollama.sh"
+                    if local_script.exists():
+                        logger.tracer.run(f"sh {local_script}", shell=True, check=True)
+                    else:
+                        logger.error("No se encontro script local. Instalacion fallida.")
+                        return False
+                 except subprocess.CalledProcessError:
+                    logger.error("Fallo la instalacion de Ollama (Todos los metodos).")
+                    return False
 
     if not ensure_ollama_running():
          logger.error("No se pudo conectar a Ollama. Ejecuta 'ollama serve' manualmente.")
-         return
+         return False
 
     # 2. Leer contexto compartido
-    context_path = target_home / ".config" / "brainbash" / "context.md"
     system_prompt = ""
-    if context_path.exists():
+    if context_path(target_home).exists():
         try:
-            with open(context_path, "r") as f:
-                # Escapamos comillas triples para no romper el Modelfile
-                system_prompt = f.read().strip().replace('"""', '\\"\\"\\"')
-                logger.info("Contexto compartido cargado.")
+            system_prompt = read_system_prompt(target_home)
+            logger.info("Contexto compartido cargado.")
         except Exception as e:
             logger.error(f"Error leyendo contexto: {e}")
     else:
-        logger.warning(f"No se encontro contexto en {context_path}")
+        logger.warning(f"No se encontro contexto en {context_path(target_home)}")
+
+    # 2.5 Modelos incluidos en el bundle: se copian al store (el servidor los ve al listar)
+    if bundle:
+        models_dir = ollama_models_dir(target_home)
+        seeded = bundle.seed_models(models_dir)
+        if seeded:
+            logger.tracer.run(["chown", "-R", f"{target_user}:{target_user}", str(models_dir)], check=False)
+            logger.info(f"{len(seeded)} archivos de modelos copiados desde el bundle.")
+
+    # 2.6 Store local (--models-from): reflink/hardlink en el mismo disco, blobs verificados
+    if models_from:
+        wanted = [MODELS_MAP[m] for m in selected_models
+                  if m in MODELS_MAP and not journal.is_done(f"ollama.pull:{MODELS_MAP[m]}")]
+        try:
+            with logger.span("ollama import", "install", source=str(models_from)):
+                imported, importer = import_models(models_from, ollama_models_dir(target_home), wanted,
+                                                   log=logger.info)
+        except ModelStoreError as e:
+            logger.warning(f"No se pudieron importar modelos: {e}")
+        else:
+            if importer.created:
+                logger.tracer.run(["chown", f"{target_user}:{target_user}"] + [str(p) for p in importer.created],
+                                  check=False)
+            for tag, result in imported.items():
+                if result["status"] in ("missing", "invalid"):
+                    logger.warning(f"{tag}: no se importo ({result['error']}), se descargara.")
+            logger.info(f"Importacion de modelos: {format_import(importer)}")
+
+    # Una sola consulta de inventario por corrida: digests de las bases y de los alias ya creados
+    try:
+        inventory = client.digests()
+    except OllamaError as e:
+        logger.warning(f"No se pudo leer el inventario de Ollama: {e}")
+        inventory = {}
+
+    # 3. Descargar modelos base: todos a la vez via /api/pull (hasta pull_workers),
+    #    con avance en el log. El journal evita re-bajar GBs tras un corte.
+    all_ok = True
+    failed = set()
+    to_pull = []
+    for menu_id in selected_models:
+        tag_original = MODELS_MAP.get(menu_id)
+        if not tag_original:
+            continue
+        if journal.is_done(f"ollama.pull:{tag_original}"):
+            logger.info(f"[Resume] Base ya descargada: {tag_original}")
+        elif bundle:
+            # Sin red: el modelo tiene que haber venido en el bundle
+            if ollama_manifest_path(target_home, tag_original).exists():
+                journal.mark_done(f"ollama.pull:{tag_original}")
+            else:
+                logger.error(f"{tag_original} no esta en el bundle (crealo con 'bundle --models').")
+                failed.add(tag_original)
+        else:
+            to_pull.append(tag_original)
+
+    # Cada 'ollama pull' cuesta un round-trip al registro aunque el modelo este al dia:
+    # se compara el inventario con los digests fijados (sin red) o con los del registro
+    pull_plan = {}
+    pulls = {}
+    if to_pull:
+        with logger.span("ollama digests", "probe", models=to_pull):
+            pull_plan = plan_pulls(to_pull, inventory, pinned_digests, workers=pull_workers)
+        for tag in to_pull:
+            if not pull_plan[tag]["pull"]:
+                logger.info(f"[Skip] {tag}: {pull_plan[tag]['reason']}")
+                journal.mark_done(f"ollama.pull:{tag}")
+            elif pull_plan[tag]["local"]:
+                logger.info(f"{tag}: {pull_plan[tag]['reason']}")
+        to_pull = [tag for tag in to_pull if pull_plan[tag]["pull"]]
+
+    if to_pull:
+        cap = f", tope {pull_max_mbps:g} MB/s" if pull_max_mbps else ""
+        logger.info(f"Descargando {', '.join(to_pull)} ({pull_workers} en paralelo{cap})...")
+        with logger.span("ollama pull", "download", models=to_pull):
+            pulls = pull_models(client, to_pull, pull_workers, pull_max_mbps * 1024 * 1024, log=logger.info)
+        for tag, result in pulls.items():
+            if result["ok"]:
+                journal.mark_done(f"ollama.pull:{tag}")
+                logger.success(f"{tag}: {result['bytes'] / (1024 * 1024):.1f} MB en {result['seconds']:.1f} s "
+                               f"({result['rate'] / (1024 * 1024):.1f} MB/s)")
+            else:
+                logger.error(f"Fallo la descarga de {tag}: {result['error']}")
+                failed.add(tag)
+
+    # Solo si se bajo algo cambian los digests de las bases
+    if any(result["ok"] for result in pulls.values()):
+        try:
+            inventory = client.digests()
+        except OllamaError as e:
+            logger.warning(f"No se pudo releer el inventario de Ollama: {e}")
+        pulled = {normalize_model(tag) for tag, result in pulls.items() if result["ok"]}
+        for tag, pin in (pinned_digests or {}).items():
+            got = inventory.get(normalize_model(tag))
+            if normalize_model(tag) in pulled and got and got != bare_digest(pin):
+                logger.warning(f"{tag}: el registro sirvio {got[:12]}, distinto del digest fijado {bare_digest(pin)[:12]}.")
+
+    # 4. Crear alias con contexto y wrappers
+    fingerprints = ModelFingerprints(fingerprints_path(target_home), owner=target_user)
+    template_content = read_modelfile_template()
 
-    # 3. Descargar Modelos y crear alias
-    logger.info("Verificando servicio IA...")
-    time.sleep(2)
-    
     for menu_id in selected_models:
         tag_original = MODELS_MAP.get(menu_id) # qwen3:0.6b
         
@@ -404,92 +600,96 @@ def setup_ollama(logger, selected_models, target_user, target_home):
         
         if tag_original:
             logger.step(f"IA Local: Configurando {tag_alias}")
-            try:
-                # 1. Pull del original
-                logger.info(f"Descargando base: {tag_original}...")
-                subprocess.run(f"ollama pull {tag_original}", shell=True, check=True)
+            with logger.span(tag_original, "model"):
+                try:
+                    # 1. Sin el modelo base no hay nada que crear
+                    if tag_original in failed:
+                        all_ok = False
+                        continue
                 
-                # 2. Crear Modelfile usando la plantilla
-                if system_prompt:
-                    logger.info(f"Creando {tag_alias} con contexto...")
-                    
-                    template_path = Path(__file__).parent / "config" / "Modelfile"
-                    if not template_path.exists():
-                         logger.error("No se encontro config/Modelfile")
-                         continue
-
-                    with open(template_path, "r") as f:
-                        template_content = f.read()
-                    
-                    # Reemplazamos las variables
-                    final_modelfile = template_content.replace("${BASE_MODEL}", tag_original)
-                    final_modelfile = final_modelfile.replace("${SYSTEM_PROMPT}", system_prompt)
-                    
-                    # Parametros extra (Ej: Temperatura)
-                    params = MODEL_PARAMS.get(menu_id, "")
-                    final_modelfile = final_modelfile.replace("${PARAMETERS}", params)
-
-                    # Escribimos el archivo final temporalmente
-                    modelfile_path = "Modelfile.gen"
-                    try:
-                        with open(modelfile_path, "w", encoding="utf-8") as f:
-                            f.write(final_modelfile)
-                        
-                        subprocess.run(
-                            ["ollama", "create", tag_alias, "-f", modelfile_path],
-                            check=True
-                        )
-                    finally:
-                         if os.path.exists(modelfile_path):
-                            os.remove(modelfile_path)
-                else:
-                    # Fallback al viejo "cp" si no hay contexto
-                    logger.info(f"Creando alias (sin contexto): {tag_alias}...")
-                    subprocess.run(f"ollama cp {tag_original} {tag_alias}", shell=True, check=True)
+                    # 2. Alias: Modelfile desde la plantilla (o copia directa si no hay contexto).
+                    #    Se salta si la huella (digest base + prompt + parametros) no cambio.
+                    final_modelfile = render_alias_modelfile(menu_id, system_prompt, template_content)
+                    if final_modelfile is None:
+                        logger.error("No se encontro config/Modelfile")
+                        all_ok = False
+                        continue
+
+                    fingerprint = model_fingerprint(inventory.get(normalize_model(tag_original), ""), final_modelfile)
+                    bin_dir = target_home / ".local" / "bin"
+                    wrapper_path = bin_dir / menu_id
+                    if journal.is_done(f"ollama.model:{menu_id}", fingerprint) and wrapper_path.exists():
+                        logger.info(f"[Resume] {tag_alias} ya configurado.")
+                        continue
+                    if fingerprints.matches(tag_alias, fingerprint, inventory.get(normalize_model(tag_alias))):
+                        logger.info(f"[Skip] {tag_alias} ya creado con la misma base, contexto y parametros.")
+                    else:
+                        if system_prompt:
+                            logger.info(f"Creando {tag_alias} con contexto...")
+                            # Por la API: sin Modelfile.gen en el CWD que pisen corridas concurrentes
+                            client.create(tag_alias, parse_modelfile(final_modelfile))
+                        else:
+                            # Fallback al viejo "cp" si no hay contexto
+                            logger.info(f"Creando alias (sin contexto): {tag_alias}...")
+                            client.copy(tag_original, tag_alias)
+                        created = client.digests().get(normalize_model(tag_alias), "")
+                        fingerprints.record(tag_alias, fingerprint, created)
                 
-                # 3. Crear wrapper (script ejecutable)
-                bin_dir = target_home / ".local" / "bin"
-                bin_dir.mkdir(parents=True, exist_ok=True)
+                    # 3. Crear wrapper (script ejecutable)
+                    bin_dir.mkdir(parents=True, exist_ok=True)
                 
-                subprocess.run(["chown", "-R", f"{target_user}:{target_user}", str(bin_dir)], check=False)
+                    logger.tracer.run(["chown", "-R", f"{target_user}:{target_user}", str(bin_dir)], check=False)
                 
-                wrapper_path = bin_dir / menu_id
-                logger.info(f"Creando comando: {menu_id}...")
+                    logger.info(f"Creando comando: {menu_id}...")
                 
-                with open(wrapper_path, "w") as f:
-                    # $@ pasa todos los argumentos al comando ollama
-                    f.write(f'#!/bin/sh\nexec ollama run {tag_alias} "$@"\n')
+                    with open(wrapper_path, "w") as f:
+                        # $@ pasa todos los argumentos al comando ollama
+                        f.write(f'#!/bin/sh\nexec ollama run {tag_alias} "$@"\n')
                 
-                # Hacer ejecutable (+x)
-                wrapper_path.chmod(0o755)
-                # Fix ownership
-                subprocess.run(["chown", f"{target_user}:{target_user}", str(wrapper_path)], check=False)
+                    # Hacer ejecutable (+x)
+                    wrapper_path.chmod(0o755)
+                    # Fix ownership
+                    logger.tracer.run(["chown", f"{target_user}:{target_user}", str(wrapper_path)], check=False)
+
+                    journal.mark_done(f"ollama.model:{menu_id}", fingerprint)
+
+                except (subprocess.CalledProcessError, OllamaError) as e:
+                    logger.error(f"Fallo al configurar {tag_alias}: {e}")
+                    all_ok = False
 
-            except subprocess.CalledProcessError as e:
-                logger.error(f"Fallo al configurar {tag_alias}: {e}")
+    return all_ok
 
-def setup_gemini(logger, tui, real_user, real_home, api_key=None):
-    """Configura Gemini usando el script src/gemini_tool.py"""
+def ask_gemini_key():
+    """Pide la API Key de Gemini por consola. Retorna "" si el usuario la salta."""
+    print("\n--- Configuracion de API Key ---")
+    print("Si tienes una API Key de Google Gemini, ingrésala ahora.")
+    print("Si no, presiona Enter para configurar después.")
+
+    # Intentar restaurar terminal antes de input
+    try:
+        subprocess.run(["stty", "sane"], check=False)
+    except: pass
+
+    try:
+        return input("API Key > ").strip()
+    except EOFError:
+        print("\n[Warn] No se detecto entrada interactiva. Saltando.")
+        return ""
+    except Exception:
+        return ""
+
+def setup_gemini(logger, tui, real_user, real_home, api_key=None, journal=None, bundle=None):
+    """
+    Configura Gemini usando el script src/gemini_tool.py.
+    Con bundle, las dependencias se instalan desde sus wheels (sin PyPI).
+    Retorna False si fallo algun paso.
+    """
     logger.step("Configurando Gemini (Google AI)")
+    journal = journal or Journal()
     
-    # 0. Preguntar por API Key
-    if not api_key:
-        print("\n--- Configuracion de API Key ---")
-        print("Si tienes una API Key de Google Gemini, ingrésala ahora.")
-        print("Si no, presiona Enter para configurar después.")
-        
-        # Intentar restaurar terminal antes de input
-        try:
-            subprocess.run(["stty", "sane"], check=False)
-        except: pass
-
-        try:
-            api_key = input("API Key > ").strip()
-        except EOFError:
-            print("\n[Warn] No se detecto entrada interactiva. Saltando.")
-            api_key = ""
-        except Exception:
-             api_key = ""
+    # 0. Preguntar por API Key (None = nadie la pidio todavia)
+    if api_key is None:
+        api_key = ask_gemini_key()
     
     if api_key:
         secrets_path = real_home / ".brainbash_secrets"
@@ -499,7 +699,7 @@ def setup_gemini(logger, tui, real_user, real_home, api_key=None):
             with os.fdopen(fd, "w") as f:
                 f.write(f"export GEMINI_API_KEY='{api_key}'\n")
             
-            subprocess.run(["chown", f"{real_user}:{real_user}", str(secrets_path)], check=False)
+            logger.tracer.run(["chown", f"{real_user}:{real_user}", str(secrets_path)], check=False)
             logger.success(f"API Key guardada en {secrets_path}")
         except Exception as e:
             print(f"[Error] No se pudo guardar la Key: {e}")
@@ -507,7 +707,7 @@ def setup_gemini(logger, tui, real_user, real_home, api_key=None):
         print("[INFO] Saltando configuración de Key. Recuerda agregarla manualmente luego en ~/.brainbash_secrets")
     
     # 1. Definir rutas
-    source_script = Path(__file__).parent / "src" / "gemini_tool.py"
+    source_script = REPO_ROOT / "src" / "gemini_tool.py"
     
     # Destinos
     venv_path = real_home / ".gemini-cli" / "venv" 
@@ -516,34 +716,47 @@ def setup_gemini(logger, tui, real_user, real_home, api_key=None):
     
     # Asegurar directorios
     bin_dir.mkdir(parents=True, exist_ok=True)
-    subprocess.run(["chown", "-R", f"{real_user}:{real_user}", str(bin_dir)], check=False)
+    logger.tracer.run(["chown", "-R", f"{real_user}:{real_user}", str(bin_dir)], check=False)
     
     if not source_script.exists():
         logger.error(f"No se encontro el archivo fuente: {source_script}")
-        return
+        return False
 
     # 2. Crear Venv (si falta)
     if not venv_path.exists():
         logger.info("Creando entorno virtual...")
         try:
-            subprocess.run(["python3", "-m", "venv", str(venv_path)], check=True)
-            subprocess.run(["chown", "-R", f"{real_user}:{real_user}", str(venv_path)], check=False)
+            logger.tracer.run(["python3", "-m", "venv", str(venv_path)], check=True)
+            logger.tracer.run(["chown", "-R", f"{real_user}:{real_user}", str(venv_path)], check=False)
         except Exception as e:
             logger.error(f"Error creando venv: {e}")
-            return
+            return False
     
     # 3. Instalar librerias
     logger.info("Instalando dependencias...")
     pip_bin = venv_path / "bin" / "pip"
     python_bin = venv_path / "bin" / "python3"
     
-    try:
-        # Actualizar pip primero para evitar warnings
-        subprocess.run([str(pip_bin), "install", "-q", "--upgrade", "pip"], check=True)
-        subprocess.run([str(pip_bin), "install", "-q", "google-genai"], check=True)
-    except:
-        logger.error("Fallo pip install.")
-        return
+    pip_inputs = {"venv": str(venv_path), "packages": GEMINI_PACKAGES}
+    if journal.is_done("gemini.pip", pip_inputs) and pip_bin.exists():
+        logger.info("[Resume] Dependencias ya instaladas.")
+    else:
+        try:
+            with logger.span("gemini pip", "install"):
+                if bundle:
+                    if not bundle.wheels_dir:
+                        logger.error("El bundle no incluye las wheels de google-genai.")
+                        return False
+                    logger.tracer.run([str(pip_bin), "install", "-q", "--no-index", "--find-links",
+                                       str(bundle.wheels_dir), "--upgrade"] + GEMINI_PACKAGES, check=True)
+                else:
+                    # Actualizar pip primero para evitar warnings
+                    logger.tracer.run([str(pip_bin), "install", "-q", "--upgrade", "pip"], check=True)
+                    logger.tracer.run([str(pip_bin), "install", "-q", "google-genai"], check=True)
+            journal.mark_done("gemini.pip", pip_inputs)
+        except:
+            logger.error("Fallo pip install.")
+            return False
     
     # 4. Instalar el script con el Shebang Magico
     logger.info("Instalando script ejecutable...")
@@ -563,31 +776,138 @@ def setup_gemini(logger, tui, real_user, real_home, api_key=None):
         # Hacemos ejecutable
         dest_script.chmod(0o755)
         
-        subprocess.run(["chown", "-R", f"{real_user}:{real_user}", str(venv_path)], check=False)
-        subprocess.run(["chown", f"{real_user}:{real_user}", str(dest_script)], check=False)
+        logger.tracer.run(["chown", "-R", f"{real_user}:{real_user}", str(venv_path)], check=False)
+        logger.tracer.run(["chown", f"{real_user}:{real_user}", str(dest_script)], check=False)
         
         logger.success("Gemini instalado correctamente.")
+        ok = True
         
     except Exception as e:
         logger.error(f"Error al instalar script: {e}")
+        ok = False
         
-    try: subprocess.run(["stty", "sane"], check=False)
-    except: pass
+    # Sin TUI (modo desatendido) no hay terminal que restaurar
+    if tui:
+        try: logger.tracer.run(["stty", "sane"], check=False)
+        except: pass
+
+    return ok
 
 # ==========================================
 # MAIN LOOP
 # ==========================================
 
-def main():
-    manager = get_manager()
-    tui = TUI()
-    logger = Logger(Colors.GREEN, log_file="installation_log.log")
-    
-    # Inject logger into manager (for core logging)
-    manager.set_logger(logger)
-
-    # ESTADO INICIAL
-    state = {
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Instalador BrainBash")
+    parser.add_argument("--profile", metavar="ARCHIVO",
+                        help="Perfil JSON para instalacion desatendida (sin menu ni preguntas)")
+    parser.add_argument("--plan", action="store_true",
+                        help="Muestra que etapas faltan en este host y sale sin instalar nada")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continua una instalacion interrumpida desde el primer paso incompleto")
+    parser.add_argument("--from-bundle", metavar="BUNDLE",
+                        help="Instala sin red desde un bundle (ver 'main.py bundle'); solo el gestor de paquetes usa la red")
+    parser.add_argument("--models-from", metavar="ORIGEN", default=os.environ.get("BRAINBASH_MODELS_FROM"),
+                        help="Importa los modelos desde un directorio o tarball con el layout de ~/.ollama/models "
+                             "(o BRAINBASH_MODELS_FROM); solo se descarga lo que falte")
+
+    parser.add_argument("--pkg-cache", metavar="DIR", default=os.environ.get("BRAINBASH_PKG_CACHE"),
+                        help="Directorio compartido para los .deb/.rpm/.apk descargados (o BRAINBASH_PKG_CACHE)")
+    parser.add_argument("--pkg-cache-max-mb", type=int, default=DEFAULT_MAX_MB,
+                        help="Tamaño maximo del cache de paquetes en MB (default: %(default)s)")
+
+    commands = parser.add_subparsers(dest="command", metavar="{cache,bundle}")
+    cache = commands.add_parser("cache", help="Administra el cache de artefactos descargados")
+    cache.add_argument("action", choices=["stats", "prune"])
+    cache.add_argument("--max-mb", type=int,
+                       help="prune: tamaño objetivo en MB (default: el limite configurado; 0 vacia el cache)")
+    bundle = commands.add_parser("bundle", help="Empaqueta todo lo que necesita una seleccion para instalar sin red")
+    bundle.add_argument("-o", "--output", required=True, metavar="ARCHIVO", help="Bundle a generar (.tar)")
+    bundle.add_argument("--profile", dest="bundle_profile", metavar="ARCHIVO",
+                        help="Perfil con la seleccion (default: --profile o la seleccion por defecto del menu)")
+    bundle.add_argument("--arch", action="append", metavar="ARCH",
+                        help="Arquitectura destino, repetible (default: la de esta maquina)")
+    bundle.add_argument("--models", action="store_true",
+                        help="Incluye los modelos de Ollama seleccionados (deben estar descargados aqui)")
+
+    fleet = parser.add_argument_group("flota (varios hosts por SSH)")
+    fleet.add_argument("--hosts", metavar="ARCHIVO",
+                       help="Lista de hosts (uno por linea). Requiere --profile")
+    fleet.add_argument("--concurrency", type=int, default=4,
+                       help="Hosts en paralelo (default: 4)")
+    fleet.add_argument("--ssh-cmd", default=DEFAULT_SSH_CMD,
+                       help="Comando para llegar a cada host, con {host} (default: '%(default)s')")
+    fleet.add_argument("--report", metavar="ARCHIVO",
+                       help="Guarda el reporte de la flota en JSON")
+    return parser.parse_args(argv)
+
+def run_unattended(profile_path, manager, logger, show_plan_only=False, resume=False, bundle=None, models_from=None):
+    """Modo desatendido: perfil -> state -> run_execution_phase, sin TTY."""
+    try:
+        state = load_profile(profile_path, MENU_BASE, MENU_EXTRA, MENU_MODELS)
+    except ProfileError as e:
+        logger.error(f"Perfil invalido: {e}")
+        sys.exit(2)
+
+    logger.info(f"Perfil cargado: {profile_path}")
+    if show_plan_only:
+        print_plan(state, manager)
+        return
+    results = run_execution_phase(state, manager, logger, None, resume=resume, bundle=bundle,
+                                  models_from=models_from)
+    sys.exit(1 if STATUS_FAILED in results.values() else 0)
+
+def run_fleet(args):
+    """Fan-out: sube el repo a cada host y corre el perfil con concurrencia limitada."""
+    if not args.profile:
+        print("[Error] --hosts requiere --profile.")
+        sys.exit(2)
+    try:
+        # Validamos la estructura del perfil localmente antes de tocar ningun host;
+        # la API Key (env:/file:) se resuelve en cada host remoto
+        load_profile(args.profile, MENU_BASE, MENU_EXTRA, MENU_MODELS, resolve_keys=False)
+        hosts = read_hosts(args.hosts)
+    except (ProfileError, OSError) as e:
+        print(f"[Error] {e}")
+        sys.exit(2)
+    if not hosts:
+        print("[Error] La lista de hosts esta vacia.")
+        sys.exit(2)
+
+    extra_args = ["--resume"] if args.resume else []
+    if args.pkg_cache:
+        # La ruta se interpreta en cada host remoto
+        extra_args += ["--pkg-cache", args.pkg_cache, "--pkg-cache-max-mb", str(args.pkg_cache_max_mb)]
+    if args.models_from:
+        # Idem: un NFS o un tarball ya copiado a cada host
+        extra_args += ["--models-from", args.models_from]
+    try:
+        runner = FleetRunner(hosts, build_payload(REPO_ROOT, args.profile), args.concurrency,
+                             args.ssh_cmd, extra_args)
+    except ValueError as e:
+        print(f"[Error] --ssh-cmd invalido: {e}")
+        sys.exit(2)
+    print(f"=== Flota: {len(hosts)} hosts, concurrencia {args.concurrency} ===")
+    results = runner.run()
+
+    print("\n=== REPORTE DE FLOTA ===")
+    print(render_report(results))
+    if args.report:
+        write_report(results, args.report)
+        print(f"Reporte guardado en {args.report}")
+    sys.exit(0 if all(r["exit"] == 0 for r in results) else 1)
+
+def run_cache_command(args):
+    """'main.py cache stats|prune': inspecciona o recorta el cache de artefactos."""
+    cache = artifact_cache()
+    if args.action == "prune":
+        removed, freed = cache.prune(args.max_mb)
+        print(f"Borrados {removed} objetos ({freed / (1024 * 1024):.1f} MB).")
+    print(cache.render_stats())
+
+def default_state():
+    """Seleccion inicial del menu (tambien la del bundle sin perfil)."""
+    return {
         "update_sys": False, # Por defecto NO actualiza
         "pkgs_base": [x[0] for x in MENU_BASE],  # Por defecto todos ON
         "pkgs_extra": [x[0] for x in MENU_EXTRA], # Por defecto todos ON
@@ -596,6 +916,98 @@ def main():
         "dotfiles": True    # Dotfiles SI por defecto
     }
 
+def run_bundle_command(args):
+    """'main.py bundle -o ARCHIVO': resuelve la seleccion y la empaqueta para instalar sin red."""
+    profile_path = args.bundle_profile or args.profile
+    try:
+        state = load_profile(profile_path, MENU_BASE, MENU_EXTRA, MENU_MODELS) if profile_path else default_state()
+    except ProfileError as e:
+        print(f"[Error] Perfil invalido: {e}")
+        sys.exit(2)
+
+    _, real_home = get_real_user_info()
+    try:
+        manifest = build_bundle(args.output, state, MODELS_MAP, real_home, arches=args.arch,
+                                include_models=args.models)
+    except (BundleError, subprocess.CalledProcessError, OSError) as e:
+        print(f"[Error] No se pudo generar el bundle: {e}")
+        sys.exit(1)
+    size = Path(args.output).stat().st_size / (1024 * 1024)
+    print(f"Bundle {args.output} ({size:.1f} MB): {', '.join(manifest['arches'])}; "
+          f"binarios: {', '.join(manifest['tools']) or '-'}; modelos: {', '.join(manifest['models']) or '-'}")
+
+def alias_modelfiles(state, real_home):
+    """{menu_id: Modelfile del alias -local}: el plan compara su huella con la guardada."""
+    try:
+        system_prompt = read_system_prompt(real_home)
+    except OSError:
+        system_prompt = ""
+    template_content = read_modelfile_template()
+    return {m: render_alias_modelfile(m, system_prompt, template_content) for m in state["models"] if m in MODELS_MAP}
+
+def make_plan(state, manager, real_user, real_home):
+    return build_plan(state, manager, real_user, real_home, REPO_ROOT, DOTFILES_MAP, MODELS_MAP,
+                      alias_modelfiles(state, real_home))
+
+def print_plan(state, manager):
+    """--plan: muestra lo que haria la instalacion, sin tocar nada."""
+    real_user, real_home = get_real_user_info()
+    plan = make_plan(state, manager, real_user, real_home)
+    print(f"\n=== PLAN ({real_user}: {real_home}) ===")
+    print(plan.render())
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "cache":
+        run_cache_command(args)
+        return
+    if args.command == "bundle":
+        run_bundle_command(args)
+        return
+
+    # La flota corre desde la maquina de control: no instala nada localmente
+    if args.hosts:
+        run_fleet(args)
+        return
+
+    manager = get_manager()
+    logger = Logger(Colors.GREEN, log_file="installation_log.log")
+    
+    # Inject logger into manager (for core logging)
+    manager.set_logger(logger)
+    if args.pkg_cache:
+        manager.set_pkg_cache(args.pkg_cache, args.pkg_cache_max_mb)
+
+    bundle = None
+    if args.from_bundle:
+        try:
+            bundle = Bundle.open(args.from_bundle)
+        except BundleError as e:
+            logger.error(str(e))
+            sys.exit(2)
+        bundle.activate()
+        manager.offline = True
+        logger.info(f"Modo offline: usando el bundle {args.from_bundle}")
+
+    try:
+        run_install(args, manager, logger, bundle)
+    finally:
+        if bundle:
+            bundle.close()
+
+def run_install(args, manager, logger, bundle=None):
+    """Perfil (desatendido) o menu TUI, y despues la ejecucion."""
+    if args.profile:
+        run_unattended(args.profile, manager, logger, show_plan_only=args.plan, resume=args.resume, bundle=bundle,
+                       models_from=args.models_from)
+        return
+
+    tui = TUI()
+
+    # ESTADO INICIAL
+    state = default_state()
+
     while True:
         # Calcular textos para el menu principal
         c_base = len(state["pkgs_base"])
@@ -686,17 +1098,30 @@ def main():
     # EJECUCION
     # ==========================================
     
+    if args.plan:
+        print_plan(state, manager)
+        return
+
     # Delegamos al runner
-    run_execution_phase(state, manager, logger, tui)
+    run_execution_phase(state, manager, logger, tui, resume=args.resume, bundle=bundle, models_from=args.models_from)
 
 # ==========================================
 # LOGICA PRINCIPAL DE EJECUCION
 # ==========================================
 
-def run_execution_phase(state, manager, logger, tui):
+def run_execution_phase(state, manager, logger, tui, plan=None, resume=False, bundle=None, models_from=None):
     """
     Ejecuta el proceso de instalacion basado en el estado (state).
     Separado de main() para permitir testing automatizado.
+
+    Cada etapa declara sus dependencias y las independientes corren
+    en paralelo (ver src/tasks.py). Solo se lanzan las etapas con
+    acciones pendientes en el plan (ver src/plan.py).
+    Los pasos completados quedan en el journal; con resume=True se
+    continua desde el primer paso incompleto (ver src/journal.py).
+    Con bundle (--from-bundle) todo sale del bundle salvo los paquetes
+    del gestor de la distro (ver src/bundle.py).
+    Con models_from (--models-from) los modelos se importan de un store local (ver src/modelstore.py).
     """
     logger.step("INICIANDO DESPLIEGUE")
     
@@ -704,50 +1129,166 @@ def run_execution_phase(state, manager, logger, tui):
     real_user, real_home = get_real_user_info()
     logger.info(f"Usuario destino: {real_user} ({real_home})")
 
-    # 1. Update (Opcional)
-    if state["update_sys"]:
+    if "metadata_ttl" in state:
+        manager.metadata_ttl = state["metadata_ttl"]
+    if "download_workers" in state:
+        manager.download_workers = state["download_workers"]
+    # --pkg-cache tiene prioridad sobre el perfil
+    if "pkg_cache" in state and manager.pkg_cache is None:
+        manager.set_pkg_cache(state["pkg_cache"]["dir"], state["pkg_cache"]["max_mb"])
+    # --models-from tiene prioridad sobre el perfil
+    models_from = models_from or state.get("models_from")
+
+    journal = Journal(journal_path(real_home), resume=resume, owner=real_user)
+    manager.set_journal(journal)
+    if resume:
+        logger.info(f"Reanudando desde el journal: {journal.path}")
+
+    # Plan: sondeamos el host una vez y solo ejecutamos lo que falta
+    if plan is None:
+        plan = make_plan(state, manager, real_user, real_home)
+    logger.info("Plan de ejecucion:\n" + plan.render())
+
+    # La API Key se pide ANTES de lanzar el grafo: input() no puede
+    # competir con la salida de tareas concurrentes.
+    # Pasamos API Key si esta en state (para tests) o la pedimos ahora.
+    api_key = state.get("gemini_api_key")
+    if plan.needs("gemini") and api_key is None:
+        api_key = ask_gemini_key()
+
+    pending_pkgs = plan.todo("packages")
+    pending_models = [m for m in plan.todo("ollama") if m != "motor"]
+
+    # Paquetes nativos que piden las otras etapas: van en la MISMA transaccion
+    # que los paquetes seleccionados (un solo resolver/lock/triggers por gestor)
+    stages = []
+    if "starship" in pending_pkgs and not shutil.which("fc-cache"):
+        stages.append("fonts")
+    if plan.needs("ollama") and not shutil.which("ollama"):
+        stages.append("ollama")
+    if plan.needs("gemini") and not python_venv_available():
+        stages.append("gemini")
+    if plan.needs("shell") and not shutil.which("chsh"):
+        stages.append("shell")
+    stage_natives = manager.stage_packages(stages)
+
+    # --- Definicion de etapas ---
+
+    def step_update():
         manager.update()
 
-    # 2. Paquetes (Base + Extra combinados)
-    all_pkgs = state["pkgs_base"] + state["pkgs_extra"]
-    if all_pkgs:
+    def step_prefetch():
+        manager.prefetch(pending_pkgs, stages)
+
+    def step_packages():
         logger.step("Instalando Paquetes")
-        manager.install(all_pkgs)
+        with logger.span("PackageManager.install", "install", packages=pending_pkgs, stages=stages):
+            manager.install(pending_pkgs, stages)
 
-    # 3. Shell (OMZ) - Se instala si seleccionó Zsh
-    if "zsh" in state["pkgs_base"]:
+    def step_omz():
         logger.step("Configurando Shell")
-        install_omz(logger, real_user, real_home)
+        install_omz(logger, real_user, real_home, bundle)
+
+    def step_shell():
         set_default_shell(logger, real_user)
 
-    # 4. Dotfiles
-    if state["dotfiles"]:
+    def step_dotfiles():
         logger.step("Aplicando Config. Personales")
-        # Asumiendo que main.py esta en la raiz del repo
-        repo_root = Path(__file__).parent.resolve()
-        
         # Usamos real_home para que los dotfiles vayan al usuario, no a root
-        dm = DotfileManager(repo_root, real_home, logger)
-        
-        for src, dest in DOTFILES_MAP.items():
-            dm.link(f"config/{src}", dest)
+        dm = DotfileManager(REPO_ROOT, real_home, logger)
+        for src in plan.todo("dotfiles"):
+            dm.link(f"config/{src}", DOTFILES_MAP[src])
         logger.success("Configs aplicadas.")
 
-    # 5. IA Local (Ollama + Modelos)
-    if state["models"]:
+    def step_ollama():
         logger.step("Configurando IA Local")
-        setup_ollama(logger, state["models"], real_user, real_home)
+        if not setup_ollama(logger, pending_models, real_user, real_home, journal, bundle,
+                            state.get("pull_workers", PULL_WORKERS), state.get("pull_max_mbps", PULL_MAX_MBPS),
+                            state.get("model_digests"), models_from):
+            raise RuntimeError("La configuracion de IA local quedo incompleta.")
+
+    def step_gemini():
+        if not setup_gemini(logger, tui, real_user, real_home, api_key=api_key, journal=journal, bundle=bundle):
+            raise RuntimeError("La configuracion de Gemini quedo incompleta.")
+
+    # --- Grafo de dependencias ---
+    graph = TaskGraph(max_workers=state.get("workers", EXECUTION_WORKERS), logger=logger)
+
+    def deps(*names):
+        # Solo dependemos de etapas que realmente estan en el grafo
+        return [n for n in names if n in graph]
+
+    def add_step(name, func, step_deps=None, inputs=None):
+        # En modo resume, las etapas ya completadas con las mismas entradas se saltan
+        key = f"step:{name}"
+        if resume and journal.is_done(key, inputs):
+            logger.info(f"[Resume] Etapa '{name}' ya completada.")
+            return
+
+        def run_and_record():
+            func()
+            journal.mark_done(key, inputs)
 
-    # 6. IA Nube (Gemini)
-    if state["use_gemini"]:
-        # Pasamos API Key si esta en state (para tests) o None (para prompt interactivo)
-        api_key = state.get("gemini_api_key") 
-        setup_gemini(logger, tui, real_user, real_home, api_key=api_key)
+        graph.add(name, run_and_record, step_deps)
+
+    # 1. Update (Opcional)
+    if plan.needs("update"):
+        add_step("update", step_update)
+
+    # 2. Paquetes (Base + Extra combinados, solo los que faltan + nativos de otras etapas)
+    # La pre-descarga arranca apenas hay indices y se solapa con OMZ, dotfiles y venv;
+    # la instalacion despues usa los archivos ya descargados.
+    if plan.needs("packages") or stage_natives:
+        add_step("packages", step_packages, deps("update") + ["prefetch"], sorted(state["pkgs_base"] + state["pkgs_extra"]))
+        if "packages" in graph:
+            graph.add("prefetch", step_prefetch, deps("update"))
+
+    # 3. Shell (OMZ) - Se instala si seleccionó Zsh
+    # El instalador de OMZ necesita git, curl y zsh; si ya estan no espera a los paquetes.
+    if plan.needs("omz"):
+        omz_needs_pkgs = not (shutil.which("git") and shutil.which("curl") and shutil.which("zsh"))
+        add_step("omz", step_omz, deps("packages") if omz_needs_pkgs else [])
+    if plan.needs("shell"):
+        add_step("shell", step_shell, deps("packages", "omz"))
+
+    # 4. Dotfiles (Solo symlinks, no dependen de nada)
+    if plan.needs("dotfiles"):
+        add_step("dotfiles", step_dotfiles, inputs=DOTFILES_MAP)
+
+    # 5. IA Local (Ollama + Modelos) - Lee context.md linkeado por dotfiles
+    if plan.needs("ollama"):
+        add_step("ollama", step_ollama, deps("packages", "dotfiles"), sorted(state["models"]))
+
+    # 6. IA Nube (Gemini) - El venv solo espera a los paquetes si falta el modulo venv
+    if plan.needs("gemini"):
+        gemini_needs_pkgs = "gemini" in stages
+        add_step("gemini", step_gemini, deps("packages") if gemini_needs_pkgs else [], bool(api_key))
+
+    results = graph.run()
+
+    for name, status in results.items():
+        if status == STATUS_SKIPPED:
+            logger.warning(f"Etapa '{name}' saltada (fallo una dependencia).")
+        elif status == STATUS_CANCELLED:
+            logger.warning(f"Etapa '{name}' cancelada.")
 
     logger.step("FINALIZADO")
+    logger.info("Resumen de tiempos:\n" + logger.tracer.summary())
+    if manager.pkg_cache:
+        logger.info(manager.pkg_cache.report())
+    artifacts = artifact_cache()
+    if artifacts.hits or artifacts.misses:
+        logger.info(f"Cache de artefactos {artifacts.root}: {artifacts.hits} aciertos, {artifacts.misses} descargas")
+    try:
+        logger.tracer.export_chrome(TRACE_FILE)
+        logger.info(f"Traza exportada en {TRACE_FILE} (abrir con chrome://tracing o ui.perfetto.dev)")
+    except OSError as e:
+        logger.warning(f"No se pudo exportar la traza: {e}")
     logger.info("Reinicia tu terminal para ver los cambios.")
     print("\n[TIP] Para revertir tu shell a Bash, ejecuta: chsh -s $(which bash)")
 
+    return results
+
 if __name__ == "__main__":
     try: main()
     except KeyboardInterrupt: sys.exit(0)
@@ -0,0 +1,248 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+from .cache import ArtifactCache, resolve_url
+from .download import SEGMENTS
+from .core import (GITHUB_BINARIES, NERD_FONTS, NERD_FONTS_URL, BAT_THEME_URL,
+                   arch_terms, use_offline_caches)
+from .github import GitHubError, ReleaseCache, asset_sha256, select_asset
+from .plan import ollama_models_dir, ollama_manifest_path
+
+BUNDLE_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+
+# platform.machine() -> nombre de arquitectura en las descargas de Ollama
+OLLAMA_ARCH = {"x86_64": "amd64", "aarch64": "arm64", "arm64": "arm64"}
+
+OMZ_REPO = "https://github.com/ohmyzsh/ohmyzsh.git"
+
+# Paquetes pip del venv de Gemini (ver setup_gemini en main.py)
+GEMINI_PACKAGES = ["pip", "google-genai"]
+
+
+class BundleError(Exception):
+    """Bundle invalido, incompleto o que no sirve para este host."""
+
+
+def ollama_tgz_url(machine: str) -> str:
+    arch = OLLAMA_ARCH.get(machine, machine)
+    return f"https://ollama.com/download/ollama-linux-{arch}.tgz"
+
+
+def _model_files(models_dir: Path, manifest: Path) -> List[Path]:
+    """Manifest + blobs (config y capas) de un modelo de Ollama."""
+    data = json.loads(manifest.read_text())
+    digests = [data["config"]["digest"]] + [layer["digest"] for layer in data.get("layers", [])]
+    return [manifest] + [models_dir / "blobs" / d.replace(":", "-") for d in digests]
+
+
+def build_bundle(output, state: Dict, models_map: Dict[str, str], home: Path,
+                 arches: Optional[List[str]] = None, include_models: bool = False,
+                 log: Callable[[str], None] = print) -> Dict:
+    """
+    Resuelve todo lo que necesita la seleccion 'state' y lo empaqueta en 'output' (.tar):
+    binarios de GitHub por arquitectura (glibc y musl), tgz de Ollama, fuentes, tema de bat,
+    arbol de Oh My Zsh, wheels de google-genai y, opcionalmente, los modelos ya descargados.
+    El bundle reutiliza el formato de los caches (artifacts/ y github/) para que la
+    instalacion lo lea con el mismo codigo, solo que sin red.
+    """
+    arches = arches or [platform.machine()]
+    selection = list(state["pkgs_base"]) + list(state["pkgs_extra"])
+    work = Path(tempfile.mkdtemp(prefix="brainbash-bundle-"))
+    try:
+        artifacts = ArtifactCache(work / "artifacts", max_mb=1024 * 1024)
+        releases = ReleaseCache(work / "github", ttl=0)
+        manifest = {"format": BUNDLE_FORMAT, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "arches": arches, "selection": selection, "tools": [], "models": [],
+                    "omz": False, "wheels": None}
+
+        # 1. Binarios de GitHub (el host destino decide si los usa: ver _resolve_sources)
+        for tool in [t for t in selection if t in GITHUB_BINARIES]:
+            repo, keyword, _, static = GITHUB_BINARIES[tool]
+            try:
+                release = releases.latest(repo, warn=log)
+            except GitHubError as e:
+                raise BundleError(str(e))
+            for arch in arches:
+                for musl in sorted({static, True}):
+                    found = select_asset(release, arch_terms(arch), keyword, musl)
+                    if found:
+                        url, tag = found
+                        log(f"[bundle] {tool} {tag} ({arch}{', musl' if musl else ''})")
+                        artifacts.fetch(url, version=tag, arch=arch, sha256=asset_sha256(release, url))
+            manifest["tools"].append(tool)
+
+        # 2. Fuentes (Starship) y tema de bat
+        if "starship" in selection:
+            for font in NERD_FONTS:
+                artifacts.fetch(f"{NERD_FONTS_URL}/{font.replace(' ', '%20')}")
+        if "bat" in selection:
+            artifacts.fetch(BAT_THEME_URL)
+
+        # 3. Motor Ollama por arquitectura (la version sale de la redireccion)
+        if state["models"]:
+            for arch in arches:
+                url = ollama_tgz_url(arch)
+                log(f"[bundle] Ollama ({OLLAMA_ARCH.get(arch, arch)})")
+                version = resolve_url(url)
+                artifacts.fetch(url, version=version, arch=OLLAMA_ARCH.get(arch, arch), checksum_url=version or None,
+                                segments=SEGMENTS)
+
+        # 4. Oh My Zsh (arbol completo, como lo deja el instalador oficial)
+        if "zsh" in selection:
+            log("[bundle] Oh My Zsh")
+            subprocess.run(["git", "clone", "--depth", "1", "-q", OMZ_REPO, str(work / "omz")], check=True)
+            manifest["omz"] = True
+
+        # 5. Wheels de Gemini (para la plataforma de Python de ESTA maquina)
+        if state["use_gemini"]:
+            log("[bundle] Wheels de google-genai")
+            subprocess.run([sys.executable, "-m", "pip", "download", "-q", "-d", str(work / "wheels")]
+                           + GEMINI_PACKAGES, check=True)
+            manifest["wheels"] = f"{platform.machine()}/py{sys.version_info.major}.{sys.version_info.minor}"
+
+        # 6. Modelos (opcional): los que ya estan descargados en esta maquina
+        if include_models:
+            models_dir = ollama_models_dir(home)
+            for menu_id in state["models"]:
+                tag = models_map[menu_id]
+                local = ollama_manifest_path(home, tag)
+                if not local.exists():
+                    raise BundleError(f"{tag} no esta descargado en esta maquina (ejecuta 'ollama pull {tag}').")
+                log(f"[bundle] Modelo {tag}")
+                for path in _model_files(models_dir, local):
+                    dest = work / "models" / path.relative_to(models_dir)
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy2(path, dest)
+                manifest["models"].append(tag)
+
+        with open(work / MANIFEST_NAME, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Sin compresion: casi todo ya viene comprimido (tgz, gguf)
+        with tarfile.open(output, "w") as tar:
+            for child in sorted(work.iterdir()):
+                tar.add(str(child), arcname=child.name)
+        return manifest
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def _inside(name: str) -> bool:
+    return not name.startswith("/") and ".." not in Path(name).parts
+
+
+def _check_member(member: tarfile.TarInfo, symlinks: Set[str]):
+    """
+    Se extrae como root: ninguna entrada puede escribir fuera del directorio destino.
+    Los enlaces tambien cuentan ('evil -> /etc' seguido de 'evil/x' escaparia), asi
+    que solo se aceptan enlaces relativos que apuntan dentro del bundle (Oh My Zsh trae
+    algunos symlinks), ninguna entrada puede ir "a traves" de un symlink del propio
+    bundle y nada de dispositivos ni fifos.
+    """
+    if not _inside(member.name):
+        raise BundleError(f"Ruta insegura en el bundle: {member.name}")
+    parents = {p.as_posix() for p in Path(member.name).parents}
+    if parents & symlinks:
+        raise BundleError(f"Ruta a traves de un enlace en el bundle: {member.name}")
+    if member.issym():
+        symlinks.add(Path(member.name).as_posix())
+        target = os.path.normpath(os.path.join(os.path.dirname(member.name), member.linkname))
+        if not _inside(target):
+            raise BundleError(f"Enlace inseguro en el bundle: {member.name} -> {member.linkname}")
+    elif member.islnk():
+        if not _inside(os.path.normpath(member.linkname)):
+            raise BundleError(f"Enlace inseguro en el bundle: {member.name} -> {member.linkname}")
+    elif not (member.isfile() or member.isdir()):
+        raise BundleError(f"Entrada no permitida en el bundle: {member.name}")
+
+
+class Bundle:
+    """Bundle abierto (extraido) para instalar sin red: ver build_bundle."""
+
+    def __init__(self, root: Path, manifest: Dict, temporary: bool = False):
+        self.root = root
+        self.manifest = manifest
+        self._temporary = temporary
+
+    @classmethod
+    def open(cls, path) -> "Bundle":
+        path = Path(path)
+        temporary = False
+        if path.is_dir():
+            root = path
+        else:
+            root = Path(tempfile.mkdtemp(prefix="brainbash-bundle-"))
+            temporary = True
+            try:
+                with tarfile.open(path, "r") as tar:
+                    symlinks = set()
+                    for member in tar.getmembers():
+                        _check_member(member, symlinks)
+                    if hasattr(tarfile, "data_filter"):
+                        tar.extractall(str(root), filter="data")
+                    else:
+                        tar.extractall(str(root))
+            except (OSError, tarfile.TarError) as e:
+                shutil.rmtree(root, ignore_errors=True)
+                raise BundleError(f"No se pudo abrir el bundle {path}: {e}")
+            except BundleError:
+                shutil.rmtree(root, ignore_errors=True)
+                raise
+
+        try:
+            with open(root / MANIFEST_NAME, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise BundleError(f"El bundle no tiene un {MANIFEST_NAME} valido: {e}")
+        if manifest.get("format") != BUNDLE_FORMAT:
+            raise BundleError(f"Formato de bundle no soportado: {manifest.get('format')}")
+        machine = platform.machine()
+        if manifest.get("tools") and machine not in manifest.get("arches", []):
+            raise BundleError(f"El bundle es para {', '.join(manifest['arches'])}, este host es {machine}.")
+        return cls(root, manifest, temporary)
+
+    def activate(self):
+        """Descargas de artefactos y metadata de GitHub salen solo del bundle."""
+        use_offline_caches(self.root / "artifacts", self.root / "github")
+
+    @property
+    def omz_dir(self) -> Optional[Path]:
+        return self.root / "omz" if self.manifest.get("omz") else None
+
+    @property
+    def wheels_dir(self) -> Optional[Path]:
+        return self.root / "wheels" if self.manifest.get("wheels") else None
+
+    def has_model(self, tag: str) -> bool:
+        return tag in self.manifest.get("models", [])
+
+    def seed_models(self, models_dir: Path) -> List[Path]:
+        """Copia manifests y blobs del bundle al store de Ollama (solo lo que falta)."""
+        src = self.root / "models"
+        copied = []
+        if not src.exists():
+            return copied
+        for path in sorted(src.rglob("*")):
+            if not path.is_file():
+                continue
+            dest = models_dir / path.relative_to(src)
+            if dest.exists():
+                continue
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(path, dest)
+            copied.append(dest)
+        return copied
+
+    def close(self):
+        if self._temporary:
+            shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,397 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .download import ChecksumError, download, open_resumable, published_sha256, segmented_download
+
+# Tamaño maximo por defecto del cache de artefactos
+DEFAULT_MAX_MB = int(os.environ.get("BRAINBASH_ARTIFACT_CACHE_MAX_MB", 2048))
+
+# Descargas parciales sin tocar por mas de esto se borran en prune()
+PARTIAL_TTL = 7 * 24 * 3600
+
+
+def sha256_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def resolve_url(url: str, timeout: float = 10) -> str:
+    """
+    URL estable tras las redirecciones (HEAD). Para enlaces 'latest' sin version
+    (p.ej. ollama.com/download/...) identifica la release real. "" si no hay red.
+    Se queda con el ultimo salto sin query string: el final suele ser una URL
+    firmada del CDN que cambia en cada consulta.
+    """
+    import urllib.request
+    chain = [url]
+
+    class Recorder(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, req, fp, code, msg, headers, newurl):
+            chain.append(newurl)
+            return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+    try:
+        req = urllib.request.Request(url, method="HEAD", headers={"User-Agent": "python"})
+        with urllib.request.build_opener(Recorder).open(req, timeout=timeout):
+            pass
+    except Exception:
+        return ""
+    stable = [u for u in chain if "?" not in u]
+    return stable[-1] if stable else chain[-1]
+
+
+class HashingTee:
+    """Lector que copia lo leido a 'sink' y calcula el SHA-256 al vuelo."""
+
+    def __init__(self, src, sink):
+        self.src = src
+        self.sink = sink
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1) -> bytes:
+        data = self.src.read(size)
+        if data:
+            self.sink.write(data)
+            self.digest.update(data)
+        return data
+
+    def drain(self):
+        """Consume el resto del origen (p.ej. si el lector paro antes del final)."""
+        while self.read(1024 * 1024):
+            pass
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Cache en disco de artefactos descargados (tarballs de releases, fuentes, temas).
+    Cada entrada se indexa por URL/version/arquitectura y apunta a un objeto
+    direccionado por contenido (objects/ab/abcd...), verificado con SHA-256.
+    Con tamaño maximo y desalojo LRU. Seguro entre hilos y entre procesos.
+    Las descargas se reanudan (HTTP Range) y se verifican contra el checksum
+    indicado o, si no hay, el publicado junto al archivo (ver src/download.py).
+
+    Estructura:
+        index.json           {clave: {"sha256", "size", "mtime", "url", "version", "arch", "last_used"}}
+        objects/<2>/<sha256>
+        partial/<clave>.part descargas a medias (se reanudan en la proxima corrida)
+    """
+
+    def __init__(self, root, max_mb: int = DEFAULT_MAX_MB):
+        self.root = Path(root)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        # Descargas de esta corrida: {"url", "bytes", "seconds", "segments"}
+        self.transfers: List[Dict] = []
+        # Offline (bundle): nunca descarga; si la version no coincide usa la copia mas nueva de la URL
+        self.offline = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url: str, version: str = "", arch: str = "") -> str:
+        return hashlib.sha256(f"{url}|{version}|{arch}".encode()).hexdigest()[:32]
+
+    def _object_path(self, sha256: str) -> Path:
+        return self.root / "objects" / sha256[:2] / sha256
+
+    def _partial_path(self, key: str) -> Path:
+        return self.root / "partial" / key
+
+    @contextmanager
+    def _download_lock(self, key: str):
+        """Una sola descarga por clave (entre hilos y procesos) sobre el mismo .part."""
+        partial = self._partial_path(key)
+        partial.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{partial}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield partial
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # --- Indice (protegido por lock de hilo + flock entre procesos) ---
+
+    @contextmanager
+    def _locked_index(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.root / ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                yield index
+                self._write_index(index)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self) -> Dict:
+        try:
+            with open(self.root / "index.json", "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index: Dict):
+        tmp = self.root / "index.json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp, self.root / "index.json")
+
+    # --- API ---
+
+    def lookup(self, url: str, version: str = "", arch: str = "", sha256: Optional[str] = None) -> Optional[Path]:
+        """
+        Ruta del objeto en cache si existe y su SHA-256 es correcto, si no None.
+        El digest se verifica al guardar; despues basta con que tamaño y mtime no cambien.
+        Si cambiaron se vuelve a calcular, fuera del lock (releer GBs no bloquea a los demas).
+        """
+        key = self.key(url, version, arch)
+        with self._locked_index() as index:
+            entry = index.get(key)
+            if entry is None and self.offline:
+                same_url = [(k, e) for k, e in index.items()
+                            if e["url"] == url and (not arch or e.get("arch") == arch)]
+                if same_url:
+                    key, entry = max(same_url, key=lambda kv: kv[1]["last_used"])
+            if not entry or (sha256 and entry["sha256"] != sha256):
+                return None
+            path = self._object_path(entry["sha256"])
+            if not path.exists():
+                # Borrado a mano: se descarta
+                index.pop(key, None)
+                return None
+            digest = entry["sha256"]
+            if self._unchanged(entry, path):
+                entry["last_used"] = time.time()
+                return path
+
+        try:
+            ok = sha256_file(path) == digest
+        except OSError:
+            ok = False
+
+        with self._locked_index() as index:
+            entry = index.get(key)
+            if not entry or entry["sha256"] != digest:
+                return None
+            if not ok:
+                # Objeto corrupto: se descarta
+                index.pop(key, None)
+                if path.exists(): path.unlink()
+                return None
+            entry["mtime"] = int(path.stat().st_mtime)
+            entry["last_used"] = time.time()
+            return path
+
+    @staticmethod
+    def _unchanged(entry: Dict, path: Path) -> bool:
+        # Segundos enteros: tar (bundles) no conserva los nanosegundos
+        stat = path.stat()
+        return stat.st_size == entry["size"] and entry.get("mtime") == int(stat.st_mtime)
+
+    def store(self, src, url: str, version: str = "", arch: str = "", sha256: Optional[str] = None,
+              actual: Optional[str] = None) -> Path:
+        """
+        Mueve 'src' al cache (verificando sha256 si se indica) y retorna la ruta del objeto.
+        'actual' es el digest ya calculado al descargar (evita releer el archivo).
+        """
+        actual = actual or sha256_file(src)
+        if sha256 and actual != sha256:
+            raise ValueError(f"SHA-256 no coincide para {url}: esperado {sha256}, obtenido {actual}")
+
+        path = self._object_path(actual)
+        with self._locked_index() as index:
+            # Dentro del lock: un prune concurrente no lo ve como huerfano
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(src, path)
+            # Lectura para todos los usuarios del host (instalaciones multi-usuario)
+            path.chmod(0o644)
+            index[self.key(url, version, arch)] = {
+                "sha256": actual, "size": path.stat().st_size, "mtime": int(path.stat().st_mtime),
+                "url": url, "version": version, "arch": arch, "last_used": time.time()
+            }
+            self._evict(index, self.max_bytes)
+        return path
+
+    def _check_online(self, url: str):
+        if self.offline:
+            raise OSError(f"Modo offline: {url} no esta en el bundle")
+
+    def _expected_sha256(self, url: str, sha256: Optional[str], checksum_url: Optional[str]) -> Optional[str]:
+        # Solo en un fallo del cache: buscar el checksum publicado cuesta consultas HTTP
+        return sha256 or published_sha256(checksum_url or url)
+
+    def fetch(self, url: str, version: str = "", arch: str = "", sha256: Optional[str] = None,
+              checksum_url: Optional[str] = None, segments: int = 1) -> Path:
+        """
+        Retorna el artefacto desde disco si esta en cache; si no lo descarga
+        (reanudable, con reintentos) y lo guarda verificado.
+        checksum_url: URL junto a la que se publican los checksums (default: url).
+        segments: conexiones en paralelo para archivos grandes (ver segmented_download).
+        """
+        cached = self.lookup(url, version, arch, sha256)
+        if cached:
+            self.hits += 1
+            return cached
+
+        self._check_online(url)
+        key = self.key(url, version, arch)
+        with self._download_lock(key) as partial:
+            # Otro proceso pudo terminar la misma descarga mientras esperabamos
+            cached = self.lookup(url, version, arch, sha256)
+            if cached:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            expected = self._expected_sha256(url, sha256, checksum_url)
+            stats = {"url": url}
+            if segments > 1:
+                actual = segmented_download(url, partial, expected, segments=segments, stats=stats)
+            else:
+                actual = download(url, partial, expected, stats=stats)
+            self.transfers.append(stats)
+            return self.store(partial, url, version, arch, expected, actual=actual)
+
+    def last_transfer(self, url: str) -> Optional[Dict]:
+        """Ultima descarga de 'url' en esta corrida (None si salio del cache)."""
+        for stats in reversed(self.transfers):
+            if stats["url"] == url:
+                return stats
+        return None
+
+    @contextmanager
+    def open_stream(self, url: str, version: str = "", arch: str = "", sha256: Optional[str] = None,
+                    checksum_url: Optional[str] = None, timeout: float = 60):
+        """
+        Abre el artefacto para lectura secuencial. Si esta en cache lee del disco;
+        si no, lee directo de la respuesta HTTP y, al terminar, lo que paso por el
+        stream queda guardado en el cache (sin copia temporal aparte ni curl).
+        Un corte de conexion se reanuda con Range sin que el lector lo note; si
+        el proceso muere, lo recibido queda en partial/ y la proxima corrida
+        completa esa descarga (fetch) en lugar de empezar de cero.
+        """
+        cached = self.lookup(url, version, arch, sha256)
+        if cached:
+            self.hits += 1
+            with open(cached, "rb") as f:
+                yield f
+            return
+
+        self._check_online(url)
+        key = self.key(url, version, arch)
+        partial = self._partial_path(key)
+        if partial.with_name(partial.name + ".part").exists():
+            path = self.fetch(url, version, arch, sha256, checksum_url)
+            with open(path, "rb") as f:
+                yield f
+            return
+
+        with self._download_lock(key) as partial:
+            part = partial.with_name(partial.name + ".part")
+            self.misses += 1
+            expected = self._expected_sha256(url, sha256, checksum_url)
+            with open(part, "wb") as sink, open_resumable(url, timeout=timeout) as response:
+                tee = HashingTee(response, sink)
+                yield tee
+                tee.drain()
+            actual = tee.hexdigest()
+            if expected and actual != expected:
+                part.unlink()
+                raise ChecksumError(f"SHA-256 no coincide para {url}: esperado {expected}, obtenido {actual}")
+            self.store(part, url, version, arch, expected, actual=actual)
+
+    def copy_to(self, url: str, dest, version: str = "", arch: str = "", sha256: Optional[str] = None) -> Path:
+        """fetch() + copia a 'dest' (el objeto en cache no se modifica)."""
+        path = self.fetch(url, version, arch, sha256)
+        shutil.copyfile(path, dest)
+        return Path(dest)
+
+    @staticmethod
+    def _size(index: Dict) -> int:
+        # Un objeto cuenta una sola vez aunque lo referencien varias claves
+        return sum(e["size"] for e in {e["sha256"]: e for e in index.values()}.values())
+
+    def _evict(self, index: Dict, max_bytes: int):
+        """LRU: borra las entradas menos usadas hasta quedar bajo max_bytes (y objetos huerfanos)."""
+        removed, freed = 0, 0
+        total = self._size(index)
+        for key, entry in sorted(index.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= max_bytes:
+                break
+            del index[key]
+            # Varias claves pueden apuntar al mismo objeto
+            if not any(e["sha256"] == entry["sha256"] for e in index.values()):
+                total -= entry["size"]
+                path = self._object_path(entry["sha256"])
+                if path.exists():
+                    path.unlink()
+                    removed += 1
+                    freed += entry["size"]
+
+        referenced = {e["sha256"] for e in index.values()}
+        objects = self.root / "objects"
+        if objects.exists():
+            for path in objects.glob("*/*"):
+                if path.name not in referenced:
+                    freed += path.stat().st_size
+                    path.unlink()
+                    removed += 1
+        return removed, freed
+
+    def prune(self, max_mb: Optional[int] = None):
+        """Aplica el limite (o max_mb si se indica). Retorna (objetos borrados, bytes liberados)."""
+        max_bytes = self.max_bytes if max_mb is None else max_mb * 1024 * 1024
+        with self._locked_index() as index:
+            removed, freed = self._evict(index, max_bytes)
+        # Descargas a medias abandonadas (todas si se vacia el cache)
+        partial_dir = self.root / "partial"
+        if partial_dir.exists():
+            limit = time.time() - (0 if max_bytes == 0 else PARTIAL_TTL)
+            for path in [p for p in partial_dir.iterdir() if p.suffix in (".part", ".seg", ".json")]:
+                try:
+                    st = path.stat()
+                    if st.st_mtime < limit:
+                        path.unlink()
+                        removed += 1
+                        freed += st.st_size
+                except OSError:
+                    pass
+        return removed, freed
+
+    def stats(self) -> Dict:
+        index = self._read_index()
+        return {
+            "root": str(self.root),
+            "entries": len(index),
+            "objects": len({e["sha256"] for e in index.values()}),
+            "bytes": self._size(index),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def render_stats(self) -> str:
+        st = self.stats()
+        mb = 1024 * 1024
+        lines = [f"Cache de artefactos: {st['root']}",
+                 f"  Entradas: {st['entries']} ({st['objects']} objetos)",
+                 f"  Ocupado:  {st['bytes'] / mb:.1f}/{st['max_bytes'] / mb:.0f} MB"]
+        index = self._read_index()
+        for entry in sorted(index.values(), key=lambda e: e["last_used"], reverse=True):
+            used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"]))
+            lines.append(f"  {entry['size'] / mb:8.1f} MB  {used}  {entry['url']}")
+        return "\n".join(lines)
@@ -1,10 +1,20 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, List, Optional, Sequence, Set
 import shutil
 import subprocess
 import os
+import threading
 import platform
+import glob
+import time
+import tempfile
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from .pkgcache import PackageCache, DEFAULT_MAX_MB
+from .cache import ArtifactCache
+from .github import GitHubError, ReleaseCache, asset_sha256, select_asset
 
 # ==========================================
 # DICCIONARIO ROSETTA (Mapeo de Paquetes)
@@ -36,18 +46,171 @@ PACKAGE_MAP = {
     "starship": {"default": "starship"} # Prompt (requerido por tu zshrc)
 }
 
+# Binarios que delatan que una herramienta ya esta instalada
+# (nombre generico -> candidatos, el primero que exista alcanza)
+BINARY_ALIASES = {
+    "bat": ["bat", "batcat"],        # Debian instala 'batcat'
+    "eza": ["eza", "exa"],           # Debian Stable trae 'exa'
+    "tldr": ["tldr", "tealdeer"],
+    "python-dev": ["python3-config"] # Lo provee python3-dev / python3-devel
+}
+
+# Paquetes nativos que sirven para una herramienta, en orden de preferencia.
+# Si ninguno esta en los repos de la distro se usa la instalacion manual (GitHub/pip).
+NATIVE_ALTERNATIVES = {
+    "eza": ["eza", "exa"],           # Debian Stable solo trae 'exa'
+    "tldr": ["tealdeer", "tldr"]     # tealdeer (Rust) es mas rapido
+}
+
+# Binarios de GitHub: herramienta -> (repo, palabra clave del asset, es .tar.gz, build musl estatico)
+# Los builds musl estaticos de tealdeer y zoxide corren tambien sobre glibc.
+GITHUB_BINARIES = {
+    "eza": ("eza-community/eza", ".tar.gz", True, False),
+    "bat": ("sharkdp/bat", ".tar.gz", True, False),
+    "fzf": ("junegunn/fzf", ".tar.gz", True, False),
+    "tldr": ("dbrgn/tealdeer", "linux", False, True),
+    "starship": ("starship/starship", ".tar.gz", True, False),
+    "zoxide": ("ajeetdsouza/zoxide", ".tar.gz", True, True)
+}
+
+# Scripts oficiales si no hay asset para la arquitectura ({sudo} = prefijo de privilegios)
+INSTALL_SCRIPTS = {
+    "starship": "curl -sS https://starship.rs/install.sh | {sudo} sh -s -- -y",
+    "zoxide": "curl -sS https://raw.githubusercontent.com/ajeetdsouza/zoxide/main/install.sh | {sudo} sh -s -- --bin-dir /usr/local/bin"
+}
+
+# Tema de bat (Debian lo instala junto al paquete)
+BAT_THEME_URL = "https://raw.githubusercontent.com/catppuccin/bat/main/themes/Catppuccin%20Mocha.tmTheme"
+
+# Descargas manuales (GitHub) en paralelo
+DOWNLOAD_WORKERS = int(os.environ.get("BRAINBASH_DOWNLOAD_WORKERS", 4))
+
+# Fuentes MesloLGS NF (requeridas por Starship)
+NERD_FONTS_URL = "https://github.com/romkatv/powerlevel10k-media/raw/master"
+NERD_FONTS = [
+    "MesloLGS NF Regular.ttf",
+    "MesloLGS NF Bold.ttf",
+    "MesloLGS NF Italic.ttf",
+    "MesloLGS NF Bold Italic.ttf"
+]
+
+# Marca (en el directorio de fuentes) de la ultima vez que fc-cache las indexo
+FONTS_STAMP = ".brainbash-fonts"
+
+# Edad maxima (segundos) de los indices de repositorios antes de refrescarlos.
+# Re-ejecuciones dentro de este lapso no vuelven a bajar decenas de MB de indices.
+METADATA_TTL = int(os.environ.get("BRAINBASH_METADATA_TTL", 6 * 3600))
+
+def brainbash_cache_dir() -> Path:
+    """Cache compartido del instalador: /var/cache/brainbash como root, ~/.cache/brainbash si no."""
+    if os.environ.get("BRAINBASH_CACHE_DIR"):
+        return Path(os.environ["BRAINBASH_CACHE_DIR"])
+    if os.geteuid() == 0:
+        return Path("/var/cache/brainbash")
+    return Path(os.environ.get("XDG_CACHE_HOME", str(Path.home() / ".cache"))) / "brainbash"
+
+def arch_terms(machine: str) -> List[str]:
+    """Como puede aparecer la arquitectura en el nombre de un asset (x86_64/amd64...)."""
+    arch = machine.lower()
+    if arch == "x86_64": return ["x86_64", "amd64"]
+    if arch in ["aarch64", "arm64"]: return ["aarch64", "arm64"]
+    return [arch]
+
+_artifact_cache = None
+_cache_singletons_lock = threading.Lock()
+
+def artifact_cache() -> ArtifactCache:
+    """Cache de artefactos descargados del host (ver src/cache.py), uno por proceso."""
+    global _artifact_cache
+    with _cache_singletons_lock:
+        if _artifact_cache is None:
+            _artifact_cache = ArtifactCache(brainbash_cache_dir() / "artifacts")
+        return _artifact_cache
+
+_release_cache = None
+
+def release_cache() -> ReleaseCache:
+    """Cache de metadata de releases de GitHub (ver src/github.py), uno por proceso."""
+    global _release_cache
+    with _cache_singletons_lock:
+        if _release_cache is None:
+            _release_cache = ReleaseCache(brainbash_cache_dir() / "github")
+        return _release_cache
+
+def use_offline_caches(artifacts_root, github_root):
+    """Instalacion desde bundle: artefactos y metadata de releases salen solo de disco."""
+    global _artifact_cache, _release_cache
+    with _cache_singletons_lock:
+        _artifact_cache = ArtifactCache(artifacts_root)
+        _artifact_cache.offline = True
+        _release_cache = ReleaseCache(github_root)
+        _release_cache.offline = True
+
 # ==========================================
 # CLASE ABSTRACTA
 # ==========================================
 class PackageManager(ABC):
+    # Paquetes nativos que necesita cada etapa del instalador.
+    # Se suman a la transaccion de install() para no pagar resolver/lock/triggers varias veces.
+    # Etapas: "fonts" (fc-cache), "ollama", "gemini" (venv), "shell" (chsh)
+    STAGE_PACKAGES: Dict[str, List[str]] = {}
+
+    # Herramientas con instalacion manual (ver _install_binary) si no hay paquete nativo
+    MANUAL_TOOLS = {"eza", "bat", "fzf", "tldr", "starship", "zoxide"}
+
+    # Archivos de indices del gestor (globs). Su mtime indica la edad de los metadatos.
+    METADATA_GLOBS: List[str] = []
+
+    # Cache compartido de paquetes (opt-in, ver src/pkgcache.py):
+    # extension de los paquetes y globs de indices que el gestor guarda ahi ("{cache}" = directorio)
+    PACKAGE_SUFFIX = ""
+    CACHE_METADATA_GLOBS: List[str] = []
+
     def __init__(self, distro_id: str):
         self.distro_id = distro_id
         self._sudo_cmd = [] if os.geteuid() == 0 else ["sudo"]
         self.logger = None
+        self.journal = None
+        # Cache del estado instalado (una consulta a la base de paquetes por corrida)
+        self._installed = None
+        self._installed_lock = threading.Lock()
+        # Indice de disponibilidad en repos {nombre nativo: disponible} (una consulta por corrida)
+        self._available = {}
+        self._available_lock = threading.Lock()
+        self.metadata_ttl = METADATA_TTL
+        self._metadata_refreshed = False
+        self.pkg_cache = None
+        self._prefetch_token = None
+        self.download_workers = DOWNLOAD_WORKERS
+        # Instalacion desde bundle: sin red fuera del gestor de paquetes
+        self.offline = False
+        self._bin_lock = threading.Lock()
 
     def set_logger(self, logger):
         self.logger = logger
 
+    def set_journal(self, journal):
+        """Journal de la corrida (ver src/journal.py) para registrar sub-pasos."""
+        self.journal = journal
+
+    def set_pkg_cache(self, path, max_mb: int = DEFAULT_MAX_MB):
+        """Activa el cache compartido de paquetes en 'path' (p.ej. un volumen montado del host)."""
+        cache = PackageCache(path, self.PACKAGE_SUFFIX, max_mb)
+        try:
+            cache.prepare()
+        except OSError as e:
+            self._log_warn(f"No se pudo usar el cache de paquetes {path}: {e}")
+            return
+        self.pkg_cache = cache
+        self._log_info(f"Cache de paquetes compartido: {cache.path} (max {max_mb} MB)")
+
+    def _mark_done(self, key, inputs=None):
+        if self.journal: self.journal.mark_done(key, inputs)
+
+    def _is_done(self, key, inputs=None) -> bool:
+        """Sub-paso ya completado (el journal solo conserva entradas con --resume)."""
+        return bool(self.journal) and self.journal.is_done(key, inputs)
+
     def _log_info(self, msg):
         if self.logger: self.logger.info(msg)
         else: print(f"[INFO] {msg}")
@@ -64,6 +227,16 @@ class PackageManager(ABC):
         if self.logger: self.logger.error(msg)
         else: print(f"[ERROR] {msg}")
         
+    def _span(self, name, cat="step", **args):
+        """Span de trazado si hay logger (ver utils.Tracer), si no no mide nada."""
+        if self.logger: return self.logger.span(name, cat, **args)
+        return nullcontext()
+
+    def _run(self, cmd, **kwargs):
+        """subprocess.run medido en la traza de la instalacion."""
+        if self.logger: return self.logger.tracer.run(cmd, **kwargs)
+        return subprocess.run(cmd, **kwargs)
+
     @property
     def sudo_cmd(self) -> List[str]:
         return self._sudo_cmd
@@ -76,15 +249,238 @@ class PackageManager(ABC):
             return mapping["default"]
         return generic_name
 
+    def _query_installed(self) -> Set[str]:
+        """
+        Consulta UNICA a la base de paquetes de la distro (dpkg/rpm/apk).
+        Retorna los nombres nativos instalados. Cada manager la implementa.
+        """
+        return set()
+
+    def installed_packages(self) -> Set[str]:
+        """Paquetes nativos instalados, cacheados para toda la corrida."""
+        with self._installed_lock:
+            if self._installed is None:
+                try:
+                    with self._span("installed-query", "probe"):
+                        self._installed = self._query_installed()
+                except (OSError, subprocess.CalledProcessError) as e:
+                    self._log_warn(f"No se pudo consultar la base de paquetes: {e}")
+                    self._installed = set()
+            return self._installed
+
+    def invalidate_installed(self):
+        """Llamar despues de una transaccion para que la proxima consulta refleje los cambios."""
+        with self._installed_lock:
+            self._installed = None
+
+    def _drop_installed(self, native_packages: List[str], quiet: bool = False) -> List[str]:
+        """Filtra los paquetes nativos que ya estan instalados (no llegan al gestor)."""
+        installed = self.installed_packages()
+        missing = [p for p in native_packages if p not in installed]
+        skipped = [p for p in native_packages if p in installed]
+        if skipped and not quiet:
+            self._log_info(f"Ya instalados (se omiten): {', '.join(skipped)}")
+        return missing
+
+    # ==========================================
+    # CACHE COMPARTIDO DE PAQUETES
+    # ==========================================
+
+    def _cache_opts(self) -> List[str]:
+        """Opciones del gestor para bajar/guardar paquetes en el cache compartido."""
+        return []
+
+    def _cache_package_name(self, filename: str) -> Optional[str]:
+        """Nombre del paquete a partir del archivo en cache (depende del formato)."""
+        return None
+
+    def _cache_begin(self):
+        """Foto del cache y de lo instalado antes de una transaccion (None si no hay cache)."""
+        if not self.pkg_cache:
+            return None
+        if self._prefetch_token:
+            # La foto se tomo antes de la pre-descarga: lo pre-descargado cuenta como fallo
+            token, self._prefetch_token = self._prefetch_token, None
+            return token
+        return self.pkg_cache.snapshot(), set(self.installed_packages())
+
+    def _cache_end(self, token):
+        """Cuenta aciertos/fallos de la transaccion y aplica el limite de tamaño."""
+        if not token:
+            return
+        files_before, installed_before = token
+        self.invalidate_installed()
+        new_packages = self.installed_packages() - installed_before
+        self.pkg_cache.record(files_before, new_packages, self._cache_package_name)
+        self.pkg_cache.evict()
+
+    # ==========================================
+    # DISPONIBILIDAD EN REPOS (nativo vs manual)
+    # ==========================================
+
+    def _query_available(self, names: List[str]) -> Set[str]:
+        """
+        Consulta UNICA a los indices de repos (apt-cache policy, dnf repoquery, apk search).
+        Retorna cuales de 'names' tienen un candidato instalable. Cada manager la implementa.
+        """
+        return set(names)
+
+    def available_packages(self, names: List[str]) -> Set[str]:
+        """Nombres nativos disponibles en los repos, cacheados para toda la corrida."""
+        with self._available_lock:
+            unknown = [n for n in dict.fromkeys(names) if n not in self._available]
+            if unknown:
+                try:
+                    with self._span("availability-query", "probe", packages=unknown):
+                        found = self._query_available(unknown)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    # Sin indice asumimos nativo: el gestor reporta si no existe
+                    self._log_warn(f"No se pudo consultar los repositorios: {e}")
+                    found = set(unknown)
+                for name in unknown:
+                    self._available[name] = name in found
+            return {n for n in names if self._available.get(n)}
+
+    def _native_candidates(self, package: str) -> List[str]:
+        return NATIVE_ALTERNATIVES.get(package, [self._get_mapped_name(package)])
+
+    def _resolve_sources(self, packages: List[str]):
+        """
+        Elige la fuente de cada herramienta: el primer paquete nativo disponible,
+        si no la instalacion manual. Retorna (nombres nativos, herramientas manuales).
+        """
+        candidates = {pkg: self._native_candidates(pkg) for pkg in packages}
+        available = self.available_packages([c for names in candidates.values() for c in names])
+
+        native, manual = [], []
+        for pkg in packages:
+            choice = next((c for c in candidates[pkg] if c in available), None)
+            if choice:
+                native.append(choice)
+            elif pkg in self.MANUAL_TOOLS:
+                manual.append(pkg)
+            else:
+                # Sin alternativa: que el gestor reporte el error
+                native.append(candidates[pkg][0])
+        if manual:
+            self._log_info(f"Sin paquete nativo, instalacion manual: {', '.join(manual)}")
+        return native, manual
+
     def check_is_installed(self, package: str) -> bool:
-        return shutil.which(package) is not None
+        # 1. Base de paquetes (consulta cacheada)
+        if self._get_mapped_name(package) in self.installed_packages():
+            return True
+        # 2. Binario en PATH (instalaciones manuales / GitHub)
+        candidates = BINARY_ALIASES.get(package, [package])
+        return any(shutil.which(name) is not None for name in candidates)
 
     @abstractmethod
     def update(self):
         pass
 
+    # ==========================================
+    # FRESCURA DE METADATOS (indices de repos)
+    # ==========================================
+
+    def _metadata_stamp(self) -> Path:
+        # apt/dnf no siempre tocan el mtime si el indice no cambio: guardamos nuestra marca
+        return brainbash_cache_dir() / f"metadata-{type(self).__name__}.stamp"
+
+    def _metadata_globs(self) -> List[str]:
+        globs = list(self.METADATA_GLOBS)
+        if self.pkg_cache:
+            globs += [g.replace("{cache}", str(self.pkg_cache.path)) for g in self.CACHE_METADATA_GLOBS]
+        return globs
+
+    def metadata_age(self):
+        """Segundos desde el ultimo refresco de indices, o None si no hay indices locales."""
+        mtimes = []
+        for pattern in self._metadata_globs():
+            for path in glob.glob(pattern):
+                try: mtimes.append(os.path.getmtime(path))
+                except OSError: pass
+        if not mtimes:
+            return None
+        stamp = self._metadata_stamp()
+        if stamp.exists():
+            mtimes.append(stamp.stat().st_mtime)
+        return max(0.0, time.time() - max(mtimes))
+
+    def metadata_is_fresh(self) -> bool:
+        age = self.metadata_age()
+        return age is not None and age < self.metadata_ttl
+
     @abstractmethod
-    def install(self, packages: List[str]):
+    def _refresh_metadata(self):
+        """Comando nativo que refresca los indices (apt update, dnf makecache, apk update)."""
+        pass
+
+    def refresh_metadata(self, force: bool = False) -> bool:
+        """
+        Refresca los indices solo si son mas viejos que metadata_ttl (o si force=True).
+        Retorna True si realmente se refrescaron.
+        """
+        if not force and self.metadata_is_fresh():
+            age_min = int(self.metadata_age() // 60)
+            self._log_info(f"Indices de repositorios frescos (hace {age_min} min). Se omite el refresco.")
+            return False
+
+        with self._span("refresh-metadata", "probe"):
+            self._refresh_metadata()
+        self._metadata_refreshed = True
+        try:
+            stamp = self._metadata_stamp()
+            stamp.parent.mkdir(parents=True, exist_ok=True)
+            stamp.touch()
+        except OSError:
+            pass
+        return True
+
+    def stage_packages(self, stages: Sequence[str]) -> List[str]:
+        """Paquetes nativos (sin duplicados) que piden las etapas indicadas."""
+        result = []
+        for stage in stages:
+            for pkg in self.STAGE_PACKAGES.get(stage, []):
+                if pkg not in result:
+                    result.append(pkg)
+        return result
+
+    def _split_packages(self, packages: List[str], stages: Sequence[str] = ()):
+        """
+        Separa la seleccion en (paquetes nativos, binarios manuales) tal como
+        la va a instalar install(). Cada manager la implementa.
+        """
+        return [], []
+
+    def _prefetch(self, native_packages: List[str]):
+        """Comando nativo de solo-descarga (apt-get --download-only, dnf --downloadonly, apk cache download)."""
+        pass
+
+    def prefetch(self, packages: List[str], stages: Sequence[str] = ()):
+        """
+        Descarga sin instalar los paquetes nativos que va a pedir install(),
+        para que la descarga se solape con otras etapas. Es best-effort:
+        si falla, install() descarga lo que falte. Nunca lanza: 'packages' depende de
+        este paso y una pre-descarga rota no debe saltear la instalacion.
+        """
+        try:
+            native, _ = self._split_packages(packages, stages)
+            missing = self._drop_installed(native, quiet=True)
+            if not missing:
+                return
+            self._prefetch_token = self._cache_begin()
+            self._log_info(f"Pre-descargando en segundo plano: {', '.join(missing)}")
+            with self._span("prefetch", "download", packages=missing):
+                self._prefetch(missing)
+        except Exception as e:
+            self._log_warn(f"Fallo la pre-descarga ({e}). La instalacion bajara lo que falte.")
+
+    @abstractmethod
+    def install(self, packages: List[str], stages: Sequence[str] = ()):
+        """
+        Instala los paquetes genericos + los nativos de 'stages'
+        en una sola transaccion del gestor de la distro.
+        """
         pass
 
     @abstractmethod
@@ -99,27 +495,33 @@ class PackageManager(ABC):
         # 1. Directorio de fuentes local
         home = Path.home()
         fonts_dir = home / ".local" / "share" / "fonts"
+        if self._is_done("fonts", NERD_FONTS) and all((fonts_dir / font).exists() for font in NERD_FONTS):
+            self._log_info("[Resume] Fuentes ya instaladas.")
+            return
         fonts_dir.mkdir(parents=True, exist_ok=True)
         
         # URLs de MesloLGS NF
-        base_url = "https://github.com/romkatv/powerlevel10k-media/raw/master"
-        fonts = [
-            "MesloLGS NF Regular.ttf",
-            "MesloLGS NF Bold.ttf",
-            "MesloLGS NF Italic.ttf",
-            "MesloLGS NF Bold Italic.ttf"
-        ]
+        base_url = NERD_FONTS_URL
         
         try:
-            for font in fonts:
-                target = fonts_dir / font
-                if not target.exists():
-                    self._log_info(f"   > Descargando {font}...")
+            # Descargas en paralelo (cada una sale del cache de artefactos si ya estaba)
+            missing = [font for font in NERD_FONTS if not (fonts_dir / font).exists()]
+            if missing:
+                self._log_info(f"   > Descargando {len(missing)} fuentes...")
+                workers = max(1, min(self.download_workers, len(missing)))
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fonts") as pool:
                     # Encode spaces in URL
-                    encoded_font = font.replace(" ", "%20")
-                    subprocess.run(["curl", "-fLo", str(target), f"{base_url}/{encoded_font}"], check=True)
-            
-            # Refrescar cache
+                    list(pool.map(lambda font: artifact_cache().copy_to(
+                        f"{base_url}/{font.replace(' ', '%20')}", fonts_dir / font), missing))
+
+            # Refrescar cache: solo este directorio, y solo si las fuentes cambiaron
+            stamp = fonts_dir / FONTS_STAMP
+            fingerprint = self._fonts_fingerprint(fonts_dir)
+            if stamp.exists() and stamp.read_text().strip() == fingerprint:
+                self._log_info("   > Cache de fuentes al dia.")
+                self._mark_done("fonts", NERD_FONTS)
+                return
+
             self._log_info("   > Actualizando cache de fuentes...")
             
             # Verificar si existe fc-cache, si no, instalar fontconfig via manager especifico
@@ -127,116 +529,137 @@ class PackageManager(ABC):
                 self.install_fontconfig()
 
             if shutil.which("fc-cache"):
-                subprocess.run(["fc-cache", "-fv"], check=False, stdout=subprocess.DEVNULL)
+                # Sin -v ni el resto de directorios del sistema: en imagenes de escritorio
+                # un 'fc-cache -fv' global tarda varios segundos
+                self._run(["fc-cache", "-f", str(fonts_dir)], check=False, stdout=subprocess.DEVNULL)
+                stamp.write_text(fingerprint)
                 self._log_info("Instalacion de fuentes completada.")
+                self._mark_done("fonts", NERD_FONTS)
             else:
                 self._log_warn("'fc-cache' no encontrado incluso tras intentar instalar fontconfig.")
                 
         except Exception as e:
             self._log_error(f"Fallo instalando fuentes: {e}")
 
+    @staticmethod
+    def _fonts_fingerprint(fonts_dir: Path) -> str:
+        """Nombre, tamaño y mtime de las fuentes: cambia si alguna se agrega o reemplaza."""
+        parts = []
+        for font in NERD_FONTS:
+            try:
+                st = (fonts_dir / font).stat()
+                parts.append(f"{font}:{st.st_size}:{int(st.st_mtime)}")
+            except OSError:
+                parts.append(f"{font}:-")
+        return "|".join(parts)
+
     # ==========================================
     # METODOS DE AYUDA (Instalación manual)
     # ==========================================
 
     def _get_arch_terms(self):
-        arch = platform.machine().lower()
-        if arch == "x86_64": return ["x86_64", "amd64"]
-        if arch in ["aarch64", "arm64"]: return ["aarch64", "arm64"]
-        return [arch]
-
-    def _download_github_asset(self, repo, keyword, output_name, allow_musl=False):
-        import urllib.request
-        import json
-        
-        print(f"⬇️  [GitHub] Buscando {output_name} en {repo}...")
+        return arch_terms(platform.machine())
+
+    def _github_asset_url(self, repo, keyword, allow_musl=False):
+        """(url, tag, sha256) del asset de la ultima release para esta arquitectura, o None."""
+        self._log_info(f"[GitHub] Buscando asset en {repo}...")
         try:
-            api_url = f"https://api.github.com/repos/{repo}/releases/latest"
-            req = urllib.request.Request(api_url, headers={'User-Agent': 'python'})
-            with urllib.request.urlopen(req) as response:
-                data = json.loads(response.read().decode())
-            
-            arch_terms = self._get_arch_terms()
-            download_url = None
-            
-            for asset in data["assets"]:
-                name = asset["name"].lower()
-                if "linux" not in name and "unknown-linux" not in name: continue
-                if not any(term in name for term in arch_terms): continue
-                if keyword and keyword not in name: continue
-                # Si allow_musl es False, evitamos musl (para glibc distros)
-                # Si es True, PREFERIMOS musl si estamos en Alpine?
-                # Simplificacion: Si allow_musl es False, saltamos 'musl'.
-                if "musl" in name and not allow_musl: continue
-                
-                download_url = asset["browser_download_url"]
-                # Si encontramos uno bueno, paramos (o podriamos priorizar musl para alpine)
-                break
-            
-            if not download_url: return False
-            subprocess.run(["curl", "-L", "-o", output_name, download_url], check=True)
-            return True
-        except Exception as e:
-            print(f"Error descargando asset: {e}")
-            return False
+            # Metadata cacheada con ETag/TTL (ver src/github.py): no gasta cuota en cada corrida
+            release = release_cache().latest(repo, warn=self._log_warn)
+        except GitHubError as e:
+            self._log_error(str(e))
+            return None
+        found = select_asset(release, self._get_arch_terms(), keyword, allow_musl)
+        if not found:
+            return None
+        # Digest publicado por la API (si la release es vieja, el cache busca un sha256sum.txt)
+        return found + (asset_sha256(release, found[0]),)
+
+    def install_binaries(self, tools: List[str], allow_musl=False):
+        """
+        Instala herramientas manuales en paralelo: las descargas corren en un pool
+        de download_workers hilos y solo la copia final a /usr/local/bin se serializa.
+        """
+        if not tools:
+            return
+        workers = max(1, min(self.download_workers, len(tools)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download") as pool:
+            list(pool.map(lambda tool: self._install_binary(tool, allow_musl), tools))
+
+    def _fetch_binary(self, tool, work_dir: Path, allow_musl=False) -> Optional[Path]:
+        """
+        Descarga el asset y extrae SOLO el ejecutable de 'tool' a work_dir, sin privilegios.
+        La respuesta HTTP (o el archivo del cache) se lee en streaming con tarfile:
+        ni curl, ni tar, ni tarball temporal.
+        """
+        repo, keyword, archived, static = GITHUB_BINARIES[tool]
+        found = self._github_asset_url(repo, keyword, allow_musl or static)
+        if not found:
+            return None
+        url, tag, sha256 = found
+
+        target = work_dir / tool
+        # Misma release + arquitectura = mismo archivo: sale del cache local
+        with artifact_cache().open_stream(url, version=tag, arch=platform.machine(), sha256=sha256) as stream:
+            if not archived:
+                with open(target, "wb") as out:
+                    shutil.copyfileobj(stream, out)
+            else:
+                # Modo stream ("r|gz"): miembros en orden, sin seek. Puede estar en ./eza, ./bin/eza o ./bat-vX/bat
+                with tarfile.open(fileobj=stream, mode="r|gz") as tar:
+                    for member in tar:
+                        if member.isfile() and Path(member.name).name == tool:
+                            with open(target, "wb") as out:
+                                shutil.copyfileobj(tar.extractfile(member), out)
+                            break
+        if not target.exists():
+            return None
+        target.chmod(0o755)
+        return target
+
+    def _place_binary(self, tool, binary: Path):
+        """Unico paso privilegiado: serializado entre las herramientas que se instalan en paralelo."""
+        with self._bin_lock:
+            self._run(self.sudo_cmd + ["install", "-m", "0755", str(binary), f"/usr/local/bin/{tool}"], check=True)
 
     def _install_binary(self, tool, allow_musl=False):
         if shutil.which(tool):
             self._log_info(f"{tool} ya está instalado.")
             return
-            
+        if tool not in GITHUB_BINARIES:
+            self._log_warn(f"No hay instalacion manual para {tool}.")
+            return
+        binary_inputs = {"arch": platform.machine(), "musl": allow_musl}
+        if self._is_done(f"binary:{tool}", binary_inputs) and Path(f"/usr/local/bin/{tool}").exists():
+            self._log_info(f"[Resume] {tool} ya instalado.")
+            return
+
         self._log_info(f"Instalando {tool}...")
-        original_cwd = os.getcwd()
-        temp_dir = Path("/tmp/brainbash_bin")
-        if temp_dir.exists(): shutil.rmtree(temp_dir)
-        temp_dir.mkdir(exist_ok=True)
-        
-        sudo_prefix = " ".join(self.sudo_cmd)
-        
-        try:
-            os.chdir(temp_dir)
-            
-            if tool == "eza":
-                if self._download_github_asset("eza-community/eza", ".tar.gz", "eza.tar.gz", allow_musl):
-                    subprocess.run("tar -xzf eza.tar.gz", shell=True)
-                    # A veces descomprime en ./eza o ./bin/eza, asumimos ./eza o buscamos
-                    if os.path.exists("eza"):
-                        subprocess.run(f"{sudo_prefix} mv ./eza /usr/local/bin/", shell=True)
-                    elif os.path.exists("./bin/eza"):
-                        subprocess.run(f"{sudo_prefix} mv ./bin/eza /usr/local/bin/", shell=True)
-                    else:
-                        # Fallback generico: buscar archivo ejecutable
-                        pass
-                    subprocess.run(f"{sudo_prefix} chmod +x /usr/local/bin/eza", shell=True)
-            elif tool == "bat":
-                if self._download_github_asset("sharkdp/bat", ".tar.gz", "bat.tar.gz", allow_musl):
-                    subprocess.run("tar -xzf bat.tar.gz", shell=True)
-                    subprocess.run(f"{sudo_prefix} mv bat-*/bat /usr/local/bin/", shell=True)
-                    subprocess.run(f"{sudo_prefix} chmod +x /usr/local/bin/bat", shell=True)
-            elif tool == "fzf":
-                if self._download_github_asset("junegunn/fzf", ".tar.gz", "fzf.tar.gz", allow_musl):
-                    subprocess.run("tar -xzf fzf.tar.gz", shell=True)
-                    subprocess.run(f"{sudo_prefix} mv fzf /usr/local/bin/", shell=True)
-                    subprocess.run(f"{sudo_prefix} chmod +x /usr/local/bin/fzf", shell=True)
-            elif tool == "tldr":
-                # Tealdeer
-                if self._download_github_asset("dbrgn/tealdeer", "linux", "tldr", allow_musl):
-                    subprocess.run("chmod +x tldr", shell=True)
-                    subprocess.run(f"{sudo_prefix} mv tldr /usr/local/bin/", shell=True)
-            elif tool == "starship":
-                subprocess.run("curl -sS https://starship.rs/install.sh | sh -s -- -y", shell=True)
-                self._install_nerd_fonts()
-            elif tool == "zoxide":
-                 # Zoxide script installs to ~/.local/bin by default usually, but we forced /usr/local/bin before
-                 # The script param --bin-dir requires write access.
-                 # Using sudo if needed.
-                 # Updated URL to use verified one if needed
-                 cmd = f"curl -sS https://raw.githubusercontent.com/ajeetdsouza/zoxide/main/install.sh | {sudo_prefix} sh -s -- --bin-dir /usr/local/bin"
-                 subprocess.run(cmd, shell=True)
-            
-            self._log_info(f"{tool} instalado.")
-        except Exception as e:
-            self._log_error(f"Error {tool}: {e}")
-        finally:
-            os.chdir(original_cwd)
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        # Directorio propio por herramienta: las descargas corren en paralelo
+        work_dir = Path(tempfile.mkdtemp(prefix=f"brainbash-{tool}-"))
+
+        with self._span(tool, "binary"):
+            try:
+                with self._span(f"{tool} download", "download"):
+                    binary = self._fetch_binary(tool, work_dir, allow_musl)
+
+                if binary:
+                    self._place_binary(tool, binary)
+                elif tool in INSTALL_SCRIPTS and not self.offline:
+                    # Sin asset para esta arquitectura: script oficial (tambien privilegiado)
+                    with self._bin_lock:
+                        self._run(INSTALL_SCRIPTS[tool].format(sudo=" ".join(self.sudo_cmd)), shell=True)
+                else:
+                    self._log_error(f"No se encontro un binario de {tool} para esta arquitectura.")
+                    return
+
+                if tool == "starship":
+                    self._install_nerd_fonts()
+
+                self._log_info(f"{tool} instalado.")
+                if shutil.which(tool) or Path(f"/usr/local/bin/{tool}").exists():
+                    self._mark_done(f"binary:{tool}", binary_inputs)
+            except Exception as e:
+                self._log_error(f"Error {tool}: {e}")
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,394 @@
+import hashlib
+import http.client
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+# Reintentos ante cortes de conexion (cada uno reanuda desde el ultimo byte recibido)
+RETRIES = int(os.environ.get("BRAINBASH_DOWNLOAD_RETRIES", 5))
+BACKOFF = 1.0        # segundos del primer reintento; se duplica en cada fallo seguido
+CHUNK = 1024 * 1024
+
+# Conexiones en paralelo para archivos grandes (tarball de Ollama) y tamaño minimo por segmento
+SEGMENTS = int(os.environ.get("BRAINBASH_DOWNLOAD_SEGMENTS", 4))
+MIN_SEGMENT = 8 * 1024 * 1024
+
+# Archivos de checksums que suelen publicarse junto a los assets de una release
+CHECKSUM_FILES = ["{name}.sha256", "sha256sum.txt", "SHA256SUMS", "checksums.txt"]
+
+_HEX64 = re.compile(r"^[0-9a-fA-F]{64}$")
+
+
+class DownloadError(Exception):
+    """La descarga no se pudo completar tras los reintentos."""
+
+
+class ChecksumError(DownloadError):
+    """El archivo descargado no coincide con el checksum esperado."""
+
+
+def _total_from_headers(response, offset: int) -> Optional[int]:
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    length = response.headers.get("Content-Length")
+    return offset + int(length) if length is not None else None
+
+
+class ResumableReader:
+    """
+    Lector secuencial de 'url' a partir de 'offset'. Si la conexion se corta
+    reconecta con 'Range: bytes=N-' y sigue donde quedo, con backoff exponencial.
+    Si el servidor ignora el Range (responde 200) se descartan los bytes ya leidos.
+    Con 'end' lee solo hasta ese byte inclusive (un segmento del archivo).
+    """
+
+    def __init__(self, url: str, offset: int = 0, retries: int = RETRIES, backoff: float = BACKOFF,
+                 timeout: float = 60, sleep: Callable[[float], None] = time.sleep, end: Optional[int] = None):
+        self.url = url
+        self.offset = offset
+        self.end = end
+        self.total = None
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.sleep = sleep
+        self.reconnects = 0
+        self._failures = 0
+        self._response = None
+        self._connect()
+
+    def _connect(self):
+        headers = {"User-Agent": "python"}
+        if self.end is not None:
+            headers["Range"] = f"bytes={self.offset}-{self.end}"
+        elif self.offset:
+            headers["Range"] = f"bytes={self.offset}-"
+        req = urllib.request.Request(self.url, headers=headers)
+        try:
+            response = urllib.request.urlopen(req, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and self.offset:
+                # Ya tenemos todo: 'bytes */total' confirma el tamaño
+                total = e.headers.get("Content-Range", "").rpartition("/")[2]
+                if total.isdigit() and int(total) == self.offset:
+                    self.total = self.offset
+                    self._response = None
+                    return
+            raise
+        if (self.offset or self.end is not None) and response.status != 206:
+            # Sin soporte de Range: saltamos lo que ya teniamos
+            skip = self.offset
+            while skip:
+                data = response.read(min(CHUNK, skip))
+                if not data:
+                    response.close()
+                    raise DownloadError(f"{self.url}: el servidor devolvio menos datos que los ya descargados")
+                skip -= len(data)
+            self.total = _total_from_headers(response, 0)
+        elif self.end is not None:
+            self.total = self.end + 1
+        else:
+            self.total = _total_from_headers(response, self.offset)
+        if self.end is not None and self.total is not None:
+            self.total = min(self.total, self.end + 1)
+        self._response = response
+
+    def _retry(self, error: Exception):
+        self._failures += 1
+        if self._failures > self.retries:
+            raise DownloadError(f"{self.url}: {error} (tras {self.retries} reintentos)")
+        self.sleep(self.backoff * 2 ** (self._failures - 1))
+        self.reconnects += 1
+        if self._response is not None:
+            try: self._response.close()
+            except OSError: pass
+        try:
+            self._connect()
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500 and e.code != 429:
+                raise DownloadError(f"{self.url}: HTTP {e.code} {e.reason}")
+            self._response = None
+        except (OSError, http.client.HTTPException):
+            self._response = None
+
+    def read(self, size: int = -1) -> bytes:
+        while True:
+            try:
+                if self._response is None:
+                    if self.total is not None and self.offset >= self.total:
+                        return b""
+                    raise ConnectionError("sin conexion")
+                if self.end is not None:
+                    # Segmento: nunca leemos mas alla de 'end' (aunque el servidor mande todo)
+                    remaining = self.total - self.offset
+                    if remaining <= 0:
+                        return b""
+                    size = remaining if size < 0 else min(size, remaining)
+                data = self._response.read(size)
+                if not data and self.total is not None and self.offset < self.total:
+                    raise http.client.IncompleteRead(b"", self.total - self.offset)
+            except (OSError, http.client.HTTPException) as e:
+                self._retry(e)
+                continue
+            self.offset += len(data)
+            if data:
+                self._failures = 0
+            return data
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_resumable(url: str, offset: int = 0, retries: int = RETRIES, backoff: float = BACKOFF,
+                   timeout: float = 60, sleep: Callable[[float], None] = time.sleep,
+                   end: Optional[int] = None) -> ResumableReader:
+    """ResumableReader que reintenta tambien la primera conexion (5xx, 429, red)."""
+    for attempt in range(retries + 1):
+        try:
+            return ResumableReader(url, offset, retries, backoff, timeout, sleep, end=end)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                raise
+            if (400 <= e.code < 500 and e.code != 429) or attempt == retries:
+                raise DownloadError(f"{url}: HTTP {e.code} {e.reason}")
+        except (OSError, http.client.HTTPException) as e:
+            if attempt == retries:
+                raise DownloadError(f"{url}: {e} (tras {retries} reintentos)")
+        sleep(backoff * 2 ** attempt)
+
+
+def download(url: str, dest, sha256: Optional[str] = None, retries: int = RETRIES,
+             backoff: float = BACKOFF, timeout: float = 60,
+             sleep: Callable[[float], None] = time.sleep, stats: Optional[Dict] = None) -> str:
+    """
+    Descarga 'url' a 'dest' y retorna su SHA-256.
+    Lo recibido se guarda en '<dest>.part': si el proceso muere, la proxima
+    llamada continua desde ahi (HTTP Range). Si se indica sha256 se verifica
+    antes de mover el archivo a 'dest' (y un .part corrupto se descarta).
+    'stats' (opcional) recibe bytes/seconds/segments de esta descarga.
+    """
+    started = time.monotonic()
+    dest = Path(dest)
+    part = dest.with_name(dest.name + ".part")
+    digest = hashlib.sha256()
+    offset = 0
+    if part.exists():
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK), b""):
+                digest.update(chunk)
+                offset += len(chunk)
+
+    try:
+        reader = open_resumable(url, offset, retries, backoff, timeout, sleep)
+    except urllib.error.HTTPError as e:
+        if offset == 0:
+            # Sin .part (o ya reiniciado) no hay nada que descartar
+            raise DownloadError(f"{url}: HTTP {e.code} {e.reason}")
+        # 416 con un .part que no calza con el archivo remoto: empezamos de cero
+        part.unlink()
+        return download(url, dest, sha256, retries, backoff, timeout, sleep, stats)
+
+    received = 0
+    with reader, open(part, "ab") as out:
+        for chunk in iter(lambda: reader.read(CHUNK), b""):
+            out.write(chunk)
+            digest.update(chunk)
+            received += len(chunk)
+    if stats is not None:
+        stats.update(bytes=received, seconds=time.monotonic() - started, segments=1)
+
+    actual = digest.hexdigest()
+    if sha256 and actual != sha256.lower():
+        part.unlink()
+        raise ChecksumError(f"SHA-256 no coincide para {url}: esperado {sha256}, obtenido {actual}")
+    os.replace(part, dest)
+    return actual
+
+
+# --- Descarga segmentada (varias conexiones) ---
+
+def probe_ranges(url: str, timeout: float = 20) -> Tuple[Optional[int], bool]:
+    """(tamaño total, acepta Range) pidiendo solo el primer byte. (None, False) si falla."""
+    req = urllib.request.Request(url, headers={"User-Agent": "python", "Range": "bytes=0-0"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            if response.status == 206:
+                return _total_from_headers(response, 0), True
+            length = response.headers.get("Content-Length")
+            return (int(length) if length is not None else None), False
+    except (OSError, http.client.HTTPException, ValueError):
+        return None, False
+
+
+def _plan_segments(total: int, count: int):
+    size = -(-total // count)
+    return [[start, min(start + size, total) - 1, start] for start in range(0, total, size)]
+
+
+def segmented_download(url: str, dest, sha256: Optional[str] = None, segments: int = SEGMENTS,
+                       retries: int = RETRIES, backoff: float = BACKOFF, timeout: float = 60,
+                       sleep: Callable[[float], None] = time.sleep, stats: Optional[Dict] = None) -> str:
+    """
+    Como download(), pero en 'segments' conexiones en paralelo (Range) sobre un
+    archivo preasignado: en enlaces con mucha latencia una sola conexion TCP no
+    llena el ancho de banda. Si el servidor no acepta Range o el archivo es chico,
+    cae a download(). El avance de cada segmento queda en '<dest>.seg.json', asi
+    que un proceso interrumpido retoma cada segmento donde quedo.
+    """
+    total, ranges = probe_ranges(url, timeout)
+    count = min(segments, (total or 0) // MIN_SEGMENT)
+    if not ranges or count < 2:
+        return download(url, dest, sha256, retries, backoff, timeout, sleep, stats)
+
+    started = time.monotonic()
+    dest = Path(dest)
+    seg_path = dest.with_name(dest.name + ".seg")
+    state_path = dest.with_name(dest.name + ".seg.json")
+    plan = None
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("url") == url and saved.get("total") == total and seg_path.exists() \
+                and seg_path.stat().st_size == total:
+            plan = saved["segments"]
+    except (OSError, ValueError, KeyError):
+        pass
+    if plan is None:
+        plan = _plan_segments(total, count)
+        with open(seg_path, "wb") as f:
+            try:
+                os.posix_fallocate(f.fileno(), 0, total)
+            except (AttributeError, OSError):
+                f.truncate(total)
+    resumed = sum(pos - start for start, _, pos in plan)
+
+    lock = threading.Lock()
+    last_saved = [0.0]
+
+    def save_state(force=False):
+        # Cada ~1 s como mucho: lo escrito despues del ultimo guardado se vuelve a bajar
+        now = time.monotonic()
+        if not force and now - last_saved[0] < 1:
+            return
+        last_saved[0] = now
+        tmp = state_path.with_name(state_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "total": total, "segments": plan}, f)
+        os.replace(tmp, state_path)
+
+    fd = os.open(str(seg_path), os.O_WRONLY)
+
+    def fetch_segment(segment):
+        start, end, pos = segment
+        if pos > end:
+            return
+        with open_resumable(url, pos, retries, backoff, timeout, sleep, end=end) as reader:
+            for chunk in iter(lambda: reader.read(CHUNK), b""):
+                os.pwrite(fd, chunk, pos)
+                pos += len(chunk)
+                with lock:
+                    segment[2] = pos
+                    save_state()
+        if pos != end + 1:
+            raise DownloadError(f"{url}: el segmento {start}-{end} quedo incompleto ({pos - start} bytes)")
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(plan), thread_name_prefix="segment") as pool:
+            for future in [pool.submit(fetch_segment, segment) for segment in plan]:
+                future.result()
+    finally:
+        os.close(fd)
+        with lock:
+            save_state(force=True)
+
+    digest = hashlib.sha256()
+    with open(seg_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            digest.update(chunk)
+    actual = digest.hexdigest()
+    state_path.unlink()
+    if sha256 and actual != sha256.lower():
+        seg_path.unlink()
+        raise ChecksumError(f"SHA-256 no coincide para {url}: esperado {sha256}, obtenido {actual}")
+    os.replace(seg_path, dest)
+    if stats is not None:
+        stats.update(bytes=total - resumed, seconds=time.monotonic() - started, segments=len(plan))
+    return actual
+
+
+def format_transfer(stats: Dict) -> str:
+    """'1534.2 MB en 38.1 s (40.3 MB/s, 4 conexiones)'."""
+    mb = stats["bytes"] / (1024 * 1024)
+    rate = mb / stats["seconds"] if stats["seconds"] > 0 else 0
+    return f"{mb:.1f} MB en {stats['seconds']:.1f} s ({rate:.1f} MB/s, {stats['segments']} conexiones)"
+
+
+# --- Checksums publicados ---
+
+_checksum_files: Dict[str, Optional[str]] = {}
+_checksum_lock = threading.Lock()
+
+
+def _fetch_text(url: str, timeout: float) -> Optional[str]:
+    with _checksum_lock:
+        if url in _checksum_files:
+            return _checksum_files[url]
+    text = None
+    try:
+        req = urllib.request.Request(url, headers={"User-Agent": "python"})
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            # Un archivo de checksums es chico: si no, no es lo que buscamos
+            data = response.read(1024 * 1024 + 1)
+            if len(data) <= 1024 * 1024:
+                text = data.decode("utf-8", "replace")
+    except (OSError, http.client.HTTPException, ValueError):
+        pass
+    with _checksum_lock:
+        _checksum_files[url] = text
+    return text
+
+
+def parse_checksums(text: str, name: str) -> Optional[str]:
+    """SHA-256 de 'name' en un archivo estilo sha256sum ('<hex>  [*]name') o de un solo hash."""
+    lines = [line.split() for line in text.splitlines() if line.strip()]
+    for parts in lines:
+        if len(parts) >= 2 and _HEX64.match(parts[0]):
+            if parts[-1].lstrip("*").split("/")[-1] == name:
+                return parts[0].lower()
+    if len(lines) == 1 and _HEX64.match(lines[0][0]) and (len(lines[0]) == 1 or lines[0][-1].lstrip("*") == name):
+        return lines[0][0].lower()
+    return None
+
+
+def published_sha256(url: str, timeout: float = 10) -> Optional[str]:
+    """
+    Busca el checksum de 'url' en los archivos que se publican en el mismo
+    directorio (sha256sum.txt, <archivo>.sha256, ...). None si no hay ninguno.
+    Las consultas se recuerdan por proceso (varios assets comparten archivo).
+    """
+    base, _, name = url.split("?", 1)[0].rpartition("/")
+    if not base or not name:
+        return None
+    for pattern in CHECKSUM_FILES:
+        text = _fetch_text(f"{base}/{pattern.format(name=name)}", timeout)
+        if text:
+            found = parse_checksums(text, name)
+            if found:
+                return found
+    return None
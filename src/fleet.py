@@ -0,0 +1,162 @@
+import io
+import json
+import shlex
+import subprocess
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+# Comando por defecto para llegar a cada host. {host} se reemplaza por el nombre.
+# Para contenedores locales: "docker exec -i {host} sh -c"
+DEFAULT_SSH_CMD = "ssh -o BatchMode=yes {host}"
+
+# Directorio remoto donde se copia el repo (relativo al HOME remoto)
+REMOTE_DIR = ".brainbash-fleet"
+
+# Nombre con el que viaja el perfil dentro del paquete
+REMOTE_PROFILE = "fleet_profile.json"
+
+# Cosas del repo que no hace falta subir
+EXCLUDED_NAMES = {".git", "__pycache__", ".pytest_cache", "installation_log.log",
+                  "ollama.log", "brainbash_trace.json"}
+
+
+def read_hosts(path) -> List[str]:
+    """Un host por linea; se ignoran lineas vacias y comentarios (#)."""
+    hosts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                hosts.append(line)
+    return hosts
+
+
+def build_payload(repo_root: Path, profile_path) -> bytes:
+    """Empaqueta el repo + perfil una sola vez (tar.gz en memoria) para todos los hosts."""
+    def skip(info):
+        parts = Path(info.name).parts
+        if any(p in EXCLUDED_NAMES for p in parts) or info.name.endswith(".pyc"):
+            return None
+        return info
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for child in sorted(repo_root.iterdir()):
+            tar.add(str(child), arcname=child.name, filter=skip)
+        tar.add(str(profile_path), arcname=REMOTE_PROFILE)
+    return buf.getvalue()
+
+
+class FleetRunner:
+    """
+    Ejecuta el instalador en varios hosts en paralelo (con limite de concurrencia).
+    Cada host recibe el repo por stdin, corre main.py --profile y su salida se
+    muestra con el prefijo [host].
+    """
+
+    def __init__(self, hosts: List[str], payload: bytes, concurrency: int = 4,
+                 ssh_cmd: str = DEFAULT_SSH_CMD, extra_args: List[str] = None):
+        if "{host}" not in ssh_cmd:
+            raise ValueError("ssh_cmd debe contener {host}")
+        self.hosts = hosts
+        self.payload = payload
+        self.concurrency = max(1, concurrency)
+        self.ssh_cmd = ssh_cmd
+        self.extra_args = extra_args or []
+        self._print_lock = threading.Lock()
+        self._procs = {}
+
+    def _argv(self, host: str, script: str) -> List[str]:
+        return [part.replace("{host}", host) for part in shlex.split(self.ssh_cmd)] + [script]
+
+    def _emit(self, host: str, line: str):
+        with self._print_lock:
+            print(f"[{host}] {line}", flush=True)
+
+    def _stream(self, host: str, argv: List[str], stdin_data: bytes = None) -> int:
+        proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        self._procs[host] = proc
+
+        # stdin en un hilo aparte: si el payload es grande no bloqueamos la lectura
+        def feed():
+            try:
+                if stdin_data: proc.stdin.write(stdin_data)
+            except BrokenPipeError:
+                pass
+            finally:
+                proc.stdin.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        for raw in proc.stdout:
+            self._emit(host, raw.decode("utf-8", "replace").rstrip("\n"))
+        feeder.join()
+        return proc.wait()
+
+    def run_host(self, host: str) -> Dict:
+        result = {"host": host, "push_s": 0.0, "run_s": 0.0, "exit": None, "stage": "push"}
+        start = time.time()
+        remote = f'"$HOME"/{REMOTE_DIR}'
+        try:
+            # 1. Subir el repo (una vez por host)
+            push = f"rm -rf {remote} && mkdir -p {remote} && tar -xzf - -C {remote}"
+            code = self._stream(host, self._argv(host, push), self.payload)
+            result["push_s"] = round(time.time() - start, 2)
+            if code != 0:
+                result["exit"] = code
+                return result
+
+            # 2. Ejecutar el instalador desatendido
+            result["stage"] = "run"
+            run_start = time.time()
+            args = " ".join(shlex.quote(a) for a in self.extra_args)
+            run = (f'cd {remote} && SUDO=""; [ "$(id -u)" -eq 0 ] || SUDO="sudo -n"; '
+                   f'$SUDO python3 main.py --profile {REMOTE_PROFILE} {args}')
+            result["exit"] = self._stream(host, self._argv(host, run))
+            result["run_s"] = round(time.time() - run_start, 2)
+            result["stage"] = "done"
+        except OSError as e:
+            self._emit(host, f"[ERROR] No se pudo ejecutar el comando remoto: {e}")
+            result["exit"] = 255
+        finally:
+            result["total_s"] = round(time.time() - start, 2)
+        return result
+
+    def run(self) -> List[Dict]:
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="fleet")
+        # Afuera del try: un Ctrl-C a mitad del submit tambien cancela lo ya encolado
+        futures = []
+        try:
+            for host in self.hosts:
+                futures.append(pool.submit(self.run_host, host))
+            return [f.result() for f in futures]
+        except KeyboardInterrupt:
+            # Cortamos todo: los hosts pendientes no arrancan y los activos se terminan
+            for future in futures:
+                future.cancel()
+            for proc in self._procs.values():
+                if proc.poll() is None: proc.terminate()
+            raise
+        finally:
+            pool.shutdown(wait=True)
+
+
+def render_report(results: List[Dict]) -> str:
+    lines = [f"{'HOST':<28} {'ESTADO':<12} {'EXIT':>4} {'PUSH(s)':>8} {'RUN(s)':>8} {'TOTAL(s)':>9}"]
+    for r in results:
+        status = "OK" if r["exit"] == 0 else f"FALLO/{r['stage']}"
+        lines.append(f"{r['host']:<28} {status:<12} {str(r['exit']):>4} "
+                     f"{r['push_s']:>8.2f} {r['run_s']:>8.2f} {r['total_s']:>9.2f}")
+    ok = sum(1 for r in results if r["exit"] == 0)
+    lines.append(f"{ok}/{len(results)} hosts OK")
+    return "\n".join(lines)
+
+
+def write_report(results: List[Dict], path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"hosts": results}, f, indent=2)
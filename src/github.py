@@ -0,0 +1,125 @@
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+API_URL = "https://api.github.com"
+
+# Segundos durante los que la metadata de una release se usa sin consultar la API
+RELEASES_TTL = int(os.environ.get("BRAINBASH_GITHUB_TTL", 3600))
+
+
+class GitHubError(Exception):
+    """La API de GitHub no respondio y no hay copia local."""
+
+
+def github_token() -> str:
+    """Token opcional (GITHUB_TOKEN o GH_TOKEN): sube el limite de 60 a 5000 consultas/hora."""
+    return os.environ.get("GITHUB_TOKEN") or os.environ.get("GH_TOKEN") or ""
+
+
+class ReleaseCache:
+    """
+    Cache en disco de /repos/<repo>/releases/latest.
+    Dentro del TTL no hay red; pasado el TTL se revalida con If-None-Match /
+    If-Modified-Since (un 304 no consume cuota de la API). Si la API falla
+    (limite, sin red) se usa la ultima copia conocida.
+    """
+
+    def __init__(self, root, ttl: int = RELEASES_TTL, token: Optional[str] = None):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.token = github_token() if token is None else token
+        # Offline (bundle): solo la copia local, sin importar el TTL
+        self.offline = False
+
+    def _path(self, repo: str) -> Path:
+        return self.root / (repo.replace("/", "__") + ".json")
+
+    def _load(self, repo: str) -> Optional[Dict]:
+        try:
+            with open(self._path(repo), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, repo: str, entry: Dict):
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(repo)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+
+    def latest(self, repo: str, warn: Optional[Callable[[str], None]] = None) -> Dict:
+        """JSON de la ultima release de 'repo' (desde disco si esta fresca)."""
+        entry = self._load(repo)
+        if entry and (self.offline or time.time() - entry.get("fetched_at", 0) < self.ttl):
+            return entry["data"]
+        if self.offline:
+            raise GitHubError(f"Modo offline: no hay metadata de {repo} en el bundle")
+
+        headers = {"User-Agent": "brainbash", "Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        req = urllib.request.Request(f"{API_URL}/repos/{repo}/releases/latest", headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=20) as response:
+                data = json.loads(response.read().decode())
+                entry = {"etag": response.headers.get("ETag"),
+                         "last_modified": response.headers.get("Last-Modified"),
+                         "data": data}
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entry:
+                pass  # Sin cambios: renovamos el TTL de la copia local
+            elif entry:
+                if warn: warn(f"GitHub respondio {e.code} para {repo}; usando metadata en cache.")
+                return entry["data"]
+            else:
+                raise GitHubError(f"GitHub respondio {e.code} para {repo}: {e.reason}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            if entry:
+                if warn: warn(f"Sin acceso a GitHub ({e}); usando metadata en cache de {repo}.")
+                return entry["data"]
+            raise GitHubError(f"No se pudo consultar {repo}: {e}")
+
+        entry["fetched_at"] = time.time()
+        try:
+            self._save(repo, entry)
+        except OSError:
+            pass
+        return entry["data"]
+
+
+def asset_sha256(release: Dict, url: str) -> Optional[str]:
+    """SHA-256 que la API publica para el asset ('digest': 'sha256:...'), si lo hay."""
+    for asset in release.get("assets", []):
+        if asset.get("browser_download_url") == url:
+            digest = asset.get("digest") or ""
+            if digest.startswith("sha256:"):
+                return digest.split(":", 1)[1]
+    return None
+
+
+def select_asset(release: Dict, arch_terms: List[str], keyword: str = "",
+                 allow_musl: bool = False) -> Optional[Tuple[str, str]]:
+    """(url, tag) del primer asset Linux de la release que calza con la arquitectura."""
+    for asset in release.get("assets", []):
+        name = asset["name"].lower()
+        if "linux" not in name and "unknown-linux" not in name: continue
+        if not any(term in name for term in arch_terms): continue
+        if keyword and keyword not in name: continue
+        # Checksums/firmas que comparten nombre con el archivo real
+        if name.endswith((".sha256", ".sig", ".asc")): continue
+        # Si allow_musl es False, evitamos musl (para glibc distros)
+        if "musl" in name and not allow_musl: continue
+        return asset["browser_download_url"], release.get("tag_name", "")
+    return None
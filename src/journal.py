@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+try:
+    import pwd
+except ImportError:
+    pwd = None
+
+
+def journal_path(home: Path) -> Path:
+    """Ubicacion del journal para el usuario destino (sobrevive al borrado del repo temporal)."""
+    return home / ".local" / "state" / "brainbash" / "journal.json"
+
+
+def chown_to_user(path: Path, user: Optional[str]):
+    """
+    Con sudo, un archivo de estado escrito por root (y los directorios creados para el
+    dentro del home) pasa al usuario destino, como el resto de lo que se escribe en su home.
+    """
+    if not user or pwd is None or os.geteuid() != 0:
+        return
+    try:
+        record = pwd.getpwnam(user)
+    except KeyError:
+        return
+    home = Path(record.pw_dir)
+    path = Path(path)
+    for target in [path] + [p for p in path.parents if home in p.parents]:
+        try:
+            os.chown(target, record.pw_uid, record.pw_gid)
+        except OSError:
+            pass
+
+
+def _digest(inputs) -> str:
+    raw = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class Journal:
+    """
+    Registro persistente de pasos y sub-pasos completados, con sus entradas.
+    Claves de ejemplo: 'step:packages', 'ollama.pull:qwen3:0.6b', 'binary:eza'.
+    Un paso cuenta como hecho solo si sus entradas coinciden con las registradas.
+    Con path=None vive solo en memoria (util cuando no hay donde escribir).
+    'owner' es el usuario destino: el archivo queda suyo aunque se corra con sudo.
+    """
+
+    def __init__(self, path: Optional[Path] = None, resume: bool = False, owner: Optional[str] = None):
+        self.path = Path(path) if path else None
+        self.owner = owner
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        if self.path and resume and self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f).get("entries", {})
+            except (OSError, ValueError):
+                # Journal corrupto: arrancamos de cero en vez de abortar
+                self.entries = {}
+        elif self.path:
+            # Corrida nueva: el journal anterior ya no aplica
+            self._save()
+
+    def is_done(self, key: str, inputs=None) -> bool:
+        with self._lock:
+            entry = self.entries.get(key)
+        return entry is not None and entry.get("inputs") == _digest(inputs)
+
+    def mark_done(self, key: str, inputs=None):
+        with self._lock:
+            self.entries[key] = {"inputs": _digest(inputs), "at": int(time.time())}
+            self._save()
+
+    def _save(self):
+        """Escribe el journal; se llama con el lock tomado (o antes de que haya hilos)."""
+        if not self.path:
+            return
+        data = {"version": 1, "entries": dict(self.entries)}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Escritura atomica: un corte a mitad no deja el journal roto. El lock se mantiene
+            # hasta el replace para que un snapshot viejo nunca pise a uno mas nuevo.
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
+            chown_to_user(self.path, self.owner)
+        except OSError as e:
+            print(f"[AVISO] No se pudo guardar el journal ({self.path}): {e}")
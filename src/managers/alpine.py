@@ -1,75 +1,107 @@
+import os
+import re
 import subprocess
-from typing import List
+from typing import List, Optional, Sequence
 from ..core import PackageManager
 
+# "py3-pip-23.3.1-r0" -> "py3-pip"
+APK_VERSION_RE = re.compile(r"^(.+?)-\d[^-]*-r\d+$")
+
 class AlpineManager(PackageManager):
     """
     Implementacion especifica para Alpine Linux (APK).
     Ideal para entornos ligeros y contenedores.
     """
+    METADATA_GLOBS = [
+        "/var/cache/apk/APKINDEX.*.tar.gz",
+        "/etc/apk/cache/APKINDEX.*.tar.gz"
+    ]
+    STAGE_PACKAGES = {
+        "fonts": ["fontconfig"],
+        # Ollama nativo: los binarios glibc de GitHub segfaultean en musl
+        "ollama": ["ollama"],
+        # 'shadow' trae chsh/usermod
+        "shell": ["shadow"]
+    }
+    MANUAL_TOOLS = PackageManager.MANUAL_TOOLS | {"thefuck"}
+    PACKAGE_SUFFIX = ".apk"
+    # Con --cache-dir apk guarda tambien los APKINDEX ahi
+    CACHE_METADATA_GLOBS = ["{cache}/APKINDEX.*.tar.gz"]
 
     def update(self):
+        self.refresh_metadata()
+
+    def _refresh_metadata(self):
         print("[Alpine] Actualizando indices de repositorios...")
         # Usamos self.sudo_cmd que detecta si somos root o no
-        subprocess.run(self.sudo_cmd + ["apk", "update"], check=True)
+        self._run(self.sudo_cmd + ["apk", "update"] + self._cache_opts(), check=True)
 
-    def install(self, packages: List[str]):
-        apk_packages = []
-        manual_packages = []
-        
+    def _split_packages(self, packages: List[str], stages: Sequence[str] = ()):
         # En Alpine, muchas "modern tools" SI estan en los repos (community/edge).
         # Es preferible usarlas nativas que bajar binarios glibc que segfaultean (como Ollama).
-        # Mapeo manual de nombres si difieren
-        
-        for pkg in packages:
-            mapped = self._get_mapped_name(pkg)
-            
-            # tldr no parece estar en alpine standard ("tealdeer" tampoco en search)
-            # asi que lo mandamos a manual.
-            if pkg == "tldr" or mapped == "tldr":
-                manual_packages.append("tldr")
-            elif pkg == "thefuck" or mapped == "thefuck":
-                manual_packages.append("thefuck")
-            else:
-                apk_packages.append(mapped)
-
-        # Force install 'ollama' via APK if we are in this manager
-        if "ollama" not in apk_packages:
-            apk_packages.append("ollama")
+        # El indice de 'apk search' decide; lo que falte va manual (tldr de GitHub, thefuck via pip).
+        apk_packages, manual_packages = self._resolve_sources(packages)
+
+        # Lo que piden las otras etapas (ollama, fontconfig, shadow) va en la misma transaccion
+        for pkg in self.stage_packages(stages):
+            if pkg not in apk_packages: apk_packages.append(pkg)
 
         # Asegurar pip si vamos a usar pip (para thefuck)
         if "thefuck" in manual_packages or "python3-dev" in apk_packages:
              if "py3-pip" not in apk_packages: apk_packages.append("py3-pip")
 
+        # gcompat puede ser util para tldr manual, pero los nativos no lo necesitan.
+        if manual_packages:
+            if "gcompat" not in apk_packages: apk_packages.append("gcompat")
+            if "libstdc++" not in apk_packages: apk_packages.append("libstdc++")
+            if "curl" not in apk_packages: apk_packages.append("curl")
+        return apk_packages, manual_packages
+
+    def _prefetch(self, native_packages: List[str]):
+        # Sin cache (--pkg-cache o /etc/apk/cache) apk no tiene donde dejar lo descargado
+        if not self.pkg_cache and not os.path.isdir("/etc/apk/cache"):
+            self._log_info("APK sin cache configurado: se omite la pre-descarga.")
+            return
+        self.refresh_metadata()
+        # 'apk cache download' deja los .apk (con dependencias) en el cache; 'apk add' los reutiliza
+        self._run(self.sudo_cmd + ["apk"] + self._cache_opts() + ["cache", "--add-dependencies", "download"]
+                  + native_packages, check=True)
+
+    def install(self, packages: List[str], stages: Sequence[str] = ()):
+        apk_packages, manual_packages = self._split_packages(packages, stages)
+
+        # Lo que ya esta en la base de apk no llega a apk add
+        apk_packages = self._drop_installed(apk_packages)
+
         # 1. APK
         if apk_packages:
             print(f"[Alpine] Instalando paquetes nativos: {', '.join(apk_packages)}")
-            # gcompat puede ser util para tldr manual, pero los nativos no lo necesitan.
-            if manual_packages:
-                if "gcompat" not in apk_packages: apk_packages.append("gcompat")
-                if "libstdc++" not in apk_packages: apk_packages.append("libstdc++")
-                if "curl" not in apk_packages: apk_packages.append("curl")
-            
-            # Ensure 'shadow' is installed for chsh/usermod
-            if "shadow" not in apk_packages: apk_packages.append("shadow")
-
-            cmd = self.sudo_cmd + ["apk", "add", "--no-cache"] + apk_packages
+            # '--no-cache' re-baja los indices en cada 'apk add'. Refrescamos solo si
+            # estan viejos (persistiendolos en disco) y despues usamos los locales.
+            self.refresh_metadata()
+            cmd = self.sudo_cmd + ["apk", "add"] + self._cache_opts() + apk_packages
+            cache_token = self._cache_begin()
             try:
-                subprocess.run(cmd, check=True)
+                self._run(cmd, check=True)
             except subprocess.CalledProcessError:
                 print("[Error] Fallo la instalacion con APK.")
                 raise
+            finally:
+                self.invalidate_installed()
+                self._cache_end(cache_token)
 
-        # 2. Binarios Manuales (Solo tldr, thefuck)
-        for tool in manual_packages:
-            self._install_binary(tool, allow_musl=True)
+        if "starship" in apk_packages:
+            self._install_nerd_fonts()
+
+        # 2. Binarios Manuales (lo que no esta en los repos)
+        self.install_binaries(manual_packages, allow_musl=True)
 
     def _install_binary(self, tool, allow_musl=False):
         if tool == "thefuck":
             print("[Alpine] Instalando 'thefuck' via Pip...")
             try:
                 # Alpine 3.19+ requiere --break-system-packages o venv
-                subprocess.run(self.sudo_cmd + ["pip", "install", "thefuck", "--break-system-packages"], check=True)
+                self._run(self.sudo_cmd + ["pip", "install", "thefuck", "--break-system-packages"], check=True)
                 return
             except Exception as e:
                 print(f"[Error] Fallo instalando thefuck: {e}")
@@ -85,10 +117,42 @@ class AlpineManager(PackageManager):
         
         super()._install_binary(tool, allow_musl)
 
+    def _cache_opts(self) -> List[str]:
+        if not self.pkg_cache:
+            return []
+        return ["--cache-dir", str(self.pkg_cache.path)]
+
+    def _cache_package_name(self, filename: str) -> Optional[str]:
+        # "py3-pip-23.3.1-r0.1a2b3c4d.apk" -> "py3-pip"
+        match = APK_VERSION_RE.match(filename[:-len(".apk")].rsplit(".", 1)[0])
+        return match.group(1) if match else None
+
+    def _query_available(self, names: List[str]):
+        self.refresh_metadata()
+        # Una sola busqueda exacta: "nombre-version-rN" por cada paquete encontrado
+        out = self._run(["apk", "search", "-e"] + self._cache_opts() + names,
+                        capture_output=True, text=True, check=True).stdout
+        available = set()
+        for line in out.splitlines():
+            match = APK_VERSION_RE.match(line.strip())
+            if match:
+                available.add(match.group(1))
+        return available
+
+    def _query_installed(self):
+        # 'apk info -v' lista "nombre-version-rN"; nos quedamos con el nombre
+        out = self._run(["apk", "info", "-v"], capture_output=True, text=True, check=True).stdout
+        installed = set()
+        for line in out.splitlines():
+            match = APK_VERSION_RE.match(line.strip())
+            if match:
+                installed.add(match.group(1))
+        return installed
+
     def install_fontconfig(self):
         print("[Alpine] Instalando fontconfig...")
         try:
             # En Alpine, el paquete principal es fontconfig
-            subprocess.run(self.sudo_cmd + ["apk", "add", "fontconfig"], check=True)
+            self._run(self.sudo_cmd + ["apk", "add"] + self._cache_opts() + ["fontconfig"], check=True)
         except subprocess.CalledProcessError:
             print("[Error] No se pudo instalar fontconfig.")
@@ -1,81 +1,107 @@
 import subprocess
 import os
 import shutil
-from pathlib import Path
-from typing import List
-from ..core import PackageManager
+from typing import List, Optional, Sequence
+from ..core import PackageManager, artifact_cache, BAT_THEME_URL
 
 class DebianManager(PackageManager):
+    METADATA_GLOBS = [
+        "/var/lib/apt/lists/*_InRelease",
+        "/var/lib/apt/lists/*_Release",
+        "/var/lib/apt/lists/*_Packages*"
+    ]
+    STAGE_PACKAGES = {
+        "fonts": ["fontconfig"],
+        "gemini": ["python3-venv"]
+    }
+    PACKAGE_SUFFIX = ".deb"
+
     def update(self):
         self._log_info("Ejecutando actualización completa del sistema...")
         try:
             # sudo apt update && sudo apt upgrade -y && sudo apt autoremove -y
-            subprocess.run(self.sudo_cmd + ["apt", "update"], check=True)
-            subprocess.run(self.sudo_cmd + ["apt", "upgrade", "-y"], check=True)
-            subprocess.run(self.sudo_cmd + ["apt", "autoremove", "-y"], check=True)
-            # Actualizamos pip aqui para evitar warnings al final
-            self._log_info("Actualizando pip...")
-            subprocess.run(self.sudo_cmd + ["python3", "-m", "pip", "install", "--upgrade", "pip", "--break-system-packages"], check=False)
+            # (apt update solo si las listas son mas viejas que el TTL)
+            self.refresh_metadata()
+            self._run(self.sudo_cmd + ["apt", "upgrade", "-y"] + self._cache_opts(), check=True)
+            self._run(self.sudo_cmd + ["apt", "autoremove", "-y"], check=True)
+            # Actualizamos pip aqui para evitar warnings al final (PyPI: no en modo offline)
+            if not self.offline:
+                self._log_info("Actualizando pip...")
+                self._run(self.sudo_cmd + ["python3", "-m", "pip", "install", "--upgrade", "pip", "--break-system-packages"], check=False)
         except subprocess.CalledProcessError:
             self._log_error("Falló la actualización. Continuando bajo su propio riesgo...")
 
-    def install(self, packages: List[str]):
-        apt_packages = []
-        manual_packages = []
-        
-        # Mapeo de herramientas modernas a instalación manual
-        # SOLO starship queda manual
-        modern_tools = ["starship"]
-
-        for pkg in packages:
-            # Mapeamos nombre generico a nombre de distro
-            mapped = self._get_mapped_name(pkg)
-            
-            # Caso especial: eza -> exa en Debian Stable
-            if pkg == "eza" or mapped == "eza": mapped = "exa"
-            # Caso especial: tldr -> tealdeer (Rust version, mas rapida)
-            if pkg == "tldr" or mapped == "tldr": mapped = "tealdeer"
-            
-            # Clasificamos
-            if mapped in modern_tools:
-                manual_packages.append(mapped)
-            else:
-                apt_packages.append(mapped)
-
-        # 1. APT (Base)
-        if apt_packages:
-            extras = ["curl", "wget", "tar", "unzip", "python3-venv", "procps"] 
-            to_install = list(set(apt_packages + extras))
-            self._log_info(f"Instalando via APT: {', '.join(to_install)}")
-            # Intento de instalacion con Auto-Healing (Retry con Update)
-            max_retries = 1
-            for attempt in range(max_retries + 1):
-                try:
-                    subprocess.run(self.sudo_cmd + ["apt", "install", "-y"] + to_install, check=True)
-                    break # Exito
-                except subprocess.CalledProcessError:
-                    if attempt < max_retries:
-                        self._log_warn("Fallo la instalacion APT. Intentando 'apt update' y reintentando...")
-                        try:
-                            subprocess.run(self.sudo_cmd + ["apt", "update"], check=True)
-                        except:
-                            pass # Si update falla, igual intentamos install una vez mas por si acaso
-                    else:
-                        self._log_error("Fallo APT definitivamente.")
+    def _split_packages(self, packages: List[str], stages: Sequence[str] = ()):
+        # Nativo primero segun el indice de apt (eza/exa, tealdeer/tldr...);
+        # solo lo que no esta en los repos va a instalacion manual
+        apt_packages, manual_packages = self._resolve_sources(packages)
+
+        # Base + lo que piden las otras etapas, en UNA transaccion
+        stage_packages = self.stage_packages(stages)
+        if not (apt_packages or stage_packages):
+            return [], manual_packages
+        extras = ["curl", "wget", "tar", "unzip", "python3-venv", "procps"] if apt_packages else []
+        return list(set(apt_packages + extras + stage_packages)), manual_packages
+
+    def _prefetch(self, native_packages: List[str]):
+        if self.metadata_age() is None and not self._metadata_refreshed:
+            self.refresh_metadata(force=True)
+        # Solo descarga los .deb al archivo de apt; 'apt install' los reutiliza
+        self._run(self.sudo_cmd + ["apt-get", "install", "--download-only", "-y"]
+                  + self._cache_opts() + native_packages, check=True)
+
+    def install(self, packages: List[str], stages: Sequence[str] = ()):
+        to_install, manual_packages = self._split_packages(packages, stages)
+
+        # 1. APT
+        if to_install:
+            # Lo que ya esta en dpkg no llega a apt
+            missing = self._drop_installed(to_install)
+            if missing and self.metadata_age() is None and not self._metadata_refreshed:
+                # Sin listas locales (contenedor recien creado) apt install falla seguro
+                self.refresh_metadata(force=True)
+            if missing:
+                self._log_info(f"Instalando via APT: {', '.join(missing)}")
+                # Intento de instalacion con Auto-Healing (Retry con Update)
+                max_retries = 1
+                cache_token = self._cache_begin()
+                for attempt in range(max_retries + 1):
+                    try:
+                        self._run(self.sudo_cmd + ["apt", "install", "-y"] + self._cache_opts() + missing, check=True)
+                        break # Exito
+                    except subprocess.CalledProcessError:
+                        if attempt < max_retries:
+                            # Si ya refrescamos en esta corrida, otro 'apt update' no va a cambiar nada
+                            if self._metadata_refreshed:
+                                self._log_warn("Fallo la instalacion APT. Reintentando...")
+                                continue
+                            self._log_warn("Fallo la instalacion APT. Intentando 'apt update' y reintentando...")
+                            try:
+                                self.refresh_metadata(force=True)
+                            except:
+                                pass # Si update falla, igual intentamos install una vez mas por si acaso
+                        else:
+                            self._log_error("Fallo APT definitivamente.")
+                self.invalidate_installed()
+                self._cache_end(cache_token)
 
             # Post-Install Hacks (Symlinks & Configs)
+
+            # 0. Starship nativo tambien necesita las Nerd Fonts
+            if "starship" in to_install:
+                self._install_nerd_fonts()
             
             # 1. exa -> eza
             if "exa" in to_install:
                     if shutil.which("exa") and not shutil.which("eza"):
                         self._log_info("Creando symlink eza -> exa...")
-                        subprocess.run(self.sudo_cmd + ["ln", "-s", "/usr/bin/exa", "/usr/local/bin/eza"], check=False)
+                        self._run(self.sudo_cmd + ["ln", "-s", "/usr/bin/exa", "/usr/local/bin/eza"], check=False)
             
             # 2. bat -> batcat
             if "bat" in to_install:
                     if shutil.which("batcat") and not shutil.which("bat"):
                         self._log_info("Creando symlink bat -> batcat...")
-                        subprocess.run(self.sudo_cmd + ["ln", "-s", "/usr/bin/batcat", "/usr/local/bin/bat"], check=False)
+                        self._run(self.sudo_cmd + ["ln", "-s", "/usr/bin/batcat", "/usr/local/bin/bat"], check=False)
                     
                     # 3. Instalar Tema Catppuccin Mocha
                     self._log_info("Instalando Catppuccin Mocha para bat...")
@@ -85,115 +111,94 @@ class DebianManager(PackageManager):
                         config_dir = "/job/.config/bat" if os.environ.get("HOME") == "/job" else f"{os.environ.get('HOME', '/root')}/.config/bat"
 
                     themes_dir = f"{config_dir}/themes"
-                    subprocess.run(self.sudo_cmd + ["mkdir", "-p", themes_dir], check=False)
+                    self._run(self.sudo_cmd + ["mkdir", "-p", themes_dir], check=False)
                     
-                    theme_url = "https://raw.githubusercontent.com/catppuccin/bat/main/themes/Catppuccin%20Mocha.tmTheme"
-                    subprocess.run(self.sudo_cmd + ["curl", "-L", "-o", f"{themes_dir}/Catppuccin Mocha.tmTheme", theme_url], check=False)
+                    try:
+                        theme = artifact_cache().fetch(BAT_THEME_URL)
+                        self._run(self.sudo_cmd + ["cp", str(theme), f"{themes_dir}/Catppuccin Mocha.tmTheme"], check=False)
+                    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                        self._log_warn(f"No se pudo descargar el tema de bat: {e}")
                     
                     self._log_info("Reconstruyendo cache de bat...")
-                    subprocess.run(self.sudo_cmd + ["batcat", "cache", "--build"], check=False)
+                    self._run(self.sudo_cmd + ["batcat", "cache", "--build"], check=False)
 
             # 3. tealdeer -> tldr
             if "tealdeer" in to_install:
                     if shutil.which("tealdeer") and not shutil.which("tldr"):
                         self._log_info("Creando symlink tldr -> tealdeer...")
-                        subprocess.run(self.sudo_cmd + ["ln", "-s", "/usr/bin/tealdeer", "/usr/local/bin/tldr"], check=False)
+                        self._run(self.sudo_cmd + ["ln", "-s", "/usr/bin/tealdeer", "/usr/local/bin/tldr"], check=False)
                     
-                    self._log_info("Actualizando cache TLDR (esto puede tardar)...")
-                    import time
-                    for i in range(3):
-                        try:
-                            self._log_info(f"   > Intento {i+1}/3...")
-                            subprocess.run(self.sudo_cmd + ["tldr", "--update"], check=True)
-                            self._log_success("Cache TLDR actualizado.")
-                            break
-                        except subprocess.CalledProcessError:
-                            self._log_warn(f"   [!] Fallo intento {i+1}. Reintentando en 3s...")
-                            time.sleep(3)
+                    # Las paginas de tldr se bajan de internet: en modo offline quedan para despues
+                    if self.offline:
+                        self._log_info("Modo offline: ejecuta 'tldr --update' cuando haya red.")
                     else:
-                        self._log_warn("No se pudo actualizar TLDR. Ejecuta 'tldr --update' manualmente luego.")
-
-        # 2. Binarios GitHub (Extra)
-        for tool in manual_packages:
-            if tool == "starship":
-                self._install_binary(tool)
-                self._install_nerd_fonts() # Auto-instalamos fuentes con Starship (Ahora handled by core)
-            else:
-                self._install_binary(tool)
+                        self._log_info("Actualizando cache TLDR (esto puede tardar)...")
+                        import time
+                        for i in range(3):
+                            try:
+                                self._log_info(f"   > Intento {i+1}/3...")
+                                self._run(self.sudo_cmd + ["tldr", "--update"], check=True)
+                                self._log_success("Cache TLDR actualizado.")
+                                break
+                            except subprocess.CalledProcessError:
+                                self._log_warn(f"   [!] Fallo intento {i+1}. Reintentando en 3s...")
+                                time.sleep(3)
+                        else:
+                            self._log_warn("No se pudo actualizar TLDR. Ejecuta 'tldr --update' manualmente luego.")
+
+        # 2. Binarios GitHub (Extra): descargas en paralelo (starship trae sus Nerd Fonts)
+        self.install_binaries(manual_packages)
     
+    def _cache_opts(self) -> List[str]:
+        if not self.pkg_cache:
+            return []
+        # apt exige el subdirectorio partial/; Keep-Downloaded evita que 'apt' borre los .deb
+        (self.pkg_cache.path / "partial").mkdir(parents=True, exist_ok=True)
+        return ["-o", f"Dir::Cache::Archives={self.pkg_cache.path}/",
+                "-o", "APT::Keep-Downloaded-Packages=true",
+                "-o", "Binary::apt::APT::Keep-Downloaded-Packages=true"]
+
+    def _cache_package_name(self, filename: str) -> Optional[str]:
+        # "bat_0.22.1-4_amd64.deb" -> "bat"
+        return filename.split("_", 1)[0] or None
+
+    def _query_available(self, names: List[str]):
+        # Sin listas locales apt-cache no conoce ningun paquete
+        if self.metadata_age() is None and not self._metadata_refreshed:
+            self.refresh_metadata(force=True)
+        # Una sola llamada: "paquete:" seguido de "  Candidate: version|(none)"
+        out = self._run(["apt-cache", "policy"] + names, capture_output=True, text=True, check=True).stdout
+        available = set()
+        current = None
+        for line in out.splitlines():
+            if line and not line[0].isspace() and line.endswith(":"):
+                current = line[:-1]
+            elif current and line.strip().startswith("Candidate:"):
+                if line.split(":", 1)[1].strip() != "(none)":
+                    available.add(current)
+        return available
+
+    def _refresh_metadata(self):
+        self._run(self.sudo_cmd + ["apt", "update"], check=True)
+
+    def _query_installed(self):
+        # Una sola llamada a dpkg: "ii  paquete" por cada paquete instalado
+        out = self._run(["dpkg-query", "-W", "-f=${db:Status-Abbrev} ${Package}\n"],
+                        capture_output=True, text=True, check=True).stdout
+        installed = set()
+        for line in out.splitlines():
+            status, _, name = line.partition(" ")
+            if status.startswith("ii"):
+                installed.add(name.strip())
+        return installed
+
     def install_fontconfig(self):
         self._log_info("Instalando fontconfig...")
         try:
-            subprocess.run(self.sudo_cmd + ["apt", "install", "-y", "fontconfig"], check=True)
+            self._run(self.sudo_cmd + ["apt", "install", "-y"] + self._cache_opts() + ["fontconfig"], check=True)
         except subprocess.CalledProcessError:
             self._log_error("No se pudo instalar fontconfig. Los iconos podrian no cargar correctamente.")
 
-    def _get_arch_terms(self):
-        import platform
-        arch = platform.machine().lower()
-        if arch == "x86_64": return ["x86_64", "amd64"]
-        if arch in ["aarch64", "arm64"]: return ["aarch64", "arm64"]
-        return [arch]
-
-    def _download_github_asset(self, repo, keyword, output_name, allow_musl=False):
-        import urllib.request
-        import json
-        self._log_info(f"Buscando {output_name} en {repo}...")
-        try:
-            api_url = f"https://api.github.com/repos/{repo}/releases/latest"
-            req = urllib.request.Request(api_url, headers={'User-Agent': 'python'})
-            with urllib.request.urlopen(req) as response:
-                data = json.loads(response.read().decode())
-            
-            arch_terms = self._get_arch_terms()
-            download_url = None
-            
-            for asset in data["assets"]:
-                name = asset["name"].lower()
-                if "linux" not in name and "unknown-linux" not in name: continue
-                if not any(term in name for term in arch_terms): continue
-                if keyword and keyword not in name: continue
-                if "musl" in name and not allow_musl: continue
-                download_url = asset["browser_download_url"]
-                break
-            
-            if not download_url: return False
-            subprocess.run(["curl", "-L", "-o", output_name, download_url], check=True)
-            return True
-        except Exception as e:
-            self._log_error(f"Download failed: {e}")
-            return False
-
-    def _install_binary(self, tool):
-        if shutil.which(tool):
-            print(f"[Skip] {tool} ya está instalado.")
-            return
-            
-        print(f"[Binario] Instalando {tool}...")
-        original_cwd = os.getcwd()
-        temp_dir = Path("/tmp/brainbash_bin")
-        if temp_dir.exists(): shutil.rmtree(temp_dir)
-        temp_dir.mkdir(exist_ok=True)
-        
-        sudo_prefix = " ".join(self.sudo_cmd)
-        
-        try:
-            os.chdir(temp_dir)
-            
-            # Starship y Zoxide scripting (Zoxide ahora en APT, pero mantenemos script si manager < bookworm? No, asumimos migration total)
-            # Aunque Zoxide en APT es version vieja? Debian Bookworm tiene 0.9.0.
-            # Starship es el unico que queda aqui por ahora.
-            
-            if tool == "starship":
-                subprocess.run("curl -sS https://starship.rs/install.sh | sh -s -- -y", shell=True)
-            
-            print(f"{tool} instalado.")
-        except Exception as e:
-            print(f"Error {tool}: {e}")
-        finally:
-            os.chdir(original_cwd)
-            shutil.rmtree(temp_dir, ignore_errors=True)
-
 if __name__ == "__main__":
     manager = DebianManager("debian")
     manager.update()
@@ -1,55 +1,110 @@
 import subprocess
-from typing import List
+from typing import List, Optional, Sequence
 from ..core import PackageManager
 
 class FedoraManager(PackageManager):
     """
     Implementacion especifica para Fedora, RHEL, CentOS y AlmaLinux (DNF).
     """
+    METADATA_GLOBS = [
+        "/var/cache/dnf/*/repodata/repomd.xml",
+        "/var/cache/dnf/*.solv",
+        "/var/cache/libdnf5/*/repodata/repomd.xml"
+    ]
+    STAGE_PACKAGES = {
+        "fonts": ["fontconfig"]
+    }
+    PACKAGE_SUFFIX = ".rpm"
+    # Con cachedir propio dnf guarda tambien los metadatos ahi
+    CACHE_METADATA_GLOBS = [
+        "{cache}/*/repodata/repomd.xml",
+        "{cache}/*.solv"
+    ]
 
     def update(self):
-        print("[Fedora] Actualizando metadatos de DNF...")
         # makecache solo actualiza la lista de paquetes, similar a apt update
-        subprocess.run(self.sudo_cmd + ["dnf", "makecache"], check=True)
+        self.refresh_metadata()
 
-    def install(self, packages: List[str]):
-        dnf_packages = []
-        manual_packages = []
-        
-        # Herramientas que no estan en repos base de Fedora (o tienen nombres raros)
-        # y preferimos bajar binarios recientes de GitHub
-        modern_tools = ["eza", "bat", "fzf", "starship", "zoxide", "tldr"]
-
-        for pkg in packages:
-            mapped = self._get_mapped_name(pkg)
-            
-            if mapped in modern_tools or pkg in modern_tools:
-                manual_packages.append(mapped)
-            else:
-                dnf_packages.append(mapped)
+    def _refresh_metadata(self):
+        print("[Fedora] Actualizando metadatos de DNF...")
+        self._run(self.sudo_cmd + ["dnf", "makecache"] + self._cache_opts(), check=True)
+
+    def _dnf_opts(self) -> List[str]:
+        # Mismo TTL que el resto de managers: dnf no re-baja metadatos mas nuevos que esto
+        return [f"--setopt=metadata_expire={self.metadata_ttl}"] + self._cache_opts()
+
+    def _cache_opts(self) -> List[str]:
+        if not self.pkg_cache:
+            return []
+        return ["--setopt=keepcache=True", f"--setopt=cachedir={self.pkg_cache.path}"]
+
+    def _cache_package_name(self, filename: str) -> Optional[str]:
+        # "bat-0.24.0-3.fc40.x86_64.rpm" -> "bat"
+        parts = filename[:-len(".rpm")].rsplit(".", 1)[0].rsplit("-", 2)
+        return parts[0] if len(parts) == 3 else None
+
+    def _split_packages(self, packages: List[str], stages: Sequence[str] = ()):
+        # Nativo primero segun 'dnf repoquery'; a GitHub solo va lo que no esta en los repos
+        # (p.ej. starship, que Fedora no empaqueta)
+        dnf_packages, manual_packages = self._resolve_sources(packages)
+
+        # Lo que piden las otras etapas va en la misma transaccion
+        for pkg in self.stage_packages(stages):
+            if pkg not in dnf_packages: dnf_packages.append(pkg)
+        return dnf_packages, manual_packages
+
+    def _prefetch(self, native_packages: List[str]):
+        # --downloadonly deja los .rpm en el cache de dnf; 'dnf install' los reutiliza
+        self._run(self.sudo_cmd + ["dnf", "install", "--downloadonly", "-y"]
+                  + self._dnf_opts() + native_packages, check=True)
+
+    def install(self, packages: List[str], stages: Sequence[str] = ()):
+        dnf_packages, manual_packages = self._split_packages(packages, stages)
         
+        # Lo que ya esta en rpm no llega a dnf
+        dnf_packages = self._drop_installed(dnf_packages)
+
         # 1. DNF
         if dnf_packages:
             print(f"[Fedora] Instalando paquetes DNF: {', '.join(dnf_packages)}")
+            cache_token = self._cache_begin()
             try:
                 # --skip-broken podria ayudar pero mejor ser explicitos
-                subprocess.run(
-                    self.sudo_cmd + ["dnf", "install", "-y"] + dnf_packages, 
+                self._run(
+                    self.sudo_cmd + ["dnf", "install", "-y"] + self._dnf_opts() + dnf_packages, 
                     check=True
                 )
             except subprocess.CalledProcessError:
                 print("[Error] Fallo la instalacion con DNF.")
                 raise
+            finally:
+                self.invalidate_installed()
+                self._cache_end(cache_token)
+
+        if "starship" in dnf_packages:
+            self._install_nerd_fonts()
 
         # 2. Binarios Manuales
-        for tool in manual_packages:
-            # Fedora usa glibc, asi que allow_musl=False (default) esta bien
-            self._install_binary(tool)
+        # Fedora usa glibc, asi que allow_musl=False (default) esta bien
+        self.install_binaries(manual_packages)
+
+    def _query_available(self, names: List[str]):
+        # Una sola consulta a los repos habilitados: un nombre por paquete encontrado.
+        # Con sudo, como makecache: sin root dnf usa un cache por usuario y re-baja los metadatos
+        out = self._run(self.sudo_cmd + ["dnf", "repoquery", "-q", "--qf", "%{name}\n"] + self._dnf_opts() + names,
+                        capture_output=True, text=True, check=True).stdout
+        return {line.strip() for line in out.splitlines() if line.strip()}
+
+    def _query_installed(self):
+        # Una sola llamada a rpm con solo el nombre de cada paquete
+        out = self._run(["rpm", "-qa", "--qf", "%{NAME}\n"],
+                        capture_output=True, text=True, check=True).stdout
+        return {line.strip() for line in out.splitlines() if line.strip()}
 
     def install_fontconfig(self):
         print("[Fedora] Instalando fontconfig...")
         try:
             # En Fedora, el paquete suele ser fontconfig
-            subprocess.run(self.sudo_cmd + ["dnf", "install", "-y", "fontconfig"], check=True)
+            self._run(self.sudo_cmd + ["dnf", "install", "-y"] + self._cache_opts() + ["fontconfig"], check=True)
         except subprocess.CalledProcessError:
             print("[Error] No se pudo instalar fontconfig.")
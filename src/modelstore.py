@@ -0,0 +1,268 @@
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import tarfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .plan import ollama_manifest_relpath
+
+CHUNK = 1024 * 1024
+
+# ioctl de Linux para clonar un archivo (reflink: btrfs, xfs, bcachefs...)
+FICLONE = 0x40049409
+
+
+class ModelStoreError(Exception):
+    """Origen de modelos ilegible o con formato desconocido."""
+
+
+def blob_name(digest: str) -> str:
+    """'sha256:abc...' -> 'sha256-abc...' (nombre del blob en disco)."""
+    return digest.replace(":", "-")
+
+
+def manifest_blobs(data: bytes) -> List[Tuple[str, int]]:
+    """(digest, tamaño) del config y de cada capa de un manifest."""
+    manifest = json.loads(data)
+    entries = [manifest["config"]] + list(manifest.get("layers", []))
+    return [(entry["digest"], int(entry.get("size", -1))) for entry in entries]
+
+
+def _member_name(name: str) -> str:
+    return name[2:] if name.startswith("./") else name
+
+
+class DirSource:
+    """Store de modelos en un directorio (otro ~/.ollama/models, un NFS, un bundle extraido)."""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def read_manifest(self, tag: str) -> Optional[bytes]:
+        path = self.root / ollama_manifest_relpath(tag)
+        return path.read_bytes() if path.is_file() else None
+
+    def blob_path(self, digest: str) -> Optional[Path]:
+        path = self.root / "blobs" / blob_name(digest)
+        return path if path.is_file() else None
+
+    def open_blob(self, digest: str):
+        path = self.blob_path(digest)
+        return open(path, "rb") if path else None
+
+    def close(self):
+        pass
+
+
+class TarSource:
+    """Store de modelos dentro de un tarball: los blobs se leen sin extraer el archivo entero."""
+
+    def __init__(self, path: Path, tar: tarfile.TarFile, prefix: str):
+        self.path = path
+        self._tar = tar
+        self._prefix = prefix
+        self._members = {_member_name(m.name): m for m in tar.getmembers() if m.isfile()}
+
+    def _member(self, relpath: str) -> Optional[tarfile.TarInfo]:
+        return self._members.get(f"{self._prefix}{relpath}")
+
+    def read_manifest(self, tag: str) -> Optional[bytes]:
+        member = self._member(ollama_manifest_relpath(tag).as_posix())
+        return self._tar.extractfile(member).read() if member else None
+
+    def blob_path(self, digest: str) -> Optional[Path]:
+        return None
+
+    def open_blob(self, digest: str):
+        member = self._member(f"blobs/{blob_name(digest)}")
+        return self._tar.extractfile(member) if member else None
+
+    def close(self):
+        self._tar.close()
+
+
+def _store_root(root: Path) -> Optional[Path]:
+    for candidate in (root, root / "models", root / ".ollama" / "models"):
+        if (candidate / "manifests").is_dir() and (candidate / "blobs").is_dir():
+            return candidate
+    return None
+
+
+def open_source(path):
+    """
+    Abre un origen de modelos: directorio o tarball (.tar, .tar.gz...) con el layout de
+    ~/.ollama/models (manifests/ y blobs/), en la raiz, en models/ (bundle) o en .ollama/models/.
+    """
+    path = Path(path).expanduser()
+    if path.is_dir():
+        root = _store_root(path)
+        if root is None:
+            raise ModelStoreError(f"{path} no tiene el layout de un store de Ollama (manifests/ y blobs/).")
+        return DirSource(root)
+    try:
+        tar = tarfile.open(str(path), "r:*")
+        names = [_member_name(m.name) for m in tar.getmembers()]
+    except (OSError, tarfile.TarError) as e:
+        raise ModelStoreError(f"No se pudo abrir {path}: {e}")
+    for prefix in ("", "models/", ".ollama/models/"):
+        if any(n.startswith(f"{prefix}manifests/") for n in names) and \
+                any(n.startswith(f"{prefix}blobs/") for n in names):
+            return TarSource(path, tar, prefix)
+    tar.close()
+    raise ModelStoreError(f"{path} no contiene manifests/ y blobs/ de Ollama.")
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+def _clone(src: Path, tmp: Path) -> str:
+    """
+    Mismo filesystem: reflink (copia independiente, sin copiar datos) o, si no hay
+    soporte, hardlink (solo si el blob es legible por todos: el inodo es compartido).
+    Lanza OSError si hay que copiar.
+    """
+    with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return "reflink"
+        except OSError:
+            pass
+    os.unlink(tmp)
+    if not os.stat(src).st_mode & stat.S_IROTH:
+        raise OSError(errno.EACCES, "blob no legible por otros usuarios", str(src))
+    os.link(src, tmp)
+    return "hardlink"
+
+
+def _copy_verified(fsrc, tmp: Path) -> str:
+    """Copia calculando el sha256 en la misma lectura."""
+    digest = hashlib.sha256()
+    with open(tmp, "wb") as fdst:
+        for chunk in iter(lambda: fsrc.read(CHUNK), b""):
+            digest.update(chunk)
+            fdst.write(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+class StoreImporter:
+    """
+    Importa modelos de un origen (open_source) al store de Ollama 'models_dir'.
+    Cada blob se verifica contra su digest antes de entrar al store y el manifest se
+    escribe al final, solo si estan todos: ollama nunca ve un modelo a medias.
+    """
+
+    def __init__(self, source, models_dir: Path):
+        self.source = source
+        self.models_dir = Path(models_dir)
+        # Archivos y directorios nuevos que hay que pasar al usuario destino (no los hardlinks)
+        self.created: List[Path] = []
+        self.methods = {"present": 0, "reflink": 0, "hardlink": 0, "copy": 0}
+        self.bytes = 0
+
+    def _mkdirs(self, path: Path):
+        missing = []
+        while not path.exists():
+            missing.append(path)
+            path = path.parent
+        for directory in reversed(missing):
+            directory.mkdir(exist_ok=True)
+            self.created.append(directory)
+
+    def _import_blob(self, digest: str, size: int) -> Optional[str]:
+        """Deja el blob en el store; retorna un error o None."""
+        dest = self.models_dir / "blobs" / blob_name(digest)
+        if dest.is_file() and (size < 0 or dest.stat().st_size == size):
+            self.methods["present"] += 1
+            return None
+        self._mkdirs(dest.parent)
+        tmp = dest.with_name(f".{dest.name}.import")
+        src_path = self.source.blob_path(digest)
+        try:
+            method = None
+            if src_path is not None:
+                if size >= 0 and src_path.stat().st_size != size:
+                    return f"{blob_name(digest)}: tamaño distinto al del manifest"
+                # Se verifica el origen antes de compartir sus datos
+                if _sha256_file(src_path) != digest:
+                    return f"{blob_name(digest)}: digest no coincide"
+                try:
+                    method = _clone(src_path, tmp)
+                except OSError:
+                    method = None
+            if method is None:
+                fsrc = self.source.open_blob(digest)
+                if fsrc is None:
+                    return f"{blob_name(digest)}: no esta en el origen"
+                with fsrc:
+                    got = _copy_verified(fsrc, tmp)
+                if got != digest:
+                    return f"{blob_name(digest)}: digest no coincide"
+                method = "copy"
+            os.replace(tmp, dest)
+        except OSError as e:
+            return f"{blob_name(digest)}: {e}"
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        self.methods[method] += 1
+        self.bytes += dest.stat().st_size
+        if method != "hardlink":
+            self.created.append(dest)
+        return None
+
+    def import_model(self, tag: str) -> Dict:
+        """Retorna {"status": "present"|"imported"|"missing"|"invalid", "error"}."""
+        dest = self.models_dir / ollama_manifest_relpath(tag)
+        if dest.exists():
+            return {"status": "present", "error": None}
+        data = self.source.read_manifest(tag)
+        if data is None:
+            return {"status": "missing", "error": "no esta en el origen"}
+        try:
+            blobs = manifest_blobs(data)
+        except (ValueError, KeyError, TypeError) as e:
+            return {"status": "invalid", "error": f"manifest invalido: {e}"}
+        # Los blobs buenos quedan aunque falte alguno: el pull posterior solo baja el resto
+        errors = [e for e in (self._import_blob(digest, size) for digest, size in blobs) if e]
+        if errors:
+            return {"status": "invalid", "error": "; ".join(errors)}
+        self._mkdirs(dest.parent)
+        tmp = dest.with_name(f".{dest.name}.import")
+        tmp.write_bytes(data)
+        os.replace(tmp, dest)
+        self.created.append(dest)
+        return {"status": "imported", "error": None}
+
+
+def import_models(path, models_dir: Path, tags: List[str],
+                  log: Callable[[str], None] = print) -> Tuple[Dict[str, Dict], StoreImporter]:
+    """
+    Importa 'tags' desde 'path' (directorio o tarball) a 'models_dir'.
+    Lo que falte o no verifique queda para 'ollama pull'. Lanza ModelStoreError.
+    """
+    source = open_source(path)
+    importer = StoreImporter(source, models_dir)
+    results = {}
+    try:
+        for tag in tags:
+            results[tag] = importer.import_model(tag)
+            if results[tag]["status"] == "imported":
+                log(f"{tag}: importado desde {path}")
+    finally:
+        source.close()
+    return results, importer
+
+
+def format_import(importer: StoreImporter) -> str:
+    m = importer.methods
+    return (f"{importer.bytes / (1024 * 1024):.1f} MB nuevos (reflink {m['reflink']}, hardlink {m['hardlink']}, "
+            f"copia {m['copy']}, ya presentes {m['present']})")
@@ -0,0 +1,430 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .journal import chown_to_user
+
+DEFAULT_PORT = 11434
+
+# Segundos maximos esperando a que 'ollama serve' responda
+READY_TIMEOUT = float(os.environ.get("BRAINBASH_OLLAMA_READY_TIMEOUT", 30))
+
+# Descargas de modelos en paralelo y tope opcional de ancho de banda total (MB/s, 0 = sin tope)
+PULL_WORKERS = int(os.environ.get("BRAINBASH_OLLAMA_PULLS", 2))
+PULL_MAX_MBPS = float(os.environ.get("BRAINBASH_OLLAMA_MAX_MBPS", 0))
+
+# Registro de donde 'ollama pull' baja los manifests (mismo host que usa plan.ollama_manifest_path)
+REGISTRY_URL = "https://registry.ollama.ai"
+MANIFEST_ACCEPT = "application/vnd.docker.distribution.manifest.v2+json"
+
+
+def ollama_base_url(host: Optional[str] = None) -> str:
+    """
+    URL base del servidor a partir de OLLAMA_HOST (mismas formas que acepta ollama:
+    '0.0.0.0', 'host:puerto', 'http://host:puerto'). Por defecto 127.0.0.1:11434.
+    """
+    host = (host if host is not None else os.environ.get("OLLAMA_HOST", "")).strip().rstrip("/")
+    scheme = "http"
+    if "://" in host:
+        scheme, host = host.split("://", 1)
+    hostname, _, port = host.partition(":")
+    # 0.0.0.0 es la direccion de escucha del servidor; como cliente vamos por loopback
+    if hostname in ("", "0.0.0.0"):
+        hostname = "127.0.0.1"
+    return f"{scheme}://{hostname}:{port or DEFAULT_PORT}"
+
+
+class OllamaError(Exception):
+    """El servidor de Ollama respondio con error o no respondio."""
+
+
+class OllamaClient:
+    """Cliente minimo de la API HTTP de Ollama (sin lanzar el binario 'ollama')."""
+
+    def __init__(self, base_url: Optional[str] = None, timeout: float = 10):
+        self.base_url = base_url or ollama_base_url()
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, body: Optional[Dict] = None,
+                 timeout: Optional[float] = None) -> Dict:
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(f"{self.base_url}{path}", data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=timeout or self.timeout) as response:
+                raw = response.read()
+        except urllib.error.HTTPError as e:
+            raise OllamaError(f"{method} {path}: HTTP {e.code} {e.read().decode(errors='replace').strip()}")
+        except (urllib.error.URLError, OSError) as e:
+            raise OllamaError(f"{method} {path}: {e}")
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError as e:
+            raise OllamaError(f"{method} {path}: respuesta invalida ({e})")
+
+    def pull(self, model: str, on_progress: Optional[Callable[[Dict], None]] = None,
+             should_pause: Optional[Callable[[], bool]] = None, timeout: float = 300) -> bool:
+        """
+        POST /api/pull en modo stream: on_progress recibe cada evento JSON.
+        Si should_pause() da True se corta la conexion (ollama cancela el pull y
+        conserva lo descargado) y retorna False; True cuando el pull termina.
+        """
+        req = urllib.request.Request(f"{self.base_url}/api/pull", method="POST",
+                                     data=json.dumps({"model": model, "stream": True}).encode(),
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                for line in response:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if "error" in event:
+                        raise OllamaError(f"pull {model}: {event['error']}")
+                    if on_progress:
+                        on_progress(event)
+                    if event.get("status") == "success":
+                        return True
+                    if should_pause and should_pause():
+                        return False
+        except urllib.error.HTTPError as e:
+            raise OllamaError(f"pull {model}: HTTP {e.code} {e.read().decode(errors='replace').strip()}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise OllamaError(f"pull {model}: {e}")
+        raise OllamaError(f"pull {model}: el servidor corto el stream antes de terminar")
+
+    def tags(self) -> Dict:
+        """GET /api/tags: modelos locales."""
+        return self._request("GET", "/api/tags")
+
+    def digests(self) -> Dict[str, str]:
+        """{nombre:tag -> digest} de los modelos locales (una sola consulta)."""
+        return {normalize_model(m["name"]): m.get("digest", "") for m in self.tags().get("models", [])}
+
+    def create(self, model: str, spec: Dict) -> Dict:
+        """POST /api/create con los campos de parse_modelfile() (sin archivo temporal)."""
+        return self._request("POST", "/api/create", dict(spec, model=model, stream=False), timeout=600)
+
+    def copy(self, source: str, destination: str) -> Dict:
+        """POST /api/copy (equivale a 'ollama cp')."""
+        return self._request("POST", "/api/copy", {"source": source, "destination": destination})
+
+    def is_ready(self, timeout: float = 1.0) -> bool:
+        """Un solo sondeo: el servidor responde /api/tags."""
+        try:
+            self._request("GET", "/api/tags", timeout=timeout)
+            return True
+        except OllamaError:
+            return False
+
+    def wait_ready(self, deadline: float = 30, initial: float = 0.05, max_delay: float = 1.0,
+                   sleep: Callable[[float], None] = time.sleep,
+                   clock: Callable[[], float] = time.monotonic) -> bool:
+        """
+        Sondea /api/tags con backoff exponencial (initial -> max_delay) hasta que
+        responda o pasen 'deadline' segundos. Cada sondeo es un round-trip HTTP.
+        """
+        limit = clock() + deadline
+        delay = initial
+        while True:
+            if self.is_ready(timeout=min(1.0, max(0.1, limit - clock()))):
+                return True
+            remaining = limit - clock()
+            if remaining <= 0:
+                return False
+            sleep(min(delay, remaining))
+            delay = min(delay * 2, max_delay)
+
+
+def normalize_model(name: str) -> str:
+    """'qwen-local' -> 'qwen-local:latest' (como los lista /api/tags)."""
+    return name if ":" in name.rsplit("/", 1)[-1] else f"{name}:latest"
+
+
+_PARAM_NUMBER = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+def parse_modelfile(text: str) -> Dict:
+    """
+    Modelfile -> campos de /api/create ("from", "system", "template", "parameters").
+    Soporta lo que usa config/Modelfile: FROM, SYSTEM/TEMPLATE (con o sin \"\"\") y PARAMETER.
+    """
+    spec: Dict = {}
+    parameters: Dict = {}
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        i += 1
+        if not line or line.startswith("#"):
+            continue
+        command, _, rest = line.partition(" ")
+        command, rest = command.upper(), rest.strip()
+        if rest.startswith('"""'):
+            # Bloque multilinea hasta el \"\"\" de cierre (las comillas escapadas no cierran)
+            body = rest[3:]
+            while not re.search(r'(?<!\\)"""\s*$', body) and i < len(lines):
+                body += "\n" + lines[i]
+                i += 1
+            rest = re.sub(r'"""\s*$', "", body).replace('\\"', '"')
+        if command == "FROM":
+            spec["from"] = rest
+        elif command in ("SYSTEM", "TEMPLATE"):
+            spec[command.lower()] = rest
+        elif command == "PARAMETER":
+            key, _, value = rest.partition(" ")
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            elif _PARAM_NUMBER.match(value):
+                value = float(value) if "." in value else int(value)
+            if key == "stop":
+                parameters.setdefault("stop", []).append(value)
+            else:
+                parameters[key] = value
+    if parameters:
+        spec["parameters"] = parameters
+    return spec
+
+
+def model_fingerprint(base_digest: str, modelfile: str) -> str:
+    """Huella de un alias: digest del modelo base + Modelfile renderizado (prompt y parametros)."""
+    return hashlib.sha256(f"{base_digest}\n{modelfile}".encode()).hexdigest()[:32]
+
+
+def fingerprints_path(home: Path) -> Path:
+    """Junto al journal: sobrevive entre corridas (el journal se reinicia sin --resume)."""
+    return home / ".local" / "state" / "brainbash" / "models.json"
+
+
+class ModelFingerprints:
+    """
+    Huellas de los alias -local creados: {alias: {"fingerprint", "digest"}}.
+    'digest' es el del alias al crearlo; si alguien lo borra o recrea, deja de coincidir.
+    """
+
+    def __init__(self, path, owner: Optional[str] = None):
+        self.path = Path(path)
+        # Usuario destino: con sudo el archivo no queda de root (ver journal.chown_to_user)
+        self.owner = owner
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.entries = data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def matches(self, alias: str, fingerprint: str, current_digest: Optional[str]) -> bool:
+        with self._lock:
+            entry = self.entries.get(alias)
+        return (entry is not None and entry.get("fingerprint") == fingerprint
+                and bool(current_digest) and entry.get("digest") == current_digest)
+
+    def record(self, alias: str, fingerprint: str, digest: str):
+        with self._lock:
+            self.entries[alias] = {"fingerprint": fingerprint, "digest": digest}
+            data = dict(self.entries)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
+            chown_to_user(self.path, self.owner)
+        except OSError:
+            pass
+
+
+def bare_digest(digest: str) -> str:
+    """'sha256:abc...' -> 'abc...' (/api/tags los da sin prefijo, el registro con prefijo)."""
+    return digest.split(":", 1)[1] if digest.startswith("sha256:") else digest
+
+
+def registry_manifest_url(model: str) -> str:
+    name, _, tag = normalize_model(model).rpartition(":")
+    if "/" not in name:
+        name = f"library/{name}"
+    return f"{REGISTRY_URL}/v2/{name}/manifests/{tag}"
+
+
+def registry_digest(model: str, timeout: float = 10) -> str:
+    """
+    Digest del manifest publicado de 'model' (Docker-Content-Digest o sha256 del cuerpo).
+    Es el mismo que reporta /api/tags cuando la copia local esta al dia.
+    """
+    url = registry_manifest_url(model)
+    req = urllib.request.Request(url, headers={"Accept": MANIFEST_ACCEPT})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            body = response.read()
+            header = response.headers.get("Docker-Content-Digest", "")
+    except urllib.error.HTTPError as e:
+        raise OllamaError(f"{url}: HTTP {e.code}")
+    except (urllib.error.URLError, OSError) as e:
+        raise OllamaError(f"{url}: {e}")
+    return bare_digest(header) if header else hashlib.sha256(body).hexdigest()
+
+
+def plan_pulls(models: List[str], inventory: Dict[str, str], pinned: Optional[Dict[str, str]] = None,
+               resolve: Optional[Callable[[str], str]] = registry_digest,
+               workers: int = PULL_WORKERS) -> Dict[str, Dict]:
+    """
+    Decide que modelos hay que bajar comparando el inventario local (/api/tags, una consulta)
+    con el digest esperado: el fijado en 'pinned' (sin red) o el del registro (via 'resolve').
+    Retorna {modelo: {"pull", "local", "expected", "reason"}}; 'expected' queda vacio si no
+    se pudo consultar el registro (con copia local se conserva, sin copia se baja igual).
+    """
+    pinned = {normalize_model(k): bare_digest(v) for k, v in (pinned or {}).items()}
+    local = {m: inventory.get(normalize_model(m), "") for m in models}
+    expected = {m: pinned[normalize_model(m)] for m in models if normalize_model(m) in pinned}
+    errors = {}
+
+    # Solo los que tienen copia local y no estan fijados necesitan preguntar al registro
+    ask = [m for m in models if local[m] and m not in expected] if resolve else []
+    if ask:
+        def lookup(model):
+            try:
+                return resolve(model), None
+            except OllamaError as e:
+                return "", str(e)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(ask))), thread_name_prefix="digest") as pool:
+            for model, (digest, error) in zip(ask, pool.map(lookup, ask)):
+                expected[model] = digest
+                if error:
+                    errors[model] = error
+
+    plan = {}
+    for model in models:
+        want = expected.get(model, "")
+        if not local[model]:
+            pull, reason = True, "no esta descargado"
+        elif model in errors:
+            pull, reason = False, f"registro no disponible, se usa la copia local ({errors[model]})"
+        elif not want:
+            pull, reason = False, "ya descargado"
+        elif local[model] == want:
+            pull, reason = False, "al dia" + (" (digest fijado)" if normalize_model(model) in pinned else "")
+        else:
+            pull, reason = True, f"desactualizado ({local[model][:12]} -> {want[:12]})"
+        plan[model] = {"pull": pull, "local": local[model], "expected": want, "reason": reason}
+    return plan
+
+
+class PullProgress:
+    """Bytes recibidos por un pull (suma de 'completed' por capa) y su velocidad."""
+
+    def __init__(self, model: str, clock: Callable[[], float] = time.monotonic):
+        self.model = model
+        self.clock = clock
+        self.started = clock()
+        self.finished = None
+        self.status = ""
+        self.total = 0
+        self._first = {}      # digest -> 'completed' al verlo por primera vez (reanudaciones)
+        self._last = {}
+        self._totals = {}
+
+    def update(self, event: Dict) -> int:
+        """Registra un evento; retorna los bytes nuevos desde el anterior."""
+        self.status = event.get("status", self.status)
+        digest = event.get("digest")
+        if not digest or "completed" not in event:
+            return 0
+        completed = event["completed"]
+        self._first.setdefault(digest, completed)
+        delta = max(0, completed - self._last.get(digest, completed))
+        self._last[digest] = completed
+        self._totals[digest] = event.get("total", 0)
+        self.total = sum(self._totals.values())
+        return delta
+
+    @property
+    def bytes(self) -> int:
+        return sum(self._last[d] - self._first[d] for d in self._last)
+
+    @property
+    def done(self) -> int:
+        return sum(self._last.values())
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished or self.clock()) - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+
+class BandwidthCap:
+    """Tope de bytes/s para el total de pulls concurrentes (cubeta de tokens sin rafagas)."""
+
+    def __init__(self, bytes_per_sec: float, clock: Callable[[], float] = time.monotonic):
+        self.bytes_per_sec = bytes_per_sec
+        self.clock = clock
+        self.started = clock()
+        self.consumed = 0
+        self._lock = threading.Lock()
+
+    def add(self, n: int):
+        with self._lock:
+            self.consumed += n
+
+    def ahead(self) -> float:
+        """Segundos que habria que esperar para volver a estar bajo el tope."""
+        with self._lock:
+            return self.consumed / self.bytes_per_sec - (self.clock() - self.started)
+
+
+def pull_models(client: OllamaClient, models: List[str], workers: int = PULL_WORKERS,
+                max_bytes_per_sec: float = 0, log: Callable[[str], None] = print,
+                report_every: float = 5.0, sleep: Callable[[float], None] = time.sleep) -> Dict[str, Dict]:
+    """
+    Descarga 'models' via /api/pull, hasta 'workers' a la vez, mostrando el avance.
+    Con max_bytes_per_sec, un pull que pasa el tope total se corta y se retoma
+    despues de la pausa necesaria (ollama conserva las capas a medio bajar).
+    Retorna {modelo: {"ok", "bytes", "seconds", "rate", "error"}}.
+    """
+    cap = BandwidthCap(max_bytes_per_sec) if max_bytes_per_sec > 0 else None
+    mb = 1024 * 1024
+
+    def pull_one(model: str) -> Dict:
+        progress = PullProgress(model)
+        last_report = [progress.started]
+
+        def on_progress(event):
+            delta = progress.update(event)
+            if cap: cap.add(delta)
+            now = progress.clock()
+            if now - last_report[0] >= report_every and progress.total:
+                last_report[0] = now
+                log(f"{model}: {100 * progress.done / progress.total:.0f}% "
+                    f"({progress.done / mb:.0f}/{progress.total / mb:.0f} MB, {progress.rate / mb:.1f} MB/s)")
+
+        error = None
+        try:
+            # Cortar antes de 1 s de adelanto evita reconectar por cada evento
+            while not client.pull(model, on_progress, (lambda: cap.ahead() > 1) if cap else None):
+                wait = cap.ahead()
+                log(f"{model}: tope de {max_bytes_per_sec / mb:.1f} MB/s, pausa de {wait:.1f} s")
+                sleep(max(0.0, wait))
+        except OllamaError as e:
+            error = str(e)
+        progress.finished = progress.clock()
+        return {"ok": error is None, "bytes": progress.bytes, "seconds": progress.seconds,
+                "rate": progress.rate, "error": error}
+
+    results = {}
+    if not models:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(models))), thread_name_prefix="pull") as pool:
+        for model, result in zip(models, pool.map(pull_one, models)):
+            results[model] = result
+    return results
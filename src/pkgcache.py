@@ -0,0 +1,97 @@
+import os
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set
+
+# Tamaño maximo por defecto del cache compartido de paquetes
+DEFAULT_MAX_MB = int(os.environ.get("BRAINBASH_PKG_CACHE_MAX_MB", 4096))
+
+
+class PackageCache:
+    """
+    Cache compartido de paquetes (.deb/.rpm/.apk) en un directorio del host.
+    Se monta/configura como archivo de apt, cachedir de dnf o cache de apk, y
+    lleva estadisticas de aciertos/fallos con desalojo LRU acotado por tamaño.
+    """
+
+    def __init__(self, path, suffix: str, max_mb: int = DEFAULT_MAX_MB):
+        self.path = Path(path)
+        self.suffix = suffix              # ".deb", ".rpm" o ".apk"
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.downloaded_bytes = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+
+    def prepare(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def snapshot(self) -> Dict[str, Path]:
+        """Archivos de paquetes presentes ahora {nombre_archivo: ruta} (recursivo: dnf usa subdirs)."""
+        if not self.path.exists():
+            return {}
+        return {p.name: p for p in self.path.rglob(f"*{self.suffix}") if p.is_file()}
+
+    def record(self, before: Dict[str, Path], new_packages: Set[str],
+               package_of: Callable[[str], Optional[str]]):
+        """
+        Cuenta aciertos/fallos de una transaccion.
+        new_packages: paquetes que no estaban instalados antes y ahora si.
+        package_of: nombre_archivo -> nombre de paquete (depende del gestor).
+        """
+        after = self.snapshot()
+        cached_before = {}
+        for name, path in before.items():
+            pkg = package_of(name)
+            if pkg: cached_before[pkg] = path
+
+        for pkg in new_packages:
+            path = cached_before.get(pkg)
+            if path is not None:
+                self.hits += 1
+                # Marcamos uso para el LRU (apt/dnf solo leen el archivo)
+                try: os.utime(path)
+                except OSError: pass
+            else:
+                self.misses += 1
+
+        for name in set(after) - set(before):
+            try: self.downloaded_bytes += after[name].stat().st_size
+            except OSError: pass
+
+    def size(self) -> int:
+        total = 0
+        for path in self.snapshot().values():
+            try: total += path.stat().st_size
+            except OSError: pass
+        return total
+
+    def evict(self):
+        """Borra los paquetes menos usados hasta quedar bajo max_bytes."""
+        entries = []
+        for path in self.snapshot().values():
+            try:
+                st = path.stat()
+                entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+            except OSError:
+                pass
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+                self.evicted += 1
+                self.evicted_bytes += size
+            except OSError:
+                pass
+
+    def report(self) -> str:
+        mb = 1024 * 1024
+        total = self.hits + self.misses
+        ratio = f"{100 * self.hits / total:.0f}%" if total else "-"
+        return (f"Cache de paquetes {self.path}: {self.hits} aciertos, {self.misses} fallos ({ratio}), "
+                f"{self.downloaded_bytes / mb:.1f} MB descargados, {self.evicted} desalojados "
+                f"({self.evicted_bytes / mb:.1f} MB), ocupado {self.size() / mb:.1f}/{self.max_bytes / mb:.0f} MB")
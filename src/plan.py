@@ -0,0 +1,229 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .core import NERD_FONTS
+from .ollama import ModelFingerprints, fingerprints_path, model_fingerprint, normalize_model, plan_pulls, registry_digest
+
+try:
+    import pwd
+except ImportError:
+    pwd = None
+
+# Orden en que se muestran (y ejecutan) las etapas
+PLAN_STEPS = ["update", "packages", "omz", "shell", "dotfiles", "ollama", "gemini"]
+
+# Registro por defecto de Ollama (layout de ~/.ollama/models/manifests)
+OLLAMA_REGISTRY = "registry.ollama.ai"
+
+
+def ollama_models_dir(home: Path) -> Path:
+    """Directorio del store de modelos (respeta OLLAMA_MODELS como hace ollama)."""
+    if os.environ.get("OLLAMA_MODELS"):
+        return Path(os.environ["OLLAMA_MODELS"])
+    return home / ".ollama" / "models"
+
+
+def ollama_manifest_relpath(tag: str) -> Path:
+    """Ruta del manifest relativa al store (ej: manifests/registry.ollama.ai/library/qwen3/0.6b)."""
+    name, _, version = tag.partition(":")
+    if "/" not in name:
+        name = f"library/{name}"
+    return Path("manifests") / OLLAMA_REGISTRY / name / (version or "latest")
+
+
+def ollama_manifest_path(home: Path, tag: str) -> Path:
+    """Ruta del manifest local de un modelo (ej: 'qwen3:0.6b', 'qwen-local')."""
+    return ollama_models_dir(home) / ollama_manifest_relpath(tag)
+
+
+def ollama_manifest_digest(home: Path, tag: str) -> str:
+    """sha256 del manifest local: el mismo 'digest' que reporta /api/tags ("" si no esta)."""
+    try:
+        return hashlib.sha256(ollama_manifest_path(home, tag).read_bytes()).hexdigest()
+    except OSError:
+        return ""
+
+
+class Plan:
+    """
+    Diferencia entre lo seleccionado y lo que ya hay en el host.
+    actions[etapa] = lista de cosas pendientes (vacia = etapa satisfecha).
+    """
+
+    def __init__(self):
+        self.actions: Dict[str, List[str]] = {}
+        self.satisfied: Dict[str, List[str]] = {}
+
+    def add(self, step: str, todo: List[str], done: List[str] = None):
+        self.actions[step] = list(todo)
+        self.satisfied[step] = list(done or [])
+
+    def needs(self, step: str) -> bool:
+        return bool(self.actions.get(step))
+
+    def todo(self, step: str) -> List[str]:
+        return self.actions.get(step, [])
+
+    def is_empty(self) -> bool:
+        return not any(self.actions.values())
+
+    def render(self) -> str:
+        lines = []
+        for step in PLAN_STEPS:
+            if step not in self.actions:
+                continue
+            todo, done = self.actions[step], self.satisfied[step]
+            if todo:
+                line = f"  [+] {step:<9} {', '.join(todo)}"
+            else:
+                line = f"  [=] {step:<9} (sin cambios)"
+            if done:
+                line += f"  | ya OK: {', '.join(done)}"
+            lines.append(line)
+        if self.is_empty():
+            lines.append("  Nada que hacer: el sistema ya esta aprovisionado.")
+        return "\n".join(lines)
+
+
+def _split(items, is_done):
+    todo, done = [], []
+    for item in items:
+        (done if is_done(item) else todo).append(item)
+    return todo, done
+
+
+def _default_shell_is_zsh(user: str) -> bool:
+    zsh_path = shutil.which("zsh")
+    if not zsh_path or not pwd:
+        return False
+    try:
+        return pwd.getpwnam(user).pw_shell == zsh_path
+    except KeyError:
+        return False
+
+
+def _gemini_ready(home: Path, source_script: Path, api_key: str) -> bool:
+    venv_path = home / ".gemini-cli" / "venv"
+    python_bin = venv_path / "bin" / "python3"
+    dest_script = home / ".local" / "bin" / "gemini"
+
+    if not python_bin.exists() or not dest_script.exists():
+        return False
+    if not list(venv_path.glob("lib/python*/site-packages/google/genai")):
+        return False
+
+    # El script instalado debe coincidir con la version actual del repo
+    try:
+        expected = f"#!{python_bin}\n" + source_script.read_text()
+        if dest_script.read_text() != expected:
+            return False
+    except OSError:
+        return False
+
+    # Si hay key nueva, debe estar ya guardada
+    if api_key:
+        secrets = home / ".brainbash_secrets"
+        try:
+            return f"export GEMINI_API_KEY='{api_key}'" in secrets.read_text()
+        except OSError:
+            return False
+    return True
+
+
+def build_plan(state, manager, user: str, home: Path, repo_root: Path,
+               dotfiles_map: Dict[str, str], models_map: Dict[str, str],
+               modelfiles: Optional[Dict[str, Optional[str]]] = None) -> Plan:
+    """
+    Sondea el host UNA vez y arma el plan de lo que falta hacer.
+    Solo lee el sistema (which, symlinks, manifests), nunca modifica nada; la unica
+    consulta de red es el digest publicado de los modelos sin digest fijado (no offline).
+    modelfiles: {menu_id: Modelfile del alias -local}; si cambio (contexto, parametros
+    o modelo base) respecto de la huella guardada, el modelo queda pendiente.
+    """
+    plan = Plan()
+
+    # 1. Update: es una decision explicita del usuario, no un estado del host
+    if state["update_sys"]:
+        plan.add("update", ["refrescar sistema"])
+
+    # 2. Paquetes
+    all_pkgs = state["pkgs_base"] + state["pkgs_extra"]
+    if all_pkgs:
+        fonts_dir = Path.home() / ".local" / "share" / "fonts"
+
+        def pkg_ok(pkg):
+            if not manager.check_is_installed(pkg):
+                return False
+            # Starship no esta completo sin sus fuentes
+            if pkg == "starship":
+                return all((fonts_dir / font).exists() for font in NERD_FONTS)
+            return True
+
+        plan.add("packages", *_split(all_pkgs, pkg_ok))
+
+    # 3. Shell
+    if "zsh" in state["pkgs_base"]:
+        omz_ok = (home / ".oh-my-zsh").exists()
+        plan.add("omz", [] if omz_ok else ["oh-my-zsh"], ["oh-my-zsh"] if omz_ok else [])
+        shell_ok = _default_shell_is_zsh(user)
+        plan.add("shell", [] if shell_ok else ["chsh zsh"], ["zsh por defecto"] if shell_ok else [])
+
+    # 4. Dotfiles: symlink existente apuntando al repo
+    if state["dotfiles"]:
+        def link_ok(src):
+            dest = home / dotfiles_map[src]
+            return dest.is_symlink() and os.readlink(dest) == str(repo_root / "config" / src)
+
+        plan.add("dotfiles", *_split(list(dotfiles_map), link_ok))
+
+    # 5. Ollama: motor + (modelo base, alias -local y wrapper) por modelo
+    if state["models"]:
+        engine_ok = shutil.which("ollama") is not None or (home / ".local" / "bin" / "ollama").exists()
+        fingerprints = ModelFingerprints(fingerprints_path(home))
+
+        # Bases descargadas pero desactualizadas: contra "model_digests" del perfil (sin red)
+        # o contra el registro (en paralelo; si no responde se conserva la copia local)
+        local = {}
+        for menu_id in state["models"]:
+            tag = models_map.get(menu_id)
+            digest = ollama_manifest_digest(home, tag) if tag else ""
+            if digest:
+                local[normalize_model(tag)] = digest
+        offline = getattr(manager, "offline", False)
+        stale = plan_pulls(list(local), local, state.get("model_digests"),
+                           resolve=None if offline else registry_digest) if local else {}
+
+        def model_ok(menu_id):
+            tag = models_map.get(menu_id)
+            if not tag:
+                return True
+            alias = f"{menu_id}-local"
+            if stale.get(normalize_model(tag), {}).get("pull"):
+                return False
+            if not (engine_ok
+                    and ollama_manifest_path(home, tag).exists()
+                    and ollama_manifest_path(home, alias).exists()
+                    and (home / ".local" / "bin" / menu_id).exists()):
+                return False
+            if modelfiles is None:
+                return True
+            modelfile = modelfiles.get(menu_id)
+            if modelfile is None:
+                return False
+            fingerprint = model_fingerprint(ollama_manifest_digest(home, tag), modelfile)
+            return fingerprints.matches(alias, fingerprint, ollama_manifest_digest(home, alias))
+
+        todo, done = _split(state["models"], model_ok)
+        if not engine_ok:
+            todo.insert(0, "motor")
+        plan.add("ollama", todo, done)
+
+    # 6. Gemini
+    if state["use_gemini"]:
+        ok = _gemini_ready(home, repo_root / "src" / "gemini_tool.py", state.get("gemini_api_key") or "")
+        plan.add("gemini", [] if ok else ["venv + script"], ["venv + script"] if ok else [])
+
+    return plan
@@ -0,0 +1,161 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+from .pkgcache import DEFAULT_MAX_MB
+
+# Claves aceptadas en el archivo de perfil (JSON)
+PROFILE_KEYS = {"update", "base", "extra", "models", "dotfiles", "gemini", "workers", "download_workers", "metadata_ttl", "pkg_cache",
+                "pull_workers", "pull_max_mbps", "model_digests", "models_from"}
+
+
+class ProfileError(Exception):
+    """Perfil invalido o ilegible."""
+
+
+def _check_tags(field: str, value, menu: List[Tuple[str, str, str]]) -> List[str]:
+    if not isinstance(value, list) or not all(isinstance(x, str) for x in value):
+        raise ProfileError(f"'{field}' debe ser una lista de strings.")
+    valid = [tag for tag, _, _ in menu]
+    unknown = [x for x in value if x not in valid]
+    if unknown:
+        raise ProfileError(f"'{field}' contiene opciones desconocidas: {', '.join(unknown)} "
+                           f"(validas: {', '.join(valid)})")
+    return list(value)
+
+
+def _check_bool(field: str, value) -> bool:
+    if not isinstance(value, bool):
+        raise ProfileError(f"'{field}' debe ser true o false.")
+    return value
+
+
+def check_key_source(source) -> None:
+    """Valida el formato de la fuente de la API Key sin leerla (env:VAR, file:RUTA o none)."""
+    if not source or source == "none":
+        return
+    kind, _, ref = source.partition(":") if isinstance(source, str) else ("", "", "")
+    if kind not in ("env", "file") or not ref:
+        raise ProfileError(f"Fuente de API Key invalida: '{source}' (usar env:VAR, file:RUTA o none)")
+
+
+def resolve_key_source(source: str) -> str:
+    """
+    Resuelve la API Key de Gemini sin preguntar nada por consola.
+    Formatos: "env:VARIABLE", "file:/ruta/al/archivo" o "none".
+    """
+    check_key_source(source)
+    if not source or source == "none":
+        return ""
+
+    kind, _, ref = source.partition(":")
+    if kind == "env":
+        return os.environ.get(ref, "").strip()
+
+    path = Path(ref).expanduser()
+    try:
+        content = path.read_text().strip()
+    except OSError as e:
+        raise ProfileError(f"No se pudo leer la API Key desde {path}: {e}")
+    # Aceptamos el formato de ~/.brainbash_secrets o la clave sola
+    for line in content.splitlines():
+        if "GEMINI_API_KEY=" in line:
+            return line.split("=", 1)[1].strip().strip("'").strip('"')
+    return content
+
+
+def load_profile(path, menu_base, menu_extra, menu_models, resolve_keys: bool = True) -> Dict:
+    """
+    Carga un perfil JSON y lo convierte al dict 'state' que usa run_execution_phase.
+    Las claves ausentes toman los valores por defecto del menu interactivo.
+    Con resolve_keys=False solo se valida el formato de la fuente de la API Key
+    (la flota la resuelve en cada host, no en la maquina de control).
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ProfileError(f"No se pudo leer el perfil {path}: {e}")
+
+    if not isinstance(data, dict):
+        raise ProfileError("El perfil debe ser un objeto JSON.")
+
+    unknown = set(data) - PROFILE_KEYS
+    if unknown:
+        raise ProfileError(f"Claves desconocidas en el perfil: {', '.join(sorted(unknown))}")
+
+    state = {
+        "update_sys": _check_bool("update", data.get("update", False)),
+        "pkgs_base": _check_tags("base", data.get("base", [t for t, _, s in menu_base if s == "ON"]), menu_base),
+        "pkgs_extra": _check_tags("extra", data.get("extra", [t for t, _, s in menu_extra if s == "ON"]), menu_extra),
+        "models": _check_tags("models", data.get("models", []), menu_models),
+        "dotfiles": _check_bool("dotfiles", data.get("dotfiles", True)),
+    }
+
+    # gemini: false | true | {"key": "env:GEMINI_API_KEY"} (ausente = SI, como en el menu)
+    gemini = data.get("gemini", True)
+    if isinstance(gemini, bool):
+        state["use_gemini"] = gemini
+        state["gemini_api_key"] = ""
+    elif isinstance(gemini, dict):
+        extra_keys = set(gemini) - {"key"}
+        if extra_keys:
+            raise ProfileError(f"Claves desconocidas en 'gemini': {', '.join(sorted(extra_keys))}")
+        state["use_gemini"] = True
+        source = gemini.get("key", "none")
+        if resolve_keys:
+            state["gemini_api_key"] = resolve_key_source(source)
+        else:
+            check_key_source(source)
+            state["gemini_api_key"] = ""
+    else:
+        raise ProfileError("'gemini' debe ser true, false o un objeto {\"key\": ...}.")
+
+    for field in ("workers", "download_workers", "pull_workers"):
+        if field in data:
+            workers = data[field]
+            if not isinstance(workers, int) or isinstance(workers, bool) or workers < 1:
+                raise ProfileError(f"'{field}' debe ser un entero positivo.")
+            state[field] = workers
+
+    if "metadata_ttl" in data:
+        ttl = data["metadata_ttl"]
+        if not isinstance(ttl, int) or isinstance(ttl, bool) or ttl < 0:
+            raise ProfileError("'metadata_ttl' debe ser un entero >= 0 (segundos).")
+        state["metadata_ttl"] = ttl
+
+    if "pull_max_mbps" in data:
+        mbps = data["pull_max_mbps"]
+        if not isinstance(mbps, (int, float)) or isinstance(mbps, bool) or mbps < 0:
+            raise ProfileError("'pull_max_mbps' debe ser un numero >= 0 (MB/s, 0 = sin tope).")
+        state["pull_max_mbps"] = mbps
+
+    # model_digests: {"qwen3:0.6b": "sha256:..."} -> no se consulta el registro para esos modelos
+    if "model_digests" in data:
+        digests = data["model_digests"]
+        if not isinstance(digests, dict) or not all(isinstance(k, str) and isinstance(v, str) and v
+                                                    for k, v in digests.items()):
+            raise ProfileError("'model_digests' debe ser un objeto {\"modelo:tag\": \"sha256:...\"}.")
+        state["model_digests"] = dict(digests)
+
+    if "models_from" in data:
+        if not isinstance(data["models_from"], str) or not data["models_from"]:
+            raise ProfileError("'models_from' debe ser la ruta a un directorio o tarball de modelos.")
+        state["models_from"] = data["models_from"]
+
+    # pkg_cache: "/ruta" | {"dir": "/ruta", "max_mb": 4096}
+    if "pkg_cache" in data:
+        cache = data["pkg_cache"]
+        if isinstance(cache, str):
+            cache = {"dir": cache}
+        if not isinstance(cache, dict) or not isinstance(cache.get("dir"), str) or not cache["dir"]:
+            raise ProfileError("'pkg_cache' debe ser una ruta o un objeto {\"dir\": ..., \"max_mb\": ...}.")
+        extra_keys = set(cache) - {"dir", "max_mb"}
+        if extra_keys:
+            raise ProfileError(f"Claves desconocidas en 'pkg_cache': {', '.join(sorted(extra_keys))}")
+        max_mb = cache.get("max_mb", DEFAULT_MAX_MB)
+        if not isinstance(max_mb, int) or isinstance(max_mb, bool) or max_mb < 1:
+            raise ProfileError("'pkg_cache.max_mb' debe ser un entero positivo.")
+        state["pkg_cache"] = {"dir": cache["dir"], "max_mb": max_mb}
+
+    return state
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark de descargas: una conexion vs. segmentada, contra un servidor HTTP
+local que limita el ancho de banda POR CONEXION y agrega latencia (simula un
+enlace con mucho RTT, donde una sola conexion TCP no llena el ancho de banda).
+
+    python3 src/scripts/bench_download.py --size-mb 64 --rate-mbps 4 --latency-ms 150 --segments 1 2 4 8
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT))
+
+from src.download import download, format_transfer, segmented_download  # noqa: E402
+
+
+def make_handler(payload: bytes, rate: float, latency: float, ranges: bool):
+    class ThrottledHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            start, end = 0, len(payload) - 1
+            header = self.headers.get("Range")
+            if header and ranges:
+                first, _, last = header.split("=", 1)[1].partition("-")
+                start = int(first)
+                end = min(int(last), end) if last else end
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(payload)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+
+            # Limite por conexion: bloques de 64 KB espaciados segun 'rate'
+            block = 64 * 1024
+            pos = start
+            began = time.monotonic()
+            while pos <= end:
+                data = payload[pos:min(pos + block, end + 1)]
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                pos += len(data)
+                ahead = (pos - start) / rate - (time.monotonic() - began)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    return ThrottledHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de descargas segmentadas")
+    parser.add_argument("--size-mb", type=int, default=64, help="Tamaño del archivo (default: %(default)s)")
+    parser.add_argument("--rate-mbps", type=float, default=4.0,
+                        help="Limite por conexion en MB/s (default: %(default)s)")
+    parser.add_argument("--latency-ms", type=int, default=150, help="Latencia por peticion (default: %(default)s)")
+    parser.add_argument("--segments", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Cantidad de conexiones a probar (default: %(default)s)")
+    parser.add_argument("--no-ranges", action="store_true", help="El servidor ignora Range (prueba el fallback)")
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+    expected = hashlib.sha256(payload).hexdigest()
+    handler = make_handler(payload, args.rate_mbps * 1024 * 1024, args.latency_ms / 1000, not args.no_ranges)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/ollama-linux-amd64.tgz"
+
+    print(f"Archivo: {args.size_mb} MB | limite {args.rate_mbps} MB/s por conexion | latencia {args.latency_ms} ms")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for count in args.segments:
+                dest = Path(tmp) / f"bench-{count}"
+                stats = {}
+                if count == 1:
+                    download(url, dest, expected, stats=stats)
+                else:
+                    segmented_download(url, dest, expected, segments=count, stats=stats)
+                print(f"  segmentos={count:<3} {format_transfer(stats)}")
+                dest.unlink()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
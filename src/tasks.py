@@ -0,0 +1,151 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional
+
+# Estados posibles de una tarea al terminar el grafo
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"      # Alguna dependencia fallo o fue saltada
+STATUS_CANCELLED = "cancelled"  # El grafo se cancelo antes de arrancarla
+
+
+class Task:
+    def __init__(self, name: str, func: Callable[[], None], deps: Optional[List[str]] = None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps or [])
+
+
+class TaskGraph:
+    """
+    Grafo de tareas con dependencias explicitas.
+    Las tareas independientes corren en paralelo sobre un pool acotado;
+    si una falla, sus dependientes se marcan como saltadas.
+    """
+
+    def __init__(self, max_workers: int = 3, logger=None, fail_fast: bool = False):
+        self.max_workers = max(1, max_workers)
+        self.logger = logger
+        self.fail_fast = fail_fast
+        self.tasks: Dict[str, Task] = {}
+        self.status: Dict[str, str] = {}
+        self.errors: Dict[str, BaseException] = {}
+        self._cancel = threading.Event()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tasks
+
+    def add(self, name: str, func: Callable[[], None], deps: Optional[List[str]] = None):
+        if name in self.tasks:
+            raise ValueError(f"Tarea duplicada: {name}")
+        self.tasks[name] = Task(name, func, deps)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Evita que se lancen nuevas tareas. Las que ya corren terminan solas."""
+        self._cancel.set()
+
+    def _validate(self):
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep not in self.tasks:
+                    raise ValueError(f"Tarea '{task.name}' depende de '{dep}', que no existe.")
+
+        # Deteccion de ciclos (DFS con colores)
+        visiting, done = set(), set()
+
+        def visit(name, path):
+            if name in done: return
+            if name in visiting:
+                raise ValueError(f"Ciclo de dependencias: {' -> '.join(path + [name])}")
+            visiting.add(name)
+            for dep in self.tasks[name].deps:
+                visit(dep, path + [name])
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.tasks:
+            visit(name, [])
+
+    def _log_error(self, msg):
+        if self.logger: self.logger.error(msg)
+        else: print(f"[ERROR] {msg}")
+
+    def _execute(self, task: Task):
+        # Cada tarea queda medida como un span 'stage' si el logger traza
+        span = getattr(self.logger, "span", None)
+        if span is None:
+            return task.func()
+        with span(task.name, "stage"):
+            return task.func()
+
+    def run(self) -> Dict[str, str]:
+        """
+        Ejecuta el grafo completo y retorna {nombre: estado}.
+        Los errores de cada tarea quedan en self.errors.
+        """
+        self._validate()
+        pending = dict(self.tasks)
+        running = {}
+
+        def resolve_blocked():
+            # Propaga fallos/saltos a los dependientes (en cascada)
+            changed = True
+            while changed:
+                changed = False
+                for name, task in list(pending.items()):
+                    bad = [d for d in task.deps if self.status.get(d) in (STATUS_FAILED, STATUS_SKIPPED, STATUS_CANCELLED)]
+                    if bad:
+                        self.status[name] = STATUS_SKIPPED
+                        del pending[name]
+                        changed = True
+
+        def ready():
+            return [t for t in pending.values() if all(self.status.get(d) == STATUS_OK for d in t.deps)]
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="brainbash")
+        try:
+            while pending or running:
+                resolve_blocked()
+
+                if self.cancelled:
+                    for name in list(pending):
+                        self.status[name] = STATUS_CANCELLED
+                        del pending[name]
+                else:
+                    for task in ready():
+                        del pending[task.name]
+                        running[executor.submit(self._execute, task)] = task.name
+
+                if not running:
+                    # Nada corriendo y nada listo: lo pendiente queda bloqueado
+                    for name in list(pending):
+                        self.status[name] = STATUS_SKIPPED
+                        del pending[name]
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        self.status[name] = STATUS_OK
+                    except Exception as e:
+                        self.status[name] = STATUS_FAILED
+                        self.errors[name] = e
+                        self._log_error(f"Tarea '{name}' fallo: {e}")
+                        if self.fail_fast:
+                            self.cancel()
+        except KeyboardInterrupt:
+            # Ctrl+C: no lanzamos nada nuevo y esperamos a que terminen las activas
+            self.cancel()
+            for future in running:
+                future.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=True)
+
+        return self.status
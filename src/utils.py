@@ -1,6 +1,11 @@
 import subprocess
 import shutil
 import sys
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
 from typing import List, Tuple
 
 class Colors:
@@ -134,10 +139,89 @@ class TUI:
         # Retornamos solo los que quedaron en True
         return [tag for tag, is_on in selection_state.items() if is_on]
 
+class Tracer:
+    """
+    Registra spans (nombre, categoria, inicio, duracion) de etapas y subprocesos.
+    Se exporta como Chrome trace-event JSON (chrome://tracing o ui.perfetto.dev).
+    """
+
+    def __init__(self):
+        self._t0 = time.perf_counter()
+        self._events = []
+        self._tids = {}
+        self._lock = threading.Lock()
+
+    def _tid(self):
+        # IDs chicos y estables por hilo para que el visor los agrupe en filas
+        ident = threading.get_ident()
+        with self._lock:
+            if ident not in self._tids:
+                self._tids[ident] = len(self._tids) + 1
+            return self._tids[ident]
+
+    @contextmanager
+    def span(self, name: str, cat: str = "step", **args):
+        start = time.perf_counter()
+        tid = self._tid()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            end = time.perf_counter()
+            event = {
+                "name": name, "cat": cat, "ph": "X",
+                "ts": round((start - self._t0) * 1e6), "dur": round((end - start) * 1e6),
+                "pid": os.getpid(), "tid": tid,
+                "args": dict(args, status=status)
+            }
+            with self._lock:
+                self._events.append(event)
+
+    def run(self, cmd, **kwargs):
+        """subprocess.run con un span 'subprocess' alrededor."""
+        if isinstance(cmd, str):
+            label = cmd
+        else:
+            parts = [str(c) for c in cmd]
+            if parts and parts[0] == "sudo": parts = parts[1:]
+            label = " ".join(parts[:4])
+        if len(label) > 60: label = label[:57] + "..."
+        with self.span(f"$ {label}", "subprocess"):
+            return subprocess.run(cmd, **kwargs)
+
+    def export_chrome(self, path: str):
+        with self._lock:
+            events = list(self._events)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self, limit: int = 15) -> str:
+        """Tabla de tiempos agregada por (categoria, nombre), de mayor a menor total."""
+        with self._lock:
+            events = list(self._events)
+        totals = {}
+        for ev in events:
+            key = (ev["cat"], ev["name"])
+            count, total, worst = totals.get(key, (0, 0, 0))
+            totals[key] = (count + 1, total + ev["dur"], max(worst, ev["dur"]))
+
+        rows = sorted(totals.items(), key=lambda kv: kv[1][1], reverse=True)[:limit]
+        lines = [f"{'CATEGORIA':<11} {'NOMBRE':<42} {'N':>3} {'TOTAL(s)':>9} {'MAX(s)':>8}"]
+        for (cat, name), (count, total, worst) in rows:
+            name = name if len(name) <= 42 else name[:39] + "..."
+            lines.append(f"{cat:<11} {name:<42} {count:>3} {total / 1e6:>9.2f} {worst / 1e6:>8.2f}")
+        return "\n".join(lines)
+
 class Logger:
     def __init__(self, theme_color: str = Colors.BLUE, log_file: str = None):
         self.theme_color = theme_color
         self.log_file = log_file
+        # Las tareas del instalador pueden loguear desde varios hilos a la vez
+        self._lock = threading.Lock()
+        self.tracer = Tracer()
         
         # Initialize log file (overwrite)
         if self.log_file:
@@ -149,21 +233,22 @@ class Logger:
                 self.log_file = None
 
     def _log(self, prefix, msg, color=None, to_stdout=True):
-        # 1. Stdout
-        if to_stdout:
-            if color:
-                print(f"{color}{prefix}{Colors.RESET} {msg}")
-            else:
-                print(f"{prefix} {msg}")
-        
-        # 2. File
-        if self.log_file:
-            try:
-                # Remove ANSI colors for file
-                clean_msg = f"{prefix} {msg}\n"
-                with open(self.log_file, "a", encoding="utf-8") as f:
-                    f.write(clean_msg)
-            except: pass
+        with self._lock:
+            # 1. Stdout
+            if to_stdout:
+                if color:
+                    print(f"{color}{prefix}{Colors.RESET} {msg}")
+                else:
+                    print(f"{prefix} {msg}")
+            
+            # 2. File
+            if self.log_file:
+                try:
+                    # Remove ANSI colors for file
+                    clean_msg = f"{prefix} {msg}\n"
+                    with open(self.log_file, "a", encoding="utf-8") as f:
+                        f.write(clean_msg)
+                except: pass
 
     def info(self, msg): self._log("[INFO]", msg, self.theme_color)
     def success(self, msg): self._log("[OK]", msg, Colors.GREEN)
@@ -173,6 +258,10 @@ class Logger:
     def step(self, msg): 
         self._log(f"\n=== {msg} ===", "", self.theme_color + Colors.BOLD)
 
+    def span(self, name, cat="step", **args):
+        """Context manager para medir una etapa (ver Tracer)."""
+        return self.tracer.span(name, cat, **args)
+
     def verbose(self, msg):
         """Log only to file, not stdout (for streamlined operations)"""
         self._log("[VERBOSE]", msg, to_stdout=False)
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+from src import download
+from src.download import ChecksumError, DownloadError
+
+PAYLOAD = os.urandom(256 * 1024)
+PAYLOAD_SHA = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Sirve PAYLOAD con soporte de Range; el servidor decide cortes y 416."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        header = self.headers.get("Range")
+        with server.lock:
+            server.ranges.append(header)
+        data, start = server.payload, 0
+        end = len(data) - 1
+        if server.always_416:
+            header = header or "bytes=0-"
+        if header and server.ranges_ok:
+            first, _, last = header[len("bytes="):].partition("-")
+            start = int(first)
+            end = int(last) if last else len(data) - 1
+            if start >= len(data) or server.always_416:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        with server.lock:
+            # Corte simulado: se anuncia todo y se manda solo la mitad (una vez por segmento)
+            cut = server.truncate and end not in server.truncated and len(body) > 1
+            if cut:
+                server.truncated.add(end)
+        self.wfile.write(body[:len(body) // 2] if cut else body)
+
+
+class DownloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        self.server.payload = PAYLOAD
+        self.server.ranges_ok = True
+        self.server.always_416 = False
+        self.server.truncate = False
+        self.server.truncated = set()
+        self.server.ranges = []
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/blob"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dest = Path(self.tmp.name) / "blob"
+        self.part = self.dest.with_name("blob.part")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def fetch(self, **kwargs):
+        return download.download(self.url, self.dest, sleep=lambda s: None, **kwargs)
+
+
+class TestDownload(DownloadTestCase):
+
+    def test_resume_after_truncation(self):
+        self.server.truncate = True
+        self.assertEqual(self.fetch(sha256=PAYLOAD_SHA), PAYLOAD_SHA)
+        self.assertEqual(self.dest.read_bytes(), PAYLOAD)
+        self.assertFalse(self.part.exists())
+        # La reconexion pide solo lo que falta
+        self.assertEqual(self.server.ranges[-1], f"bytes={len(PAYLOAD) // 2}-")
+
+    def test_resume_from_existing_part(self):
+        self.part.write_bytes(PAYLOAD[:1000])
+        stats = {}
+        self.assertEqual(self.fetch(sha256=PAYLOAD_SHA, stats=stats), PAYLOAD_SHA)
+        self.assertEqual(self.server.ranges, ["bytes=1000-"])
+        self.assertEqual(stats["bytes"], len(PAYLOAD) - 1000)
+
+    def test_checksum_mismatch_discards_part(self):
+        with self.assertRaises(ChecksumError):
+            self.fetch(sha256="0" * 64)
+        self.assertFalse(self.part.exists())
+        self.assertFalse(self.dest.exists())
+
+    def test_stale_part_restarts(self):
+        # Un .part mas largo que el archivo remoto da 416: se descarta y se baja de cero
+        self.part.write_bytes(PAYLOAD + b"extra")
+        self.assertEqual(self.fetch(sha256=PAYLOAD_SHA), PAYLOAD_SHA)
+        self.assertEqual(self.server.ranges[-1], None)
+
+    def test_416_without_part(self):
+        # Sin .part no hay nada que descartar: error claro en vez de reintentar
+        self.server.always_416 = True
+        with self.assertRaises(DownloadError):
+            self.fetch()
+        self.assertEqual(self.server.ranges, [None])
+
+    def test_server_without_ranges(self):
+        # Sin Range el lector salta los bytes que ya estaban en el .part
+        self.server.ranges_ok = False
+        self.part.write_bytes(PAYLOAD[:1000])
+        self.assertEqual(self.fetch(sha256=PAYLOAD_SHA), PAYLOAD_SHA)
+        self.assertEqual(self.dest.read_bytes(), PAYLOAD)
+
+
+class TestSegmentedDownload(DownloadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(download, "MIN_SEGMENT", 16 * 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, **kwargs):
+        return download.segmented_download(self.url, self.dest, sleep=lambda s: None, segments=4, **kwargs)
+
+    def test_segments_reassemble(self):
+        stats = {}
+        self.assertEqual(self.fetch(sha256=PAYLOAD_SHA, stats=stats), PAYLOAD_SHA)
+        self.assertEqual(self.dest.read_bytes(), PAYLOAD)
+        self.assertEqual(stats["segments"], 4)
+        self.assertEqual(stats["bytes"], len(PAYLOAD))
+        self.assertEqual(sorted(p.name for p in self.dest.parent.iterdir()), ["blob"])
+
+    def test_truncated_segments_resume(self):
+        self.server.truncate = True
+        self.assertEqual(self.fetch(sha256=PAYLOAD_SHA), PAYLOAD_SHA)
+        self.assertEqual(self.dest.read_bytes(), PAYLOAD)
+
+    def test_checksum_mismatch_discards_segments(self):
+        with self.assertRaises(ChecksumError):
+            self.fetch(sha256="0" * 64)
+        self.assertEqual(list(self.dest.parent.iterdir()), [])
+
+    def test_falls_back_without_ranges(self):
+        self.server.ranges_ok = False
+        stats = {}
+        self.assertEqual(self.fetch(sha256=PAYLOAD_SHA, stats=stats), PAYLOAD_SHA)
+        self.assertEqual(stats["segments"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
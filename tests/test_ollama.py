@@ -0,0 +1,133 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from unittest import mock
+
+from src import ollama
+from src.ollama import BandwidthCap, OllamaClient, pull_models
+
+LAYER = 10 * 1000
+STEP = 1000
+
+
+class PullHandler(BaseHTTPRequestHandler):
+    """/api/pull falso: una capa de LAYER bytes en eventos de STEP; retoma donde quedo cada modelo."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        model = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["model"]
+        with server.lock:
+            server.requests.append(model)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        if model in server.failing:
+            self.wfile.write(json.dumps({"error": "pull model manifest: file does not exist"}).encode() + b"\n")
+            return
+        try:
+            # Como ollama: al retomar informa primero lo que ya tiene de la capa
+            if server.done.get(model):
+                self.send_event(model)
+            while server.done.get(model, 0) < LAYER:
+                with server.lock:
+                    server.done[model] = server.done.get(model, 0) + STEP
+                self.send_event(model)
+            self.wfile.write(b'{"status": "success"}\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente corto por el tope: lo enviado queda como descargado
+            pass
+
+    def send_event(self, model):
+        event = {"status": "pulling", "digest": f"sha256:{model}", "total": LAYER,
+                 "completed": self.server.done[model]}
+        self.wfile.write(json.dumps(event).encode() + b"\n")
+        self.wfile.flush()
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestBandwidthCap(unittest.TestCase):
+
+    def test_ahead(self):
+        clock = FakeClock()
+        cap = BandwidthCap(1000, clock)
+        cap.add(5000)
+        self.assertEqual(cap.ahead(), 5.0)
+        clock.now += 3
+        self.assertEqual(cap.ahead(), 2.0)
+        clock.now += 10
+        self.assertLess(cap.ahead(), 0)
+
+
+class TestPullModels(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PullHandler)
+        self.server.lock = threading.Lock()
+        self.server.done = {}
+        self.server.failing = set()
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = OllamaClient(f"http://127.0.0.1:{self.server.server_address[1]}")
+        self.sleeps = []
+        # El tope mide con un reloj falso que solo avanza con las pausas: sin esperas reales
+        self.clock = FakeClock()
+        patcher = mock.patch.object(ollama, "BandwidthCap", lambda rate: BandwidthCap(rate, self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.clock.now += seconds
+
+    def pull(self, models, **kwargs):
+        return pull_models(self.client, models, log=lambda msg: None, sleep=self.sleep, **kwargs)
+
+    def test_parallel_pulls(self):
+        results = self.pull(["a:1", "b:1"], workers=2)
+        self.assertEqual(set(results), {"a:1", "b:1"})
+        for result in results.values():
+            self.assertTrue(result["ok"])
+            # El primer evento marca el punto de partida: se cuenta lo recibido despues
+            self.assertEqual(result["bytes"], LAYER - STEP)
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(sorted(self.server.requests), ["a:1", "b:1"])
+
+    def test_cap_pauses_and_resumes(self):
+        # 1 KB/s con eventos de 1 KB: cada pull pasa el tope enseguida y se corta
+        results = self.pull(["a:1"], max_bytes_per_sec=STEP)
+        self.assertTrue(results["a:1"]["ok"])
+        self.assertEqual(results["a:1"]["bytes"], LAYER - STEP)
+        self.assertGreater(len(self.server.requests), 1)
+        self.assertEqual(len(self.sleeps), len(self.server.requests) - 1)
+        self.assertTrue(all(wait > 0 for wait in self.sleeps))
+        # Lo recibido nunca supera el tope mas el segundo de adelanto tolerado
+        self.assertLessEqual(results["a:1"]["bytes"], STEP * (sum(self.sleeps) + 2))
+        self.assertEqual(self.server.done["a:1"], LAYER)
+
+    def test_error_is_reported(self):
+        self.server.failing.add("missing:1")
+        results = self.pull(["missing:1", "a:1"])
+        self.assertFalse(results["missing:1"]["ok"])
+        self.assertIn("file does not exist", results["missing:1"]["error"])
+        self.assertTrue(results["a:1"]["ok"])
+
+
+if __name__ == "__main__":
+    unittest.main()